@@ -0,0 +1,88 @@
+import shutil
+import pytest
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.remote as rtr
+from remotetools.fake_server import FakeConnection
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = [1_000, 10_000, 100_000]
+SUBNET = "10.8.0.0/14"
+
+
+def make_peers(count: int) -> list[rtl.PeerRecord]:
+    allocator = rtl.IPAllocator(SUBNET)
+    return [
+        rtl.PeerRecord(f"User{i}", f"pubkey{i:040d}=", "Phone", f"user{i}@example.com",
+                       allocator.allocate(), "2024-12-02T23:30:00+00:00")
+        for i in range(count)
+    ]
+
+
+@pytest.fixture(scope="module", params=SIZES, ids=lambda n: f"{n}peers")
+def peer_csv(request, tmp_path_factory):
+    """A synthetic peers.csv with the parametrized number of rows."""
+    csv_path = tmp_path_factory.mktemp("peers") / "peers.csv"
+    rtl.save_peers_to_csv(make_peers(request.param), str(csv_path))
+    return csv_path
+
+
+def test_load_peers(benchmark, peer_csv):
+    peers = benchmark(rtl.load_peers, str(peer_csv))
+    assert peers
+
+
+def test_remove_peer_from_csv(benchmark, peer_csv, tmp_path):
+    work = tmp_path / "peers.csv"
+
+    def setup():
+        shutil.copyfile(peer_csv, work)
+
+    benchmark.pedantic(rtl.remove_peer_from_csv, args=("User0", "Phone", str(work)),
+                       setup=setup, rounds=5)
+
+
+def test_find_next_vpn_ip(benchmark, peer_csv):
+    peers = rtl.load_peers(str(peer_csv))
+    assert benchmark(rtl.find_next_vpn_ip, peers, SUBNET) is not None
+
+
+def test_find_peers_by_email(benchmark, peer_csv):
+    store = rtl.CsvPeerStore(str(peer_csv))
+    store.all()
+    page = benchmark(store.find, rtl.PeerFilter(email="user7@example.com"))
+    assert page.total == 1
+
+
+def test_generate_server_config(benchmark, peer_csv):
+    peers = rtl.load_peers(str(peer_csv))
+    config = benchmark(rtr.generate_server_config, peers, "server_private_key", SUBNET)
+    assert config.count("[Peer]") == len(peers)
+
+
+@pytest.mark.parametrize("count", [10, 100, 1_000], ids=lambda n: f"{n}interfaces")
+def test_get_public_interfaces(benchmark, count):
+    blocks = ["1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 state UNKNOWN\n    inet 127.0.0.1/8 scope host lo\n",
+              "2: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 state UP\n    inet 46.62.216.199/32 scope global eth0\n"]
+    blocks += [
+        f"{i + 3}: veth{i}@if{i}: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 state UP\n"
+        f"    inet 172.17.{i // 256}.{i % 256}/16 scope global veth{i}\n"
+        for i in range(count)
+    ]
+    assert benchmark(rtr.get_public_interfaces, "".join(blocks)) == (1, ["eth0"])
+
+
+def test_orchestration_add_peer(benchmark, peer_csv, tmp_path):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    shutil.copyfile(peer_csv, store.csv_path)
+    c = FakeConnection(host="bench.example.com")
+    rtr.invalidate_server_state()
+    names = iter(range(1_000_000))
+
+    def add():
+        return rto.add_peer(c, f"New{next(names)}", "Laptop", "new@example.com", subnet=SUBNET, store=store)
+
+    # The warmup round reads the server state and loads the peer index, which later rounds reuse
+    assert benchmark.pedantic(add, rounds=10, warmup_rounds=1) is not None
+    assert "[Peer]" in c.server.config
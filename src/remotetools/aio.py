@@ -0,0 +1,428 @@
+import asyncio
+import threading
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.remote as rtr
+import remotetools.tracing as rtt
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator
+
+# SFTP writes are grouped into blocks this size so asyncssh can pipeline them
+UPLOAD_BLOCK_SIZE = 256 * 1024
+
+
+def _blocks(chunks: Iterable[str]) -> Iterator[bytes]:
+    block = bytearray()
+    for chunk in chunks:
+        block += chunk.encode()
+        if len(block) >= UPLOAD_BLOCK_SIZE:
+            yield bytes(block)
+            block.clear()
+    if block:
+        yield bytes(block)
+
+
+async def upload_blocks(chunks: Iterable[str]) -> AsyncIterator[bytes]:
+    """Encode chunks into UPLOAD_BLOCK_SIZE blocks, producing each in a worker thread.
+
+    Rendered configs read the peer store as they go, so pulling them on the
+    event loop would stall it while the store waits on a lock or the disk.
+    """
+    blocks = _blocks(chunks)
+    while (block := await asyncio.to_thread(next, blocks, None)) is not None:
+        yield block
+
+
+def _asyncssh():
+    try:
+        import asyncssh
+    except ImportError:
+        raise ImportError("The async API needs asyncssh: pip install remotetools[async]") from None
+    return asyncssh
+
+
+@dataclass
+class Result:
+    """Output of one remote command, shaped like a fabric Result."""
+    stdout: str = ""
+    stderr: str = ""
+    exited: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.exited == 0
+
+
+class CommandError(Exception):
+    """A remote command exited non-zero."""
+
+    def __init__(self, command: str, result: Result):
+        self.result = result
+        super().__init__(f"{command!r} exited {result.exited}: {result.stderr.strip()}")
+
+
+class AsyncConnection:
+    """An asyncssh connection with fabric-like run and sudo, opened on first use.
+
+    Every command is recorded as a span. The SSH connection belongs to the event
+    loop that opened it; used from another loop, it is transparently reopened.
+    """
+
+    def __init__(self, host: str, user: str = "root", port: int = 22, **options):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.options = options
+        self._conn = None
+        self._loop = None
+        self._lock = None
+
+    async def _connection(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._lock, self._conn = loop, asyncio.Lock(), None
+        async with self._lock:
+            if self._conn is None:
+                self._conn = await _asyncssh().connect(self.host, port=self.port, username=self.user,
+                                                       **self.options)
+        return self._conn
+
+    async def run(self, command: str, warn: bool = False) -> Result:
+        """Run a command and return its Result, raising CommandError on failure unless warn=True."""
+        with rtt.command_span(command, self.host) as record:
+            record.bytes_sent = len(command)
+            conn = await self._connection()
+            process = await conn.run(command, check=False)
+            exit_status = process.exit_status
+            result = Result(process.stdout or "", process.stderr or "",
+                            exit_status if exit_status is not None else -1)
+            record.exit_status = result.exited
+            record.bytes_received = len(result.stdout) + len(result.stderr)
+            if not result.ok and not warn:
+                raise CommandError(command, result)
+            return result
+
+    async def sudo(self, command: str, warn: bool = False) -> Result:
+        """Run a command as root, through non-interactive sudo unless already logged in as root."""
+        return await self.run(command if self.user == "root" else f"sudo -n {command}", warn)
+
+    async def upload(self, path: str, chunks: Iterable[str]) -> int:
+        """Stream chunks to a new remote file with mode 0600 and return the bytes written."""
+        asyncssh = _asyncssh()
+        conn = await self._connection()
+        written = 0
+        async with conn.start_sftp_client() as sftp:
+            async with sftp.open(path, "wb", attrs=asyncssh.SFTPAttrs(permissions=0o600)) as f:
+                async for block in upload_blocks(chunks):
+                    await f.write(block)
+                    written += len(block)
+        return written
+
+    async def close(self):
+        """Close the SSH connection; the next command reopens it."""
+        conn, self._conn = self._conn, None
+        if conn is not None and self._loop is asyncio.get_running_loop():
+            conn.close()
+            await conn.wait_closed()
+
+
+_connections: dict[str, AsyncConnection] = {}
+
+
+def connect(host: str, user: str = "root", port: int = 22, **options) -> AsyncConnection:
+    """Return the shared connection for user@host:port, creating it on first use."""
+    key = f"{user}@{host}:{port}"
+    if key not in _connections:
+        _connections[key] = AsyncConnection(host, user, port, **options)
+    return _connections[key]
+
+
+async def close_all():
+    """Close every shared connection."""
+    connections = list(_connections.values())
+    _connections.clear()
+    await asyncio.gather(*(c.close() for c in connections), return_exceptions=True)
+
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def event_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared event loop, starting it in a daemon thread on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="remotetools-aio", daemon=True).start()
+    return _loop
+
+
+def run(coro: Awaitable):
+    """Run a coroutine on the shared event loop from synchronous code and wait for its result.
+
+    Shared connections stay open on that loop between calls.
+    """
+    loop = event_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run() called from the shared event loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def _discard(task: asyncio.Future):
+    """Cancel a task whose result is no longer needed, retrieving any exception it ended with."""
+    task.cancel()
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+
+async def gather(*aws: Awaitable, limit: int = 50) -> list:
+    """Await many coroutines, at most limit at a time, returning results or exceptions in order."""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def bounded(aw):
+        async with semaphore:
+            return await aw
+    return await asyncio.gather(*(bounded(aw) for aw in aws), return_exceptions=True)
+
+
+async def get_server_state(c: AsyncConnection, max_age: float = 60.0) -> rtr.ServerState:
+    """Return the cached server state, shared with the sync API; see remote.get_server_state."""
+    state, fresh = rtr.cached_server_state(c, max_age)
+    if fresh:
+        return state
+    if state is not None:
+        result = await c.run(rtr.FINGERPRINT_COMMAND, warn=True)
+        if rtr.revalidate_server_state(state, result.stdout if result.ok else None):
+            return state
+
+    result = await c.run(rtr.STATE_COMMAND, warn=True)
+    return rtr.cache_server_state(c, result.stdout)
+
+
+async def retrieve_server_public_key(c: AsyncConnection) -> str:
+    """Retrieve WireGuard server public key (cached)."""
+    return (await get_server_state(c)).public_key
+
+
+async def retrieve_server_private_key(c: AsyncConnection) -> str:
+    """Retrieve WireGuard server private key (cached)."""
+    return (await get_server_state(c)).private_key
+
+
+async def detect_interfaces(c: AsyncConnection) -> list[rtr.NetworkInterface]:
+    """Return all network interfaces on the server."""
+    result = await c.run(rtr.IP_ADDR_COMMAND)
+    return rtr.parse_interfaces(result.stdout)
+
+
+async def detect_network_interface(c: AsyncConnection) -> tuple[int, list[str]]:
+    """Detect public-facing network interface on the server."""
+    candidates = [interface.name for interface in await detect_interfaces(c) if interface.is_public]
+    return len(candidates), candidates
+
+
+async def generate_client_keypairs(c: AsyncConnection, count: int) -> list[tuple[str, str]]:
+    """Generate several WireGuard keypairs on the server in a single round-trip."""
+    if count <= 0:
+        return []
+    try:
+        result = await c.run(rtr.keypairs_command(count))
+    except CommandError as e:
+        raise RuntimeError(f"Failed to generate client keypairs: {e}")
+    return rtr.parse_keypairs(result.stdout, count)
+
+
+async def upload_config(c: AsyncConnection, config: str | Callable[[], Iterable[str]],
+                        remote_path: str = rtr.CONFIG_PATH) -> bool:
+    """Upload a config and atomically move it into place with mode 0600; see remote.upload_config."""
+    render = (lambda: [config]) if isinstance(config, str) else config
+
+    result = await c.sudo(f"sha256sum {remote_path}", warn=True)
+    if await asyncio.to_thread(rtr.unchanged, render, result.stdout if result.ok else ""):
+        return False
+
+    tmp_path = rtr.upload_tmp_path((await c.run(rtr.TMP_DIR_COMMAND)).stdout.strip(), remote_path)
+    with rtt.span("sftp upload", c.host, tmp_path) as record:
+        record.bytes_sent = await c.upload(tmp_path, render())
+    await c.sudo(rtr.install_command(tmp_path, remote_path))
+    return True
+
+
+@rtt.operation("deploy_config")
+async def deploy_config(c: AsyncConnection, csv_path: str | None = None, subnet: str | None = None,
+                        incremental: bool = False, store: rtl.PeerStore | None = None) -> bool:
+    """Rebuild and deploy server config from peer database; see orchestration.deploy_config."""
+    # 1. Read peers from the CSV file or store if given, else from the configured store,
+    #    refusing a subnet whose server Address would cut some of them off
+    if csv_path:
+        source = rtl.CsvPeerStore(csv_path)
+    else:
+        source = store or rtl.get_peer_store()
+    with rtt.span("check subnet"):
+        await asyncio.to_thread(lambda: rtl.check_subnet(source.iter(), subnet))
+
+    # 2. Get server private key and public interface (cached)
+    state = await get_server_state(c)
+    server_private_key = state.private_key
+    interface = state.interface or "eth0"
+
+    # 3. Render the server config lazily, streaming peers straight from storage
+    def render():
+        return rtr.iter_server_config(source.iter(), server_private_key, subnet, interface)
+
+    # 4. In incremental mode, remember the running [Interface] settings
+    if incremental:
+        result = await c.sudo(rtr.INTERFACE_SECTION_COMMAND, warn=True)
+        old_interface = rtr.interface_section(result.stdout) if result.ok else None
+
+    # 5. Upload wg0.conf; nothing to do if unchanged
+    if not await upload_config(c, render):
+        return False
+
+    # 6. Apply only peer changes to the live interface, unless [Interface] changed
+    new_interface = rtr.interface_section(rtr.generate_interface_section(server_private_key, subnet, interface))
+    if incremental and old_interface == new_interface:
+        result = await c.sudo("wg show wg0 dump", warn=True)
+        if result.ok:
+            running = rtr.parse_wg_dump(result.stdout)
+            desired = await asyncio.to_thread(lambda: {p.public_key: f"{p.vpn_ip}/32" for p in source.iter()})
+            for cmd in rtr.peer_update_commands(desired, running):
+                await c.sudo(cmd)
+            return True
+
+    # 7. Reload WireGuard
+    await c.sudo("systemctl restart wg-quick@wg0")
+    return True
+
+
+@rtt.operation("add_peer")
+async def add_peer(c: AsyncConnection, name: str, device: str, email: str,
+                   subnet: str | None = None, incremental: bool = False, local_keys: bool = True,
+                   store: rtl.PeerStore | None = None, profile: rtl.ClientProfile = rtl.FULL_TUNNEL,
+                   deploy: bool = True, expires_utc: str = "") -> str | None:
+    """Add a new peer to the VPN and return client config; see orchestration.add_peer.
+
+    Returns None if no VPN IP is free and raises ValueError if the peer already exists.
+    """
+    results = await add_peers(c, [(name, device, email)], subnet=subnet, incremental=incremental,
+                              local_keys=local_keys, store=store, profile=profile, deploy=deploy,
+                              expires_utc=expires_utc)
+    result = results[(name, device)]
+    if result.error == "No VPN IP available":
+        return None
+    if result.error:
+        raise ValueError(result.error)
+    return result.config
+
+
+@rtt.operation("remove_peer")
+async def remove_peer(c: AsyncConnection, name: str, device: str, subnet: str | None = None,
+                      incremental: bool = False, store: rtl.PeerStore | None = None, deploy: bool = True) -> bool:
+    """Remove a peer from the VPN."""
+    results = await remove_peers(c, [(name, device)], subnet=subnet, incremental=incremental,
+                                 store=store, deploy=deploy)
+    return results[(name, device)]
+
+
+@rtt.operation("add_peers")
+async def add_peers(c: AsyncConnection, peers: list[tuple[str, str, str]],
+                    subnet: str | None = None, incremental: bool = False,
+                    local_keys: bool = True, store: rtl.PeerStore | None = None,
+                    profile: rtl.ClientProfile = rtl.FULL_TUNNEL, deploy: bool = True,
+                    expires_utc: str = "") -> dict[tuple[str, str], rto.PeerResult]:
+    """Add several (name, device, email) peers with a single deploy; see orchestration.add_peers.
+
+    Peer store calls, which may wait on file locks or fsync, run in a worker
+    thread so they don't hold up other operations on the event loop.
+    """
+    expires_utc = rtl.utc_timestamp(expires_utc)
+    results = {}
+    target = store or rtl.get_peer_store()
+
+    # 1. Note the store version, then validate and allocate an IP for each new peer
+    def allocate() -> tuple[object, list[tuple[str, str, str, str]]]:
+        return target.version(), rto._allocate(peers, target, subnet, results)
+
+    with rtt.span("allocate ips"):
+        version, accepted = await asyncio.to_thread(allocate)
+    if not accepted:
+        return results
+
+    # 2. Generate all client keypairs, fetching the server key meanwhile
+    server_key = asyncio.ensure_future(retrieve_server_public_key(c))
+    try:
+        if local_keys:
+            with rtt.span("generate keypairs"):
+                keypairs = [rtl.generate_wireguard_keypair() for _ in accepted]
+        else:
+            keypairs = await generate_client_keypairs(c, len(accepted))
+
+        # 3. Build PeerInfo for every accepted peer
+        created_utc = datetime.now(timezone.utc).isoformat()
+        peer_infos = [
+            rtl.PeerInfo(name, private_key, public_key, device, email, ip, created_utc, expires_utc)
+            for (name, device, email, ip), (private_key, public_key) in zip(accepted, keypairs)
+        ]
+
+        # 4. Save all records in one write under the store lock, allocating again if
+        #    another writer got in since step 1
+        def save(peer_infos: list[rtl.PeerInfo]) -> list[rtl.PeerInfo]:
+            with target.locked():
+                if target.version() != version:
+                    by_key = {(pi.name, pi.device): pi for pi in peer_infos}
+                    reallocated = rto._allocate([(pi.name, pi.device, pi.email) for pi in peer_infos],
+                                                target, subnet, results)
+                    peer_infos = []
+                    for name, device, email, ip in reallocated:
+                        by_key[(name, device)].vpn_ip = ip
+                        peer_infos.append(by_key[(name, device)])
+                target.add_many([rtl.PeerRecord.from_peer_info(pi) for pi in peer_infos])
+            return peer_infos
+
+        try:
+            with rtt.span("save peers"):
+                peer_infos = await asyncio.to_thread(save, peer_infos)
+        except ValueError as e:
+            for pi in peer_infos:
+                results[(pi.name, pi.device)] = rto.PeerResult(error=str(e))
+            peer_infos = []
+    except BaseException:
+        _discard(server_key)
+        raise
+    if not peer_infos:
+        _discard(server_key)
+        return results
+
+    # 5. Generate client configs
+    server_key = await server_key
+    for pi in peer_infos:
+        config = rtl.generate_client_config(pi, server_key, f"{c.host}:51820", profile)
+        results[(pi.name, pi.device)] = rto.PeerResult(peer_info=pi, config=config)
+
+    # 6. Deploy updated server config once
+    if deploy:
+        await deploy_config(c, subnet=subnet, incremental=incremental, store=store)
+
+    return results
+
+
+@rtt.operation("remove_peers")
+async def remove_peers(c: AsyncConnection, peers: list[tuple[str, str]],
+                       subnet: str | None = None, incremental: bool = False,
+                       store: rtl.PeerStore | None = None, deploy: bool = True) -> dict[tuple[str, str], bool]:
+    """Remove several (name, device) peers with a single deploy."""
+    # 1. Delete all peers from storage in one write
+    with rtt.span("remove peers"):
+        found = await asyncio.to_thread((store or rtl.get_peer_store()).remove_many, peers)
+    results = dict(zip(peers, found))
+
+    # 2. Rebuild and deploy server config once if anything changed
+    if deploy and any(found):
+        await deploy_config(c, subnet=subnet, incremental=incremental, store=store)
+
+    return results
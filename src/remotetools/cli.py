@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import sys
+import remotetools.local as rtl
+from dataclasses import asdict
+from pathlib import Path
+
+# Local commands (list, allocate, export) must not import fabric, paramiko or
+# cryptography; remote commands import them on first use.
+
+SQLITE_SUFFIXES = {".db", ".sqlite", ".sqlite3"}
+LIST_COLUMNS = ["name", "device", "email", "vpn_ip", "created_utc", "expires_utc"]
+
+
+def open_store(path: str) -> rtl.PeerStore:
+    """Open a SQLite store for .db/.sqlite paths and a CSV store otherwise."""
+    if Path(path).suffix in SQLITE_SUFFIXES:
+        return rtl.SqlitePeerStore(path)
+    return rtl.CsvPeerStore(path)
+
+
+def _connect(args: argparse.Namespace):
+    from fabric import Connection
+    return Connection(host=args.host, user=args.user, port=args.port)
+
+
+def cmd_list(args: argparse.Namespace) -> int:
+    """Print stored peers as a table or JSON lines."""
+    peer_filter = rtl.PeerFilter(email=args.email, device=args.device, expires_before=args.expires_before)
+    page = args.store.find(peer_filter, offset=args.offset, limit=args.limit)
+    if args.json:
+        for record in page.records:
+            print(json.dumps(asdict(record)))
+        return 0
+    rows = [LIST_COLUMNS] + [[getattr(record, column) for column in LIST_COLUMNS] for record in page.records]
+    widths = [max(len(row[i]) for row in rows) for i in range(len(LIST_COLUMNS))]
+    for row in rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+    if page.has_more:
+        print(f"... {page.total - page.offset - len(page.records)} more, use --offset {page.offset + len(page.records)}")
+    return 0
+
+
+def cmd_allocate(args: argparse.Namespace) -> int:
+    """Print the next free VPN IPs without reserving them."""
+    ips = args.store.free_ips(args.count)
+    for ip in ips:
+        print(ip)
+    if len(ips) < args.count:
+        print(f"myvpn: no free IP in {rtl.get_vpn_subnet()}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    """Bundle saved client configs into one zip archive, with QR codes if asked."""
+    import zipfile
+
+    paths = sorted(Path(args.configs).glob("*.conf"))
+    if not paths:
+        print(f"myvpn: no .conf files in {args.configs}", file=sys.stderr)
+        return 1
+    with zipfile.ZipFile(args.archive, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for path in paths:
+            config = path.read_text()
+            archive.writestr(path.name, config)
+            if args.qr:
+                from remotetools.export import render_qr
+                archive.writestr(path.with_suffix(".png").name, render_qr(config), compress_type=zipfile.ZIP_STORED)
+    print(f"wrote {len(paths)} configs to {args.archive}")
+    return 0
+
+
+def cmd_add(args: argparse.Namespace) -> int:
+    """Add a peer, deploy, and save its client config."""
+    import remotetools.orchestration as rto
+
+    expires_utc = ""
+    if args.expires_in_days:
+        from remotetools.expiry import expires_in
+        expires_utc = expires_in(days=args.expires_in_days)
+    profile = rtl.split_tunnel() if args.split_tunnel else rtl.FULL_TUNNEL
+    config = rto.add_peer(_connect(args), args.name, args.device, args.email, incremental=args.incremental,
+                          store=args.store, profile=profile, expires_utc=expires_utc, helper=args.helper)
+    if config is None:
+        print(f"myvpn: no free IP in {rtl.get_vpn_subnet()}", file=sys.stderr)
+        return 1
+    print(rtl.save_client_config(config, args.name, args.device, args.output_dir))
+    return 0
+
+
+def cmd_remove(args: argparse.Namespace) -> int:
+    """Remove a peer and deploy."""
+    import remotetools.orchestration as rto
+
+    if not rto.remove_peer(_connect(args), args.name, args.device, incremental=args.incremental,
+                           store=args.store, helper=args.helper):
+        print(f"myvpn: no peer {args.name}/{args.device}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def cmd_deploy(args: argparse.Namespace) -> int:
+    """Rebuild and deploy the server config."""
+    import remotetools.orchestration as rto
+
+    changed = rto.deploy_config(_connect(args), incremental=args.incremental, store=args.store,
+                                helper=args.helper)
+    print("deployed" if changed else "unchanged")
+    return 0
+
+
+def cmd_status(args: argparse.Namespace) -> int:
+    """Show the server's keys and interface and whether it matches the store."""
+    import remotetools.reconcile as rtc
+    import remotetools.remote as rtr
+
+    c = _connect(args)
+    state = rtr.get_server_state(c)
+    drift = rtc.check_drift(c, args.store)
+    print(f"host:        {c.host}")
+    print(f"public key:  {state.public_key}")
+    print(f"interface:   {state.interface or 'unknown'}")
+    print(f"listen port: {state.listen_port or 'down'}")
+    print(f"peers:       {args.store.count()} stored")
+    if drift.in_sync:
+        print("drift:       in sync")
+        return 0
+    print(f"drift:       {len(drift.missing)} missing, {len(drift.orphans)} orphans, "
+          f"{len(drift.ip_mismatches)} IP and {len(drift.key_mismatches)} key mismatches, "
+          f"{len(drift.unapplied)} not applied")
+    return 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="myvpn", description="Manage WireGuard peers.")
+    parser.add_argument("--store", default=os.environ.get("MYVPN_STORE", "peers.csv"),
+                        help="peers.csv or a .db SQLite store (default: $MYVPN_STORE or peers.csv)")
+    parser.add_argument("--subnet", default=os.environ.get("MYVPN_SUBNET", rtl.VPN_SUBNET),
+                        help=f"VPN subnet of the store's peers (default: $MYVPN_SUBNET or {rtl.VPN_SUBNET})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    remote = argparse.ArgumentParser(add_help=False)
+    remote.add_argument("--host", default=os.environ.get("MYVPN_HOST"), required="MYVPN_HOST" not in os.environ,
+                        help="server to manage (default: $MYVPN_HOST)")
+    remote.add_argument("--user", default="root")
+    remote.add_argument("--port", type=int, default=22)
+    remote.add_argument("--incremental", action="store_true", help="apply peer changes without a restart")
+    remote.add_argument("--helper", action="store_true", help="use the server-side helper, one round trip per change")
+
+    list_ = commands.add_parser("list", help="list peers")
+    list_.add_argument("--email")
+    list_.add_argument("--device")
+    list_.add_argument("--expires-before", help="only peers expiring before this UTC time")
+    list_.add_argument("--offset", type=int, default=0)
+    list_.add_argument("--limit", type=int)
+    list_.add_argument("--json", action="store_true", help="one JSON object per line")
+    list_.set_defaults(func=cmd_list)
+
+    allocate = commands.add_parser("allocate", help="show the next free VPN IPs")
+    allocate.add_argument("--count", type=int, default=1)
+    allocate.set_defaults(func=cmd_allocate)
+
+    export = commands.add_parser("export", help="zip saved client configs")
+    export.add_argument("archive")
+    export.add_argument("--configs", default=".", help="directory of .conf files (default: .)")
+    export.add_argument("--qr", action="store_true", help="add a PNG QR code per config")
+    export.set_defaults(func=cmd_export)
+
+    add = commands.add_parser("add", parents=[remote], help="add a peer and deploy")
+    add.add_argument("name")
+    add.add_argument("device")
+    add.add_argument("email")
+    add.add_argument("--split-tunnel", action="store_true", help="route only the VPN subnet")
+    add.add_argument("--expires-in-days", type=float)
+    add.add_argument("--output-dir", default=".", help="where to save the client config")
+    add.set_defaults(func=cmd_add)
+
+    remove = commands.add_parser("remove", parents=[remote], help="remove a peer and deploy")
+    remove.add_argument("name")
+    remove.add_argument("device")
+    remove.set_defaults(func=cmd_remove)
+
+    deploy = commands.add_parser("deploy", parents=[remote], help="rebuild and deploy the server config")
+    deploy.set_defaults(func=cmd_deploy)
+
+    status = commands.add_parser("status", parents=[remote], help="show server state and drift")
+    status.set_defaults(func=cmd_status)
+    return parser
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    args.store = open_store(args.store)
+    try:
+        rtl.set_vpn_subnet(args.subnet)
+        return args.func(args)
+    except Exception as e:
+        print(f"myvpn: {type(e).__name__}: {e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import logging
+import threading
+import remotetools.fleet as rtf
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.tracing as rtt
+from datetime import datetime, timedelta, timezone
+from fabric.connection import Connection
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+
+def utc_now() -> str:
+    """Return the current time in the format used for created_utc and expires_utc."""
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def expires_in(**delta) -> str:
+    """Return an expires_utc value the given timedelta from now, e.g. expires_in(days=30)."""
+    return (datetime.now(timezone.utc) + timedelta(**delta)).isoformat(timespec="seconds")
+
+
+def expired_peers(store: rtl.PeerStore | None = None, now: str | None = None) -> list[rtl.PeerRecord]:
+    """Return peers whose expiry has passed, soonest expired first."""
+    store = store or rtl.get_peer_store()
+    return store.find(rtl.PeerFilter(expires_before=now or utc_now())).records
+
+
+@rtt.operation("reap_expired")
+def reap_expired(c: Connection, store: rtl.PeerStore | None = None, now: str | None = None,
+                 dry_run: bool = False, subnet: str | None = None,
+                 incremental: bool = False) -> list[rtl.PeerRecord]:
+    """Remove every expired peer in one write and one deploy, and return them.
+
+    With dry_run=True nothing is removed or deployed; the peers that would be
+    are returned.
+    """
+    if dry_run:
+        return expired_peers(store, now)
+    return rto.remove_peers_where(c, rtl.PeerFilter(expires_before=now or utc_now()),
+                                  subnet=subnet, incremental=incremental, store=store)
+
+
+def reap_fleet(fleet: rtf.Fleet, now: str | None = None, dry_run: bool = False,
+               **kwargs) -> dict[str, object]:
+    """Reap every server in a fleet concurrently, one deploy per affected server.
+
+    Returns the expired peers, or the exception raised, per host.
+    """
+    now = now or utc_now()
+    return fleet.run(lambda server: reap_expired(server.connection, server.store, now, dry_run,
+                                                 subnet=server.subnet, **kwargs))
+
+
+def reap_periodically(reap: Callable[[], object], interval: float = 3600.0,
+                      stop: threading.Event | None = None):
+    """Call reap every interval seconds until stop is set, logging failures and carrying on."""
+    stop = stop or threading.Event()
+    while not stop.is_set():
+        try:
+            reap()
+        except Exception as e:
+            logger.warning("expiry reaper failed: %s", e)
+        stop.wait(interval)
@@ -0,0 +1,87 @@
+import io
+import os
+import time
+import zipfile
+import remotetools.local as rtl
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import BinaryIO, Callable, Iterable, Iterator
+
+
+@dataclass
+class ExportStats:
+    """What an export wrote and how long it took."""
+    configs: int = 0
+    qr_codes: int = 0
+    bytes_written: int = 0
+    seconds: float = 0.0
+
+    @property
+    def configs_per_second(self) -> float:
+        return self.configs / self.seconds if self.seconds else 0.0
+
+
+def render_qr(client_config: str) -> bytes:
+    """Render a client config as a PNG QR code for the WireGuard mobile apps."""
+    try:
+        import qrcode
+    except ImportError as e:
+        raise ImportError("QR codes need the qrcode package: pip install 'remotetools[qr]'") from e
+    buffer = io.BytesIO()
+    qrcode.make(client_config).save(buffer)
+    return buffer.getvalue()
+
+
+def export_configs(peers: Iterable[rtl.PeerInfo], server_public_key: str, server_endpoint: str,
+                   output: str | BinaryIO,
+                   profile: rtl.ClientProfile | Callable[[rtl.PeerInfo], rtl.ClientProfile] = rtl.FULL_TUNNEL,
+                   qr: bool = False, max_workers: int | None = None) -> ExportStats:
+    """Render client configs and stream them into one zip archive.
+
+    Each peer gets `<name>_<device>.conf`, plus `<name>_<device>.png` when qr is
+    set. profile is either one ClientProfile for everyone or a function choosing
+    one per peer. Configs are cheap to render and are built in this process;
+    QR codes are CPU-bound pure Python, so they are drawn in parallel by a pool
+    of max_workers processes (one per CPU by default). Only a few configs are
+    held in memory at a time, and output may be a path or any writable binary
+    stream.
+    """
+    profile_for = profile if callable(profile) else (lambda peer: profile)
+
+    def render() -> Iterator[tuple[str, str]]:
+        for peer in peers:
+            yield f"{peer.name}_{peer.device}", rtl.generate_client_config(peer, server_public_key, server_endpoint,
+                                                                            profile_for(peer))
+
+    stats = ExportStats()
+    start = time.perf_counter()
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        def write(stem: str, config: str, png: bytes | None = None):
+            data = config.encode()
+            archive.writestr(f"{stem}.conf", data)
+            stats.configs += 1
+            stats.bytes_written += len(data)
+            if png is not None:
+                # PNGs are already compressed
+                archive.writestr(f"{stem}.png", png, compress_type=zipfile.ZIP_STORED)
+                stats.qr_codes += 1
+                stats.bytes_written += len(png)
+
+        if not qr:
+            for stem, config in render():
+                write(stem, config)
+        else:
+            workers = max_workers or os.cpu_count() or 1
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for stem, config in render():
+                    pending.append((stem, config, pool.submit(render_qr, config)))
+                    if len(pending) >= workers * 4:
+                        stem, config, png = pending.popleft()
+                        write(stem, config, png.result())
+                while pending:
+                    stem, config, png = pending.popleft()
+                    write(stem, config, png.result())
+    stats.seconds = time.perf_counter() - start
+    return stats
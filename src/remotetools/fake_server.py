@@ -0,0 +1,445 @@
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+import remotetools.local as rtl
+import remotetools.remote as rtr
+import remotetools.wg_helper as rth
+from dataclasses import dataclass
+from invoke.exceptions import UnexpectedExit
+from invoke.runners import Result
+
+PRIVATE_KEY_PATH = "/etc/wireguard/private.key"
+PUBLIC_KEY_PATH = "/etc/wireguard/public.key"
+
+
+class FakeNetworkError(OSError):
+    """A simulated dropped SSH connection."""
+
+
+@dataclass
+class FakePeer:
+    """A peer on the fake running WireGuard interface."""
+    allowed_ips: str
+    endpoint: str = "(none)"
+    latest_handshake: int = 0
+    rx_bytes: int = 0
+    tx_bytes: int = 0
+
+
+def default_interfaces() -> list[rtr.NetworkInterface]:
+    """Loopback and one public ethernet interface."""
+    return [
+        rtr.NetworkInterface("lo", "UNKNOWN", 65536, ["LOOPBACK", "UP", "LOWER_UP"]),
+        rtr.NetworkInterface("eth0", "UP", 1500, ["BROADCAST", "MULTICAST", "UP", "LOWER_UP"],
+                             ["93.184.216.34"]),
+    ]
+
+
+class FakeServer:
+    """In-memory WireGuard server: a filesystem, network interfaces and a running wg0.
+
+    execute() answers the shell commands remotetools sends, so the real
+    orchestration code can run against it unchanged. Several FakeConnections
+    may share one server.
+    """
+
+    def __init__(self, interfaces: list[rtr.NetworkInterface] | None = None, ip_json: bool = True):
+        self.interfaces = interfaces if interfaces is not None else default_interfaces()
+        self.ip_json = ip_json
+        self.files: dict[str, bytes] = {}
+        self.modes: dict[str, int] = {}
+        self.inodes: dict[str, int] = {}
+        self.mtimes: dict[str, int] = {}
+        self.dirs: dict[str, int] = {}
+        self.up = False
+        self.listen_port: int | None = None
+        self.peers: dict[str, FakePeer] = {}
+        self.restarts = 0
+        self._clock = 1700000000
+        self._next_inode = 1000
+        self._lock = threading.RLock()
+        self._stdin = ""
+        self._handlers = [
+            (re.escape(rtr.STATE_COMMAND), self._state),
+            (re.escape(rtr.FINGERPRINT_COMMAND), self._stat_keys),
+            (re.escape(rtr.IP_ADDR_COMMAND), self._ip_addr),
+            (r"ip -j addr", self._ip_json),
+            (r"ip a", self._ip_text),
+            (re.escape(rtr.INTERFACE_SECTION_COMMAND), self._interface_section),
+            (re.escape(rtr.TMP_DIR_COMMAND), self._mktemp),
+            (r"wg genkey", self._genkey),
+            (r"echo -n '(\S*)' \| wg pubkey", self._pubkey),
+            (r"for i in \$\(seq (\d+)\); do k=\$\(wg genkey\); .*; done", self._keypairs),
+            (r"sh -c 'umask 077; wg genkey \| tee (\S+) \| wg pubkey > (\S+)'", self._rotate_keys),
+            (r"sha256sum (\S+)", self._sha256sum),
+            (r"sh -c 'install -m (\d+) -o root -g root (\S+) (\S+) && mv \S+ (\S+); "
+             r"status=\$\?; rm -f \S+; rmdir (\S+); exit \$status'", self._install),
+            (r"sh -c 'cat (\S+); echo (\S+); wg show (\w+) dump'", self._config_and_dump),
+            (r"cat (\S+)", self._cat),
+            (r"wg show all dump", self._dump_all),
+            (r"wg show (\w+) dump", self._dump),
+            (r"wg show (\w+) listen-port", self._listen_port),
+            (r"wg set (\w+) (.+)", self._wg_set),
+            (r"systemctl restart wg-quick@(\w+)", self._restart),
+            (r"python3 (\S+)", self._python),
+            (r"sudo -n (.+)", self._sudo),
+        ]
+        self.generate_keys()
+
+    # Filesystem
+
+    def write(self, path: str, data: bytes | str, mode: int = 0o644):
+        """Create or replace a file, giving it a new inode and mtime."""
+        with self._lock:
+            self.files[path] = data.encode() if isinstance(data, str) else data
+            self.modes[path] = mode
+            self._clock += 1
+            self._next_inode += 1
+            self.mtimes[path] = self._clock
+            self.inodes[path] = self._next_inode
+
+    def read(self, path: str) -> str:
+        """Return a file's text."""
+        return self.files[path].decode()
+
+    def remove(self, path: str):
+        """Delete a file if it exists."""
+        with self._lock:
+            for table in (self.files, self.modes, self.inodes, self.mtimes):
+                table.pop(path, None)
+
+    def generate_keys(self) -> str:
+        """Write a new server keypair to /etc/wireguard and return the public key."""
+        private_key, public_key = rtl.generate_wireguard_keypair()
+        self.write(PRIVATE_KEY_PATH, private_key + "\n", 0o600)
+        self.write(PUBLIC_KEY_PATH, public_key + "\n", 0o600)
+        return public_key
+
+    @property
+    def public_key(self) -> str:
+        return self.read(PUBLIC_KEY_PATH).strip()
+
+    @property
+    def private_key(self) -> str:
+        return self.read(PRIVATE_KEY_PATH).strip()
+
+    @property
+    def config(self) -> str:
+        """The current wg0.conf, or "" if none was deployed."""
+        return self.read(rtr.CONFIG_PATH) if rtr.CONFIG_PATH in self.files else ""
+
+    def add_traffic(self, public_key: str, rx_bytes: int = 0, tx_bytes: int = 0,
+                    handshake: int | None = None, endpoint: str | None = None):
+        """Simulate traffic from a running peer, e.g. for telemetry tests."""
+        with self._lock:
+            peer = self.peers[public_key]
+            peer.rx_bytes += rx_bytes
+            peer.tx_bytes += tx_bytes
+            peer.latest_handshake = handshake if handshake is not None else int(time.time())
+            if endpoint:
+                peer.endpoint = endpoint
+
+    # Commands
+
+    def execute(self, command: str, stdin: str = "") -> tuple[int, str, str]:
+        """Run one command with the given input and return (exit status, stdout, stderr)."""
+        with self._lock:
+            self._stdin = stdin
+            for pattern, handler in self._handlers:
+                match = re.fullmatch(pattern, command.strip(), re.DOTALL)
+                if match:
+                    return handler(*match.groups())
+        return 127, "", f"sh: {command.split()[0] if command.split() else ''}: command not found\n"
+
+    def _sudo(self, command):
+        return self.execute(command, self._stdin)
+
+    def _missing(self, tool: str, path: str) -> tuple[int, str, str]:
+        return 1, "", f"{tool}: {path}: No such file or directory\n"
+
+    def _cat(self, path):
+        if path not in self.files:
+            return self._missing("cat", path)
+        return 0, self.read(path), ""
+
+    def _stat_keys(self):
+        lines = [f"{path} {self.mtimes[path]} {len(self.files[path])} {self.inodes[path]}"
+                 for path in (PRIVATE_KEY_PATH, PUBLIC_KEY_PATH) if path in self.files]
+        status = 0 if len(lines) == 2 else 1
+        return status, "".join(line + "\n" for line in lines), ""
+
+    def _ip_json(self):
+        if not self.ip_json:
+            return 255, "", 'Option "-j" is unknown, try "ip -help".\n'
+        links = []
+        for index, interface in enumerate(self.interfaces, 1):
+            addr_info = [{"family": "inet", "local": ip, "prefixlen": 32, "scope": "global"} for ip in interface.ipv4]
+            addr_info += [{"family": "inet6", "local": ip, "prefixlen": 64, "scope": "global"} for ip in interface.ipv6]
+            links.append({"ifindex": index, "ifname": interface.name, "flags": interface.flags,
+                          "mtu": interface.mtu, "operstate": interface.state, "addr_info": addr_info})
+        return 0, json.dumps(links), ""
+
+    def _ip_text(self):
+        lines = []
+        for index, interface in enumerate(self.interfaces, 1):
+            lines.append(f"{index}: {interface.name}: <{','.join(interface.flags)}> mtu {interface.mtu} "
+                         f"state {interface.state}")
+            lines += [f"    inet {ip}/32 scope global {interface.name}" for ip in interface.ipv4]
+            lines += [f"    inet6 {ip}/64 scope global" for ip in interface.ipv6]
+        return 0, "\n".join(lines) + "\n", ""
+
+    def _ip_addr(self):
+        status, stdout, stderr = self._ip_json()
+        return (status, stdout, stderr) if status == 0 else self._ip_text()
+
+    def _listen_port(self, interface):
+        if interface != "wg0" or not self.up:
+            return 1, "", "Unable to access interface: No such device\n"
+        return 0, f"{self.listen_port or 0}\n", ""
+
+    def _state(self):
+        outputs = [
+            self._stat_keys()[1],
+            self._cat(PRIVATE_KEY_PATH)[1],
+            self._cat(PUBLIC_KEY_PATH)[1],
+            self._ip_addr()[1],
+            self._listen_port("wg0")[1],
+        ]
+        return 0, f"{rtr.STATE_SEPARATOR}\n".join(outputs), ""
+
+    def _interface_section(self):
+        if rtr.CONFIG_PATH not in self.files:
+            return 2, "", f"sed: can't read {rtr.CONFIG_PATH}: No such file or directory\n"
+        return 0, self.config.split("[Peer]", 1)[0], ""
+
+    def _genkey(self):
+        return 0, rtl.generate_wireguard_keypair()[0] + "\n", ""
+
+    def _pubkey(self, private_key):
+        try:
+            return 0, rtl.derive_public_key(private_key) + "\n", ""
+        except ValueError:
+            return 1, "", "wg: Key is not the correct length or format\n"
+
+    def _keypairs(self, count):
+        lines = [" ".join(rtl.generate_wireguard_keypair()) for _ in range(int(count))]
+        return 0, "".join(line + "\n" for line in lines), ""
+
+    def _rotate_keys(self, private_path, public_path):
+        private_key, public_key = rtl.generate_wireguard_keypair()
+        self.write(private_path, private_key + "\n", 0o600)
+        self.write(public_path, public_key + "\n", 0o600)
+        return 0, private_key + "\n", ""
+
+    def _sha256sum(self, path):
+        if path not in self.files:
+            return self._missing("sha256sum", path)
+        return 0, f"{hashlib.sha256(self.files[path]).hexdigest()}  {path}\n", ""
+
+    def _mktemp(self):
+        with self._lock:
+            self._next_inode += 1
+            path = f"/tmp/tmp.{self._next_inode}"
+            self.dirs[path] = 0o700
+        return 0, path + "\n", ""
+
+    def _install(self, mode, tmp_path, staged_path, path, tmp_dir):
+        if tmp_path not in self.files:
+            self.dirs.pop(tmp_dir, None)
+            return self._missing("install", tmp_path)
+        self.write(path, self.files[tmp_path], int(mode, 8))
+        self.remove(tmp_path)
+        self.dirs.pop(tmp_dir, None)
+        return 0, "", ""
+
+    def _dump_lines(self):
+        lines = [f"{self.private_key}\t{self.public_key}\t{self.listen_port or 0}\toff"]
+        for public_key, peer in self.peers.items():
+            lines.append(f"{public_key}\t(none)\t{peer.endpoint}\t{peer.allowed_ips}\t"
+                         f"{peer.latest_handshake}\t{peer.rx_bytes}\t{peer.tx_bytes}\toff")
+        return lines
+
+    def _dump(self, interface):
+        if interface != "wg0" or not self.up:
+            return 1, "", "Unable to access interface: No such device\n"
+        return 0, "\n".join(self._dump_lines()) + "\n", ""
+
+    def _dump_all(self):
+        if not self.up:
+            return 0, "", ""
+        return 0, "".join(f"wg0\t{line}\n" for line in self._dump_lines()), ""
+
+    def _config_and_dump(self, path, separator, interface):
+        return 0, f"{self._cat(path)[1]}{separator}\n{self._dump(interface)[1]}", ""
+
+    def _wg_set(self, interface, arguments):
+        if interface != "wg0" or not self.up:
+            return 1, "", "Unable to access interface: No such device\n"
+        words = arguments.split()
+        i = 0
+        while i < len(words):
+            if words[i] != "peer" or i + 2 >= len(words):
+                return 1, "", f"Invalid argument: {words[i]}\n"
+            public_key = words[i + 1]
+            if i + 2 < len(words) and words[i + 2] == "remove":
+                self.peers.pop(public_key, None)
+                i += 3
+            elif i + 3 < len(words) and words[i + 2] == "allowed-ips":
+                self.peers.setdefault(public_key, FakePeer("")).allowed_ips = words[i + 3]
+                i += 4
+            else:
+                return 1, "", f"Invalid argument: {' '.join(words[i:i + 3])}\n"
+        return 0, "", ""
+
+    def _python(self, path):
+        """Run the installed server-side helper, whichever version it is."""
+        if path not in self.files:
+            return 2, "", f"python3: can't open file '{path}': [Errno 2] No such file or directory\n"
+        version = re.search(r"^VERSION = (\d+)$", self.read(path), re.MULTILINE)
+        try:
+            request = json.loads(self._stdin)
+        except ValueError as e:
+            return 2, json.dumps({"error": f"invalid request: {e}"}), ""
+        response = rth.handle(request, _HelperSystem(self), int(version.group(1)) if version else 0)
+        if response.get("error") == "version mismatch":
+            return rth.EXIT_OUTDATED, json.dumps(response), ""
+        return (1 if "error" in response else 0), json.dumps(response), ""
+
+    def _restart(self, interface):
+        if interface != "wg0" or rtr.CONFIG_PATH not in self.files:
+            return 1, "", f"Job for wg-quick@{interface}.service failed.\n"
+        port = re.search(r"^\s*ListenPort\s*=\s*(\d+)", self.config, re.MULTILINE)
+        self.listen_port = int(port.group(1)) if port else None
+        # Counters restart with the interface
+        self.peers = {
+            public_key: FakePeer(",".join(ip.strip() for ip in allowed_ips.split(",")))
+            for public_key, allowed_ips in rtr.parse_config_peers(self.config).items()
+        }
+        self.up = True
+        self.restarts += 1
+        return 0, "", ""
+
+
+class _HelperSystem:
+    """The server-side helper's view of a FakeServer."""
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+
+    def read(self, path):
+        return self.server.read(path) if path in self.server.files else None
+
+    def write(self, path, text, mode=0o600):
+        self.server.write(path, text, mode)
+
+    def remove(self, path):
+        self.server.remove(path)
+
+    def remove_dir(self, path):
+        if not any(name.startswith(path + "/") for name in self.server.files):
+            self.server.dirs.pop(path, None)
+
+    def run(self, args):
+        status, stdout, _ = self.server.execute(" ".join(args))
+        return status, stdout
+
+
+class _FakeFile(io.BytesIO):
+    """A file opened over fake SFTP; written data lands on the server when closed."""
+
+    def __init__(self, connection: "FakeConnection", path: str, mode: str):
+        super().__init__(connection.server.files.get(path, b"") if "r" in mode else b"")
+        self.connection = connection
+        self.path = path
+        self.writable_mode = "w" in mode or "a" in mode
+        self.file_mode = 0o644
+
+    def chmod(self, mode: int):
+        self.connection._round_trip()
+        self.file_mode = mode
+
+    def set_pipelined(self, pipelined: bool = True):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.connection._round_trip()
+            if self.writable_mode:
+                self.connection.server.write(self.path, self.getvalue(), self.file_mode)
+        finally:
+            super().close()
+
+
+class _FakeSftp:
+    def __init__(self, connection: "FakeConnection"):
+        self.connection = connection
+
+    def open(self, path: str, mode: str = "r") -> _FakeFile:
+        self.connection._round_trip()
+        if "r" in mode and path not in self.connection.server.files:
+            raise FileNotFoundError(path)
+        return _FakeFile(self.connection, path, mode)
+
+
+class FakeConnection:
+    """A drop-in fabric Connection backed by a FakeServer, for offline tests and load simulation.
+
+    Every command and SFTP request counts as one round trip, sleeps for
+    `latency` seconds and fails with FakeNetworkError with probability
+    `failure_rate`. Commands that exit non-zero raise UnexpectedExit unless
+    warn=True, as with fabric.
+    """
+
+    def __init__(self, host: str = "fake.example.com", user: str = "root", port: int = 22,
+                 server: FakeServer | None = None, latency: float = 0.0, failure_rate: float = 0.0,
+                 seed: int | None = None):
+        self.host = host
+        self.user = user
+        self.port = port
+        self.server = server or FakeServer()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.commands: list[str] = []
+        self.round_trips = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _round_trip(self):
+        with self._lock:
+            self.round_trips += 1
+            failed = self.failure_rate and self._random.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if failed:
+            raise FakeNetworkError(f"{self.host}: injected connection failure")
+
+    def run(self, command: str, hide=None, in_stream=None, warn: bool = False, **kwargs) -> Result:
+        """Run a command on the fake server."""
+        self._round_trip()
+        with self._lock:
+            self.commands.append(command)
+        stdin = in_stream.read() if hasattr(in_stream, "read") else ""
+        exited, stdout, stderr = self.server.execute(command, stdin)
+        result = Result(stdout=stdout, stderr=stderr, exited=exited, command=command)
+        if exited != 0 and not warn:
+            raise UnexpectedExit(result)
+        return result
+
+    def sudo(self, command: str, hide=None, in_stream=None, warn: bool = False, **kwargs) -> Result:
+        """Run a command as root on the fake server."""
+        return self.run(command, hide=hide, in_stream=in_stream, warn=warn, **kwargs)
+
+    def sftp(self) -> _FakeSftp:
+        return _FakeSftp(self)
+
+    def reset_counters(self):
+        """Forget recorded commands and round trips."""
+        with self._lock:
+            self.commands.clear()
+            self.round_trips = 0
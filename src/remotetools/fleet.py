@@ -0,0 +1,110 @@
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from fabric.connection import Connection
+from typing import Callable
+
+
+@dataclass
+class Server:
+    """One exit node: its connection, peer store, VPN subnet (None for the configured one) and optional region tag."""
+    connection: Connection
+    store: rtl.PeerStore
+    subnet: str | None = None
+    region: str | None = None
+
+    @property
+    def host(self) -> str:
+        return self.connection.host
+
+
+def least_loaded(servers: list[Server], loads: dict[str, int]) -> Server:
+    """Placement policy: pick the server with the fewest peers."""
+    return min(servers, key=lambda server: loads[server.host])
+
+
+class Fleet:
+    """Manage peers across several WireGuard servers, deploying to them concurrently."""
+
+    def __init__(self, servers: list[Server], max_workers: int = 8,
+                 policy: Callable[[list[Server], dict[str, int]], Server] = least_loaded):
+        if not servers:
+            raise ValueError("A fleet needs at least one server")
+        self.servers = servers
+        self.max_workers = max_workers
+        self.policy = policy
+
+    def server(self, host: str) -> Server:
+        """Return the server with the given host."""
+        for server in self.servers:
+            if server.host == host:
+                return server
+        raise KeyError(f"No server {host} in fleet")
+
+    def candidates(self, region: str | None = None) -> list[Server]:
+        """Return the servers in a region, or all servers."""
+        servers = [s for s in self.servers if region is None or s.region == region]
+        if not servers:
+            raise ValueError(f"No server in region {region}")
+        return servers
+
+    def loads(self, servers: list[Server] | None = None) -> dict[str, int]:
+        """Return the number of peers per host."""
+        servers = self.servers if servers is None else servers
+        return {server.host: server.store.count() for server in servers}
+
+    def place(self, region: str | None = None) -> Server:
+        """Choose a server for a new peer, restricted to a region if given."""
+        candidates = self.candidates(region)
+        return self.policy(candidates, self.loads(candidates))
+
+    def run(self, fn: Callable[[Server], object], servers: list[Server] | None = None) -> dict[str, object]:
+        """Call fn on each server concurrently and return its result, or the exception raised, per host."""
+        servers = self.servers if servers is None else servers
+        results = {}
+        if not servers:
+            return results
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(servers))) as pool:
+            futures = {server.host: pool.submit(fn, server) for server in servers}
+            for host, future in futures.items():
+                try:
+                    results[host] = future.result()
+                except Exception as e:
+                    results[host] = e
+        return results
+
+    def add_peer(self, name: str, device: str, email: str, region: str | None = None,
+                 **kwargs) -> tuple[str, str]:
+        """Add a peer to the server chosen by the placement policy. Returns (host, client config)."""
+        server = self.place(region)
+        config = rto.add_peer(server.connection, name, device, email,
+                              subnet=server.subnet, store=server.store, **kwargs)
+        return server.host, config
+
+    def add_peers(self, peers: list[tuple[str, str, str]], region: str | None = None,
+                  **kwargs) -> dict[str, object]:
+        """Place several (name, device, email) peers, then add them with one deploy per server, concurrently."""
+        candidates = self.candidates(region)
+        loads = self.loads(candidates)
+        batches = {}
+        for peer in peers:
+            server = self.policy(candidates, loads)
+            loads[server.host] += 1
+            batches.setdefault(server.host, []).append(peer)
+        return self.run(
+            lambda server: rto.add_peers(server.connection, batches[server.host],
+                                         subnet=server.subnet, store=server.store, **kwargs),
+            [server for server in candidates if server.host in batches]
+        )
+
+    def remove_peer(self, host: str, name: str, device: str, **kwargs) -> bool:
+        """Remove a peer from the given server."""
+        server = self.server(host)
+        return rto.remove_peer(server.connection, name, device,
+                               subnet=server.subnet, store=server.store, **kwargs)
+
+    def deploy_all(self, **kwargs) -> dict[str, object]:
+        """Deploy every server's config concurrently and return the result per host."""
+        return self.run(lambda server: rto.deploy_config(server.connection, subnet=server.subnet,
+                                                         store=server.store, **kwargs))
@@ -1,7 +1,22 @@
 
+import base64
+import bisect
 import csv
+import ipaddress
+import os
+import socket
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pathlib import Path
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Iterable, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks only protect against other threads
+    fcntl = None
 
 # Move these somewhere else. Maybe useful for ssh key stuff
 # import os
@@ -57,6 +72,7 @@ class PeerInfo:
     email: str
     vpn_ip: str
     created_utc: str
+    expires_utc: str = ""
 
 
 @dataclass
@@ -67,6 +83,7 @@ class PeerRecord:
     email: str
     vpn_ip: str
     created_utc: str
+    expires_utc: str = ""  # ISO 8601 UTC; empty means the peer never expires
     
     @classmethod
     def from_peer_info(cls, peer_info: PeerInfo) -> 'PeerRecord':
@@ -76,13 +93,113 @@ class PeerRecord:
             device=peer_info.device,
             email=peer_info.email,
             vpn_ip=peer_info.vpn_ip,
-            created_utc=peer_info.created_utc
+            created_utc=peer_info.created_utc,
+            expires_utc=peer_info.expires_utc
         )
 
 
+CSV_FIELDS = ['name', 'public_key', 'device', 'email', 'vpn_ip', 'created_utc', 'expires_utc']
+
+
+def utc_timestamp(value: str) -> str:
+    """Normalise an ISO 8601 time to UTC with seconds precision, e.g. 2025-06-01T08:00:00+00:00.
+
+    Stored times compare as strings, so every expires_utc must be in this one
+    form. Naive times are taken as UTC and "" (never) is kept as is. Raises
+    ValueError if value is not an ISO 8601 time.
+    """
+    if not value:
+        return value
+    try:
+        moment = datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+    except ValueError:
+        raise ValueError(f"Not an ISO 8601 time: {value!r}") from None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).isoformat(timespec="seconds")
+
+
+@dataclass
+class PeerFilter:
+    """Conditions a peer must meet; unset fields match every peer.
+
+    created_after is inclusive and created_before exclusive. Both compare as
+    strings, so prefixes like "2025-06" work. expires_before matches peers that
+    have an expiry earlier than the given time, which is normalised to UTC.
+    """
+    email: str | None = None
+    device: str | None = None
+    public_key: str | None = None
+    created_after: str | None = None
+    created_before: str | None = None
+    expires_before: str | None = None
+    subnet: str | None = None
+    where: Callable[[PeerRecord], bool] | None = None
+    _in_subnet: Callable[[str], bool] | None = field(default=None, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.expires_before is not None:
+            self.expires_before = utc_timestamp(self.expires_before)
+        if self.subnet is not None:
+            self._in_subnet = in_subnet(self.subnet)
+
+    @property
+    def order_key(self) -> str | None:
+        """The column range results are ordered by, or None for insertion order."""
+        if self.expires_before is not None:
+            return "expires_utc"
+        if self.created_after is not None or self.created_before is not None:
+            return "created_utc"
+        return None
+
+    def matches(self, record: PeerRecord) -> bool:
+        """True if the record meets every condition."""
+        if self.email is not None and record.email != self.email:
+            return False
+        if self.device is not None and record.device != self.device:
+            return False
+        if self.public_key is not None and record.public_key != self.public_key:
+            return False
+        if self.created_after is not None and record.created_utc < self.created_after:
+            return False
+        if self.created_before is not None and record.created_utc >= self.created_before:
+            return False
+        if self.expires_before is not None and not ("" < record.expires_utc < self.expires_before):
+            return False
+        if self._in_subnet is not None and not self._in_subnet(record.vpn_ip):
+            return False
+        return self.where is None or self.where(record)
+
+
+@dataclass
+class PeerPage:
+    """One page of query results and the total number of matches."""
+    records: list[PeerRecord]
+    total: int
+    offset: int = 0
+    limit: int | None = None
+
+    @property
+    def has_more(self) -> bool:
+        return self.offset + len(self.records) < self.total
+
+
+def paginate(records: Iterable[PeerRecord], peer_filter: PeerFilter, offset: int = 0,
+             limit: int | None = None) -> PeerPage:
+    """Filter a stream of records, keeping only the requested page while counting every match."""
+    page = []
+    total = 0
+    for record in records:
+        if peer_filter.matches(record):
+            if total >= offset and (limit is None or len(page) < limit):
+                page.append(record)
+            total += 1
+    return PeerPage(page, total, offset, limit)
+
+
 def remove_peer(name: str, device: str) -> bool:
     """Remove a peer from storage."""
-    return remove_peer_from_csv(name, device, csv_path="peers.csv")
+    return get_peer_store().remove(name, device)
 
 
 def remove_peer_from_csv(name: str, device: str, csv_path: str = "peers.csv") -> bool:
@@ -99,33 +216,91 @@ def remove_peer_from_csv(name: str, device: str, csv_path: str = "peers.csv") ->
     if len(remaining_peers) == original_count:
         return False  # Peer not found
     
-    # Rewrite the CSV with remaining peers
-    Path(csv_path).unlink()  # Delete old file
-    for peer in remaining_peers:
-        save_peer_to_csv(peer, csv_path)
+    # Rewrite the CSV with remaining peers in a single pass
+    save_peers_to_csv(remaining_peers, csv_path)
     
     return True
 
 
+def csv_header(csv_path: str) -> list[str] | None:
+    """Return the column names of a CSV file, or None if it does not exist."""
+    if not Path(csv_path).exists():
+        return None
+    with open(csv_path, 'r', newline='') as f:
+        return next(csv.reader(f), [])
+
+
 def save_peer_to_csv(peer_record: PeerRecord, csv_path: str = "peers.csv"):
     """Append a single peer to the CSV file."""
     file_exists = Path(csv_path).exists()
+    if file_exists and csv_header(csv_path) != CSV_FIELDS:
+        # Older file without the newer columns: rewrite it with the current header
+        save_peers_to_csv(load_peers(csv_path) + [peer_record], csv_path)
+        return
     
     with open(csv_path, 'a', newline='') as f:
-        writer = csv.DictWriter(f, fieldnames=['name', 'public_key', 'device', 'email', 'vpn_ip', 'created_utc'])
+        writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
         if not file_exists:
             writer.writeheader()
         writer.writerow(asdict(peer_record))
 
 
+def save_peers_to_csv(peer_records: list[PeerRecord], csv_path: str = "peers.csv"):
+    """Write all peers to the CSV file, replacing its contents atomically.
+
+    The rows go to a temporary file that is renamed over the original, so readers
+    see either the old or the new file, never a partial one.
+    """
+    tmp_path = f"{csv_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
+            writer.writerows(asdict(p) for p in peer_records)
+            f.flush()
+            os.fsync(f.fileno())
+        if Path(csv_path).exists():
+            os.chmod(tmp_path, os.stat(csv_path).st_mode & 0o7777)
+        os.replace(tmp_path, csv_path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
 def add_peer(peer_record: PeerRecord):
     """Add a peer to storage."""
-    save_peer_to_csv(peer_record)
+    get_peer_store().add(peer_record)
+
+
+def add_peers(peer_records: list[PeerRecord]):
+    """Add several peers to storage in one write."""
+    get_peer_store().add_many(peer_records)
+
+
+def remove_peers(keys: list[tuple[str, str]]) -> list[bool]:
+    """Remove several peers by (name, device) from storage in one write."""
+    return get_peer_store().remove_many(keys)
 
 
 def get_all_peers() -> list[PeerRecord]:
     """Get all peers from storage."""
-    return load_peers(csv_path="peers.csv")
+    return get_peer_store().all()
+
+
+def find_peers(peer_filter: PeerFilter | None = None, offset: int = 0, limit: int | None = None,
+               **conditions) -> PeerPage:
+    """Query peers in storage, e.g. find_peers(email="alice@example.com") or find_peers(created_before="2025-06")."""
+    return get_peer_store().find(peer_filter or PeerFilter(**conditions), offset, limit)
+
+
+def count_peers(peer_filter: PeerFilter | None = None, **conditions) -> int:
+    """Count the peers in storage that match."""
+    return get_peer_store().count_where(peer_filter or PeerFilter(**conditions))
+
+
+def remove_peers_where(peer_filter: PeerFilter | None = None, **conditions) -> list[PeerRecord]:
+    """Remove every matching peer from storage in one write and return them."""
+    return get_peer_store().remove_where(peer_filter or PeerFilter(**conditions))
 
     
 def load_peers(csv_path: str = "peers.csv") -> list[PeerRecord]:
@@ -138,25 +313,797 @@ def load_peers(csv_path: str = "peers.csv") -> list[PeerRecord]:
         return [PeerRecord(**row) for row in reader]
 
 
-def find_next_vpn_ip(peer_records: list[PeerRecord]) -> str | None:
-    all_possible = set(f"10.0.0.{i}" for i in range(2, 255))
-    used_ips = {record.vpn_ip for record in peer_records}
-    available = all_possible - used_ips
-    return min(available, key=lambda ip: int(ip.split('.')[-1])) if available else None
+class PeerIndex:
+    """In-memory copy of a peer CSV file with lookup maps, reloaded only when the file changes.
+
+    Changes are detected by the file's mtime, size and inode. Writes made through
+    CsvPeerStore are applied to the index in place instead of forcing a reload.
+    Returned records are shared with the index and should not be modified.
+    """
+
+    def __init__(self, csv_path: str):
+        self.csv_path = csv_path
+        self.lock_path = f"{csv_path}.lock"
+        self.lock = threading.RLock()
+        self._lock_file = None
+        self.signature = None
+        self.records: list[PeerRecord] = []
+        self.by_key: dict[tuple[str, str], PeerRecord] = {}
+        self.by_public_key: dict[str, PeerRecord] = {}
+        self.by_ip: dict[str, PeerRecord] = {}
+        self.by_email: dict[str, list[PeerRecord]] = {}
+        self.by_device: dict[str, list[PeerRecord]] = {}
+        # Parallel lists sorted by created_utc, for range scans
+        self.created_keys: list[str] = []
+        self.created_records: list[PeerRecord] = []
+        # Only peers with an expiry, sorted by expires_utc
+        self.expires_keys: list[str] = []
+        self.expires_records: list[PeerRecord] = []
+        # IPAllocator per subnet, built on first use and kept until the next reload
+        self.allocators: dict[str, IPAllocator] = {}
+
+    def _stat(self) -> tuple[int, int, int] | None:
+        try:
+            st = os.stat(self.csv_path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def version(self) -> tuple[int, int, int] | None:
+        """Return a value that changes whenever the file is written."""
+        return self._stat()
+
+    def is_current(self) -> bool:
+        """True if the index matches the file on disk."""
+        return self.signature is not None and self.signature == self._stat()
+
+    @contextmanager
+    def locked(self, exclusive: bool = True):
+        """Hold the thread lock and an flock on the file's .lock sidecar; re-entrant within a thread."""
+        with self.lock:
+            if self._lock_file is not None or fcntl is None:
+                yield
+                return
+            with open(self.lock_path, 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._lock_file = lock_file
+                try:
+                    yield
+                finally:
+                    self._lock_file = None
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def refresh(self):
+        """Reload from disk if the file changed since the last load or write."""
+        with self.lock:
+            signature = self._stat()
+            if signature is None:
+                if self.signature is not None:
+                    self._rebuild([])
+            elif signature != self.signature:
+                # Shared lock so a writer in another process can't be midway through an append
+                with self.locked(exclusive=False):
+                    signature = self._stat()
+                    self._rebuild(load_peers(self.csv_path))
+            self.signature = signature
+
+    def _rebuild(self, records: list[PeerRecord]):
+        self.records = records
+        self.allocators = {}
+        self.by_key, self.by_public_key, self.by_ip, self.by_email, self.by_device = {}, {}, {}, {}, {}
+        self.created_records = sorted(records, key=lambda record: record.created_utc)
+        self.created_keys = [record.created_utc for record in self.created_records]
+        self.expires_records = sorted((r for r in records if r.expires_utc), key=lambda record: record.expires_utc)
+        self.expires_keys = [record.expires_utc for record in self.expires_records]
+        self._index(records, ordered=False)
+
+    def _index(self, records: list[PeerRecord], ordered: bool = True):
+        for record in records:
+            self.by_key[(record.name, record.device)] = record
+            self.by_public_key[record.public_key] = record
+            self.by_ip[record.vpn_ip] = record
+            self.by_email.setdefault(record.email, []).append(record)
+            self.by_device.setdefault(record.device, []).append(record)
+            if ordered:
+                # New peers are usually the newest, so this is mostly an append
+                position = bisect.bisect_right(self.created_keys, record.created_utc)
+                self.created_keys.insert(position, record.created_utc)
+                self.created_records.insert(position, record)
+            if ordered and record.expires_utc:
+                position = bisect.bisect_right(self.expires_keys, record.expires_utc)
+                self.expires_keys.insert(position, record.expires_utc)
+                self.expires_records.insert(position, record)
+
+    def applied(self, was_current: bool, added: list[PeerRecord] = (), remaining: list[PeerRecord] | None = None):
+        """Apply a write that just went to disk: added records, or the records left after a removal.
+
+        Only done if the index was current before the write; otherwise the next
+        read reloads it.
+        """
+        with self.lock:
+            if not was_current:
+                return
+            if remaining is not None:
+                allocators = self.allocators
+                removed = self.by_ip.keys() - {record.vpn_ip for record in remaining}
+                self._rebuild(remaining)
+                for allocator in allocators.values():
+                    allocator.update(removed=removed)
+                self.allocators = allocators
+            if added:
+                self.records = self.records + list(added)
+                self._index(added)
+                for allocator in self.allocators.values():
+                    allocator.update(added=[record.vpn_ip for record in added])
+            self.signature = self._stat()
+
+    def all(self) -> list[PeerRecord]:
+        self.refresh()
+        return list(self.records)
+
+    def get(self, name: str, device: str) -> PeerRecord | None:
+        self.refresh()
+        return self.by_key.get((name, device))
+
+    def find_by_public_key(self, public_key: str) -> PeerRecord | None:
+        self.refresh()
+        return self.by_public_key.get(public_key)
+
+    def find_by_ip(self, vpn_ip: str) -> PeerRecord | None:
+        self.refresh()
+        return self.by_ip.get(vpn_ip)
+
+    def find_by_email(self, email: str) -> list[PeerRecord]:
+        self.refresh()
+        return list(self.by_email.get(email, []))
+
+    def free_ips(self, count: int, subnet: str | None = None) -> list[str]:
+        """Return up to count of the lowest free addresses in the subnet from the kept allocator."""
+        subnet = subnet or _vpn_subnet
+        with self.lock:
+            self.refresh()
+            if subnet not in self.allocators:
+                self.allocators[subnet] = IPAllocator(subnet, self.by_ip)
+            return self.allocators[subnet].peek(count)
+
+    def candidates(self, peer_filter: PeerFilter) -> list[PeerRecord]:
+        """Return a superset of the matching peers from the most selective index.
+
+        Ordered by the filter's order_key, otherwise in insertion order.
+        """
+        with self.lock:
+            self.refresh()
+            options = []
+            if peer_filter.public_key is not None:
+                record = self.by_public_key.get(peer_filter.public_key)
+                options.append([record] if record else [])
+            if peer_filter.email is not None:
+                options.append(self.by_email.get(peer_filter.email, []))
+            if peer_filter.device is not None:
+                options.append(self.by_device.get(peer_filter.device, []))
+            if peer_filter.created_after is not None or peer_filter.created_before is not None:
+                lo = 0 if peer_filter.created_after is None else bisect.bisect_left(self.created_keys, peer_filter.created_after)
+                hi = len(self.created_keys) if peer_filter.created_before is None else bisect.bisect_left(self.created_keys, peer_filter.created_before)
+                options.append(self.created_records[lo:hi])
+            if peer_filter.expires_before is not None:
+                options.append(self.expires_records[:bisect.bisect_left(self.expires_keys, peer_filter.expires_before)])
+            if not options:
+                return list(self.records)
+            best = min(options, key=len)
+            order_key = peer_filter.order_key
+            if order_key is not None and best is not options[-1]:
+                return sorted(best, key=lambda record: getattr(record, order_key))
+            return list(best)
+
+
+_peer_indexes: dict[str, PeerIndex] = {}
+_peer_indexes_lock = threading.Lock()
+
+
+def peer_index(csv_path: str = "peers.csv") -> PeerIndex:
+    """Return the process-wide index for a peer CSV file."""
+    key = os.path.abspath(csv_path)
+    with _peer_indexes_lock:
+        if key not in _peer_indexes:
+            _peer_indexes[key] = PeerIndex(str(csv_path))
+        return _peer_indexes[key]
+
+
+class PeerStore:
+    """Base class for peer storage backends."""
+
+    def all(self) -> list[PeerRecord]:
+        """Return every stored peer in insertion order."""
+        raise NotImplementedError
+
+    def add_many(self, peer_records: list[PeerRecord]):
+        """Store several peers in one write."""
+        raise NotImplementedError
+
+    def remove(self, name: str, device: str) -> bool:
+        """Delete a peer. Returns True if found and deleted."""
+        raise NotImplementedError
+
+    def remove_many(self, keys: list[tuple[str, str]]) -> list[bool]:
+        """Delete several peers by (name, device) in one write. Returns a found flag per key."""
+        return [self.remove(name, device) for name, device in keys]
+
+    def count(self) -> int:
+        """Return the number of stored peers."""
+        return len(self.all())
+
+    def iter(self) -> Iterator[PeerRecord]:
+        """Yield stored peers one at a time, in insertion order."""
+        return iter(self.all())
+
+    def add(self, peer_record: PeerRecord):
+        """Store a single peer."""
+        self.add_many([peer_record])
+
+    def version(self) -> object:
+        """Return a value that changes whenever the store is written, or None if unknown."""
+        return None
+
+    def get(self, name: str, device: str) -> PeerRecord | None:
+        """Return the peer stored under (name, device), if any."""
+        return next((p for p in self.iter() if (p.name, p.device) == (name, device)), None)
+
+    def free_ips(self, count: int, subnet: str | None = None) -> list[str]:
+        """Return up to count of the lowest free client addresses in the subnet, without claiming them.
+
+        An address is claimed when a peer with it is added, so callers check
+        version() under locked() before saving, as for any other read.
+        """
+        return IPAllocator(subnet, (p.vpn_ip for p in self.iter())).peek(count)
+
+    @contextmanager
+    def locked(self) -> Iterator['PeerStore']:
+        """Hold exclusive write access for a read-modify-write, across processes where the backend supports it."""
+        yield self
+
+    def find(self, peer_filter: PeerFilter, offset: int = 0, limit: int | None = None) -> PeerPage:
+        """Return a page of matching peers, ordered by the filter's order_key, else insertion order."""
+        records = self.iter()
+        order_key = peer_filter.order_key
+        if order_key is not None:
+            records = sorted((r for r in records if peer_filter.matches(r)), key=lambda r: getattr(r, order_key))
+        return paginate(records, peer_filter, offset, limit)
+
+    def count_where(self, peer_filter: PeerFilter) -> int:
+        """Return the number of matching peers."""
+        return self.find(peer_filter, limit=0).total
+
+    def remove_where(self, peer_filter: PeerFilter) -> list[PeerRecord]:
+        """Delete every matching peer in one write and return them."""
+        with self.locked():
+            matches = self.find(peer_filter).records
+            if matches:
+                self.remove_many([(r.name, r.device) for r in matches])
+        return matches
+
+
+class CsvPeerStore(PeerStore):
+    """Peer storage backed by a CSV file, read through a cached PeerIndex."""
+
+    def __init__(self, csv_path: str = "peers.csv"):
+        self.csv_path = str(csv_path)
+        self.index = peer_index(self.csv_path)
+
+    def all(self) -> list[PeerRecord]:
+        return self.index.all()
+
+    def iter(self) -> Iterator[PeerRecord]:
+        # Serve from the index when it is loaded, otherwise stream without loading everything
+        if self.index.is_current():
+            yield from list(self.index.records)
+            return
+        if not Path(self.csv_path).exists():
+            return
+        with open(self.csv_path, 'r', newline='') as f:
+            for row in csv.DictReader(f):
+                yield PeerRecord(**row)
 
+    def count(self) -> int:
+        return len(self.index.all())
 
-def generate_client_config(peer_info: PeerInfo, server_public_key: str, server_endpoint: str = "46.62.216.199:51820") -> str:
+    def version(self) -> tuple[int, int, int] | None:
+        return self.index.version()
+
+    def get(self, name: str, device: str) -> PeerRecord | None:
+        return self.index.get(name, device)
+
+    def free_ips(self, count: int, subnet: str | None = None) -> list[str]:
+        return self.index.free_ips(count, subnet)
+
+    def find(self, peer_filter: PeerFilter, offset: int = 0, limit: int | None = None) -> PeerPage:
+        return paginate(self.index.candidates(peer_filter), peer_filter, offset, limit)
+
+    @contextmanager
+    def locked(self) -> Iterator['CsvPeerStore']:
+        with self.index.locked():
+            yield self
+
+    def add_many(self, peer_records: list[PeerRecord]):
+        with self.index.locked():
+            was_current = self.index.is_current()
+            header = csv_header(self.csv_path)
+            if header is None:
+                save_peers_to_csv(peer_records, self.csv_path)
+                was_current = self.index.signature is None or was_current
+            elif header != CSV_FIELDS:
+                # Older file without the newer columns: rewrite it with the current header
+                save_peers_to_csv(load_peers(self.csv_path) + list(peer_records), self.csv_path)
+                self.index.signature = None
+                return
+            else:
+                with open(self.csv_path, 'a', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+                    writer.writerows(asdict(p) for p in peer_records)
+            self.index.applied(was_current, added=peer_records)
+
+    def remove(self, name: str, device: str) -> bool:
+        return self.remove_many([(name, device)])[0]
+
+    def remove_many(self, keys: list[tuple[str, str]]) -> list[bool]:
+        with self.index.locked():
+            peers = self.index.all()
+            wanted = set(keys)
+            remaining = [p for p in peers if (p.name, p.device) not in wanted]
+            found = {(p.name, p.device) for p in peers} & wanted
+            if found:
+                save_peers_to_csv(remaining, self.csv_path)
+                self.index.applied(True, remaining=remaining)
+            return [key in found for key in keys]
+
+
+class SqlitePeerStore(PeerStore):
+    """Peer storage backed by an indexed SQLite database."""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS peers (
+        name TEXT NOT NULL,
+        public_key TEXT NOT NULL,
+        device TEXT NOT NULL,
+        email TEXT NOT NULL,
+        vpn_ip TEXT NOT NULL,
+        created_utc TEXT NOT NULL,
+        expires_utc TEXT NOT NULL DEFAULT ''
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS peers_name_device ON peers (name, device);
+    CREATE UNIQUE INDEX IF NOT EXISTS peers_public_key ON peers (public_key);
+    CREATE UNIQUE INDEX IF NOT EXISTS peers_vpn_ip ON peers (vpn_ip);
+    CREATE INDEX IF NOT EXISTS peers_email ON peers (email);
+    CREATE INDEX IF NOT EXISTS peers_device ON peers (device);
+    CREATE INDEX IF NOT EXISTS peers_created_utc ON peers (created_utc);
+    """
+
+    # Columns added after the first release, created on databases that predate them
+    MIGRATIONS = {
+        "expires_utc": """
+        ALTER TABLE peers ADD COLUMN expires_utc TEXT NOT NULL DEFAULT '';
+        """,
+    }
+    INDEXES = """
+    CREATE INDEX IF NOT EXISTS peers_expires_utc ON peers (expires_utc) WHERE expires_utc != '';
+    """
+    ITER_BLOCK = 1000  # rows read per lock hold in iter()
+
+    def __init__(self, db_path: str = "peers.db"):
+        self.db_path = str(db_path)
+        self.conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._owner = None  # thread running the locked() transaction
+        # IPAllocator per subnet, kept while no other connection writes
+        self._allocators: dict[str, IPAllocator] = {}
+        self._allocated_version = None
+        with self.conn:
+            self.conn.executescript(self.SCHEMA)
+            columns = {row[1] for row in self.conn.execute("PRAGMA table_info(peers)")}
+            for column, migration in self.MIGRATIONS.items():
+                if column not in columns:
+                    self.conn.executescript(migration)
+            self.conn.executescript(self.INDEXES)
+
+    @contextmanager
+    def _write(self):
+        # The connection is shared, so every write takes the lock. Inside this
+        # thread's locked() the surrounding transaction commits; otherwise commit here
+        with self._lock:
+            if self._owner == threading.get_ident():
+                yield
+            else:
+                with self.conn:
+                    yield
+
+    def version(self) -> tuple[int, int]:
+        # data_version moves on commits by other connections, total_changes on our own
+        with self._lock:
+            return self.conn.execute("PRAGMA data_version").fetchone()[0], self.conn.total_changes
+
+    @contextmanager
+    def locked(self) -> Iterator['SqlitePeerStore']:
+        with self._lock:
+            if self._owner == threading.get_ident():
+                yield self
+                return
+            self.conn.execute("BEGIN IMMEDIATE")
+            self._owner = threading.get_ident()
+            try:
+                yield self
+            except BaseException:
+                self.conn.rollback()
+                self._allocated_version = None  # the allocators saw the rolled back writes
+                raise
+            else:
+                self.conn.commit()
+            finally:
+                self._owner = None
+
+    def all(self) -> list[PeerRecord]:
+        # Reads take the lock too, so they never see another thread's uncommitted rows
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(CSV_FIELDS)} FROM peers ORDER BY rowid"
+            )
+            return [PeerRecord(*row) for row in rows]
+
+    def iter(self) -> Iterator[PeerRecord]:
+        # Fetched in blocks so the lock is not held while the caller works on a row
+        last = 0
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT rowid, {', '.join(CSV_FIELDS)} FROM peers WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                    (last, self.ITER_BLOCK)
+                ).fetchall()
+            for row in rows:
+                yield PeerRecord(*row[1:])
+            if len(rows) < self.ITER_BLOCK:
+                return
+            last = rows[-1][0]
+
+    def _allocated(self, was_current: bool, added: list[str] = (), removed: list[str] = ()):
+        # Apply our own write to the allocators, or drop them if they were already out of date
+        if was_current:
+            for allocator in self._allocators.values():
+                allocator.update(added, removed)
+            self._allocated_version = self.version()
+        else:
+            self._allocated_version = None
+
+    def add_many(self, peer_records: list[PeerRecord]):
+        rows = [tuple(asdict(p)[f] for f in CSV_FIELDS) for p in peer_records]
+        try:
+            with self._write():
+                was_current = self._allocated_version == self.version()
+                self.conn.executemany(
+                    f"INSERT INTO peers ({', '.join(CSV_FIELDS)}) VALUES ({', '.join('?' for _ in CSV_FIELDS)})",
+                    rows
+                )
+                self._allocated(was_current, added=[p.vpn_ip for p in peer_records])
+        except sqlite3.IntegrityError as e:
+            raise ValueError(f"Peer conflicts with an existing record: {e}")
+
+    def remove(self, name: str, device: str) -> bool:
+        return self.remove_many([(name, device)])[0]
+
+    def remove_many(self, keys: list[tuple[str, str]]) -> list[bool]:
+        with self._write():
+            was_current = self._allocated_version == self.version()
+            removed = []
+            for key in keys:
+                row = self.conn.execute("SELECT vpn_ip FROM peers WHERE name = ? AND device = ?", key).fetchone()
+                if row:
+                    self.conn.execute("DELETE FROM peers WHERE name = ? AND device = ?", key)
+                removed.append(row[0] if row else None)
+            self._allocated(was_current, removed=[ip for ip in removed if ip is not None])
+            return [ip is not None for ip in removed]
+
+    def get(self, name: str, device: str) -> PeerRecord | None:
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(CSV_FIELDS)} FROM peers WHERE name = ? AND device = ?", (name, device)
+            ).fetchone()
+        return PeerRecord(*row) if row else None
+
+    def free_ips(self, count: int, subnet: str | None = None) -> list[str]:
+        subnet = subnet or _vpn_subnet
+        with self._lock:
+            version = self.version()
+            if self._allocated_version != version:
+                self._allocators, self._allocated_version = {}, version
+            if subnet not in self._allocators:
+                self._allocators[subnet] = IPAllocator(subnet, (p.vpn_ip for p in self.iter()))
+            return self._allocators[subnet].peek(count)
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM peers").fetchone()[0]
+
+    def find(self, peer_filter: PeerFilter, offset: int = 0, limit: int | None = None) -> PeerPage:
+        # Indexed conditions go to SQLite; subnet and where are checked row by row
+        clauses, params = [], []
+        for column in ("email", "device", "public_key"):
+            value = getattr(peer_filter, column)
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if peer_filter.created_after is not None:
+            clauses.append("created_utc >= ?")
+            params.append(peer_filter.created_after)
+        if peer_filter.created_before is not None:
+            clauses.append("created_utc < ?")
+            params.append(peer_filter.created_before)
+        if peer_filter.expires_before is not None:
+            clauses.append("expires_utc != '' AND expires_utc < ?")
+            params.append(peer_filter.expires_before)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        order_key = peer_filter.order_key
+        order = f" ORDER BY {order_key}, rowid" if order_key else " ORDER BY rowid"
+        select = f"SELECT {', '.join(CSV_FIELDS)} FROM peers{where}{order}"
+
+        with self._lock:
+            if peer_filter.subnet is not None or peer_filter.where is not None:
+                rows = self.conn.execute(select, params)
+                return paginate((PeerRecord(*row) for row in rows), peer_filter, offset, limit)
+
+            total = self.conn.execute(f"SELECT COUNT(*) FROM peers{where}", params).fetchone()[0]
+            rows = self.conn.execute(f"{select} LIMIT ? OFFSET ?", [*params, -1 if limit is None else limit, offset])
+            return PeerPage([PeerRecord(*row) for row in rows], total, offset, limit)
+
+    def close(self):
+        self.conn.close()
+
+
+def migrate_csv_to_sqlite(csv_path: str = "peers.csv", db_path: str = "peers.db") -> int:
+    """Copy all peers from a CSV file into an SQLite store. Returns the number migrated."""
+    peers = load_peers(csv_path)
+    store = SqlitePeerStore(db_path)
+    try:
+        store.add_many(peers)
+    finally:
+        store.close()
+    return len(peers)
+
+
+_peer_store: PeerStore = CsvPeerStore("peers.csv")
+
+
+def set_peer_store(store: PeerStore):
+    """Select the storage backend used by add_peer, remove_peer and get_all_peers."""
+    global _peer_store
+    _peer_store = store
+
+
+def get_peer_store() -> PeerStore:
+    """Return the storage backend currently in use."""
+    return _peer_store
+
+
+VPN_SUBNET = "10.0.0.0/24"
+_vpn_subnet = VPN_SUBNET
+
+
+def set_vpn_subnet(subnet: str):
+    """Select the VPN subnet that peers are allocated from and the server's Address is taken from.
+
+    Operations that are not given a subnet use this one, so set it once, as
+    with set_peer_store, rather than passing it to every call.
+    """
+    global _vpn_subnet
+    network = ipaddress.IPv4Network(subnet)
+    if network.prefixlen > 30:
+        raise ValueError(f"Subnet {subnet} is too small for a server and clients")
+    _vpn_subnet = str(network)
+
+
+def get_vpn_subnet() -> str:
+    """Return the VPN subnet currently in use."""
+    return _vpn_subnet
+
+
+def in_subnet(subnet: str | None = None) -> Callable[[str], bool]:
+    """Return a fast test of whether an IPv4 address string is in the subnet (the configured one by default)."""
+    network = ipaddress.IPv4Network(subnet or _vpn_subnet)
+    base, mask = int(network.network_address), int(network.netmask)
+
+    def contains(ip: str) -> bool:
+        try:
+            return int.from_bytes(socket.inet_aton(ip), "big") & mask == base
+        except OSError:
+            return False
+    return contains
+
+
+def check_subnet(peer_records: Iterable[PeerRecord], subnet: str | None = None):
+    """Raise ValueError if any peer's VPN IP is outside the subnet, as a server config for it would cut them off."""
+    subnet = subnet or _vpn_subnet
+    contains = in_subnet(subnet)
+    for record in peer_records:
+        if not contains(record.vpn_ip):
+            raise ValueError(f"Peer {record.name}/{record.device} has {record.vpn_ip}, outside the VPN subnet "
+                             f"{subnet}; select the subnet with set_vpn_subnet")
+
+
+class IPAllocator:
+    """Bitmap allocator for client addresses in an IPv4 VPN subnet.
+
+    The network, broadcast and server (first host) addresses are reserved.
+    Allocation always returns the lowest free address.
+    """
+
+    def __init__(self, subnet: str | None = None, used_ips=()):
+        subnet = subnet or _vpn_subnet
+        self.network = ipaddress.IPv4Network(subnet)
+        if self.network.prefixlen > 30:
+            raise ValueError(f"Subnet {subnet} is too small for a server and clients")
+        self._base = int(self.network.network_address)
+        self._size = self.network.num_addresses
+        self._bits = bytearray((self._size + 7) // 8)
+        self._next = 0
+        self.available = self._size
+        for index in (0, 1, self._size - 1):
+            self._mark(index)
+        for ip in used_ips:
+            index = self._index(ip)
+            if index is not None and not self._is_used(index):
+                self._mark(index)
+        self._next = 2
+
+    @property
+    def server_ip(self) -> str:
+        return str(ipaddress.IPv4Address(self._base + 1))
+
+    def _index(self, ip: str) -> int | None:
+        try:
+            a, b, c, d = map(int, ip.split('.'))
+        except ValueError:
+            return None
+        index = ((a << 24) | (b << 16) | (c << 8) | d) - self._base
+        return index if 0 <= index < self._size else None
+
+    def _is_used(self, index: int) -> bool:
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+    def _mark(self, index: int):
+        self._bits[index >> 3] |= 1 << (index & 7)
+        self.available -= 1
+
+    def allocate(self) -> str | None:
+        """Claim and return the lowest free address, or None if the subnet is full."""
+        index = self._next
+        while index < self._size:
+            if self._bits[index >> 3] == 0xFF:
+                index = (index | 7) + 1
+            elif self._is_used(index):
+                index += 1
+            else:
+                self._mark(index)
+                self._next = index + 1
+                return str(ipaddress.IPv4Address(self._base + index))
+        self._next = self._size
+        return None
+
+    def reserve(self, ip: str) -> bool:
+        """Mark an address as used. Returns False if it was already taken."""
+        index = self._index(ip)
+        if index is None:
+            raise ValueError(f"{ip} is not in {self.network}")
+        if self._is_used(index):
+            return False
+        self._mark(index)
+        return True
+
+    def release(self, ip: str):
+        """Return a client address to the pool."""
+        index = self._index(ip)
+        if index is None or index in (0, 1, self._size - 1) or not self._is_used(index):
+            return
+        self._bits[index >> 3] &= ~(1 << (index & 7))
+        self.available += 1
+        self._next = min(self._next, index)
+
+    def peek(self, count: int) -> list[str]:
+        """Return up to count of the lowest free addresses without claiming them."""
+        found = []
+        index = self._next
+        while index < self._size and len(found) < count:
+            if self._bits[index >> 3] == 0xFF:
+                index = (index | 7) + 1
+            elif self._is_used(index):
+                index += 1
+            else:
+                if not found:
+                    self._next = index  # nothing below is free
+                found.append(str(ipaddress.IPv4Address(self._base + index)))
+                index += 1
+        if count and not found:
+            self._next = self._size
+        return found
+
+    def update(self, added: Iterable[str] = (), removed: Iterable[str] = ()):
+        """Reserve the addresses of added peers and release those of removed ones, ignoring any outside the subnet."""
+        for ip in removed:
+            self.release(ip)
+        for ip in added:
+            index = self._index(ip)
+            if index is not None and not self._is_used(index):
+                self._mark(index)
+
+
+def server_address(subnet: str | None = None) -> str:
+    """Return the server's interface address, e.g. 10.0.0.1/24."""
+    network = ipaddress.IPv4Network(subnet or _vpn_subnet)
+    return f"{network.network_address + 1}/{network.prefixlen}"
+
+
+def find_next_vpn_ip(peer_records: list[PeerRecord], subnet: str | None = None) -> str | None:
+    """Return the lowest free client address in the subnet, or None if it is full."""
+    return IPAllocator(subnet, (record.vpn_ip for record in peer_records)).allocate()
+
+
+def generate_wireguard_keypair() -> tuple[str, str]:
+    """Generate a WireGuard (Curve25519) keypair locally, returned as base64 (private, public)."""
+    # Imported here so local-only operations don't pay for loading cryptography
+    from cryptography.hazmat.primitives.asymmetric import x25519
+    from cryptography.hazmat.primitives import serialization
+
+    private_key = x25519.X25519PrivateKey.generate()
+    private_bytes = private_key.private_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PrivateFormat.Raw,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    public_bytes = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+    return base64.b64encode(private_bytes).decode(), base64.b64encode(public_bytes).decode()
+
+
+def derive_public_key(private_key: str) -> str:
+    """Return the base64 WireGuard public key for a base64 private key, like `wg pubkey`."""
+    from cryptography.hazmat.primitives.asymmetric import x25519
+    from cryptography.hazmat.primitives import serialization
+
+    key = x25519.X25519PrivateKey.from_private_bytes(base64.b64decode(private_key))
+    public_bytes = key.public_key().public_bytes(
+        encoding=serialization.Encoding.Raw,
+        format=serialization.PublicFormat.Raw
+    )
+    return base64.b64encode(public_bytes).decode()
+
+
+@dataclass
+class ClientProfile:
+    """Client-side settings: what to route through the tunnel and which DNS server to use."""
+    name: str = "full"
+    allowed_ips: str = "0.0.0.0/0"
+    dns: str = "8.8.8.8"
+    persistent_keepalive: int = 25
+
+
+FULL_TUNNEL = ClientProfile()
+
+
+def split_tunnel(subnet: str | None = None, dns: str = "") -> ClientProfile:
+    """Profile that only routes the VPN subnet through the tunnel."""
+    return ClientProfile(name="split", allowed_ips=subnet or _vpn_subnet, dns=dns)
+
+
+def generate_client_config(peer_info: PeerInfo, server_public_key: str, server_endpoint: str = "46.62.216.199:51820",
+                           profile: ClientProfile = FULL_TUNNEL) -> str:
     """Generate WireGuard client config file text."""
+    dns = f"DNS = {profile.dns}\n" if profile.dns else ""
     return f"""[Interface]
 PrivateKey = {peer_info.private_key}
 Address = {peer_info.vpn_ip}/32
-DNS = 8.8.8.8
-
+{dns}
 [Peer]
 PublicKey = {server_public_key}
 Endpoint = {server_endpoint}
-AllowedIPs = 0.0.0.0/0
-PersistentKeepalive = 25
+AllowedIPs = {profile.allowed_ips}
+PersistentKeepalive = {profile.persistent_keepalive}
 """
 
 
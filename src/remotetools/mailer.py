@@ -0,0 +1,202 @@
+import json
+import logging
+import queue
+import smtplib
+import threading
+import time
+import remotetools.local as rtl
+from concurrent.futures import Future
+from dataclasses import dataclass, asdict
+from datetime import datetime, timezone
+from email.message import EmailMessage
+from importlib.resources import files
+from importlib.resources.abc import Traversable
+from pathlib import Path
+from string import Template
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Shipped inside the package so it is found from an installed copy, not just a checkout
+TEMPLATE_DIR = files("remotetools") / "templates" / "email"
+
+
+@dataclass
+class EmailTemplate:
+    """Subject and body text; $name, $device, $email and $vpn_ip are filled in per peer."""
+    subject: str
+    body: str
+
+
+@dataclass
+class SendResult:
+    """Outcome of one email, as recorded in the send log."""
+    email: str
+    name: str
+    device: str
+    status: str
+    attempts: int
+    error: str | None = None
+    sent_utc: str | None = None
+
+
+def load_template(template_dir: str | Path | Traversable = TEMPLATE_DIR) -> EmailTemplate:
+    """Read subject.txt and body.txt from a template directory, the packaged one by default."""
+    template_dir = Path(template_dir) if isinstance(template_dir, str) else template_dir
+    return EmailTemplate(
+        subject=(template_dir / "subject.txt").read_text().strip(),
+        body=(template_dir / "body.txt").read_text()
+    )
+
+
+def build_message(peer_info: rtl.PeerInfo, client_config: str, sender: str,
+                  template: EmailTemplate) -> EmailMessage:
+    """Render the template for a peer and attach its client config."""
+    fields = {
+        "name": peer_info.name,
+        "device": peer_info.device,
+        "email": peer_info.email,
+        "vpn_ip": peer_info.vpn_ip,
+    }
+    message = EmailMessage()
+    message["From"] = sender
+    message["To"] = peer_info.email
+    message["Subject"] = Template(template.subject).safe_substitute(fields)
+    message.set_content(Template(template.body).safe_substitute(fields))
+    message.add_attachment(client_config.encode(), maintype="application", subtype="octet-stream",
+                           filename=f"{peer_info.name}_{peer_info.device}.conf")
+    return message
+
+
+def smtp_factory(host: str, port: int = 587, username: str | None = None, password: str | None = None,
+                 starttls: bool = True, timeout: float = 30.0) -> Callable[[], smtplib.SMTP]:
+    """Return a function that opens a logged-in SMTP connection."""
+    def connect() -> smtplib.SMTP:
+        smtp = smtplib.SMTP(host, port, timeout=timeout)
+        if starttls:
+            smtp.starttls()
+        if username:
+            smtp.login(username, password or "")
+        return smtp
+    return connect
+
+
+class Mailer:
+    """Send client configs from a background queue over one reused SMTP connection.
+
+    Sends are spaced to at most rate_limit messages per second. Transient
+    failures reconnect and retry with exponential backoff; refused recipients
+    are not retried. Every outcome is kept in `sent` and, if log_path is given,
+    appended to it as a JSON line.
+    """
+
+    def __init__(self, sender: str, connect: Callable[[], smtplib.SMTP],
+                 template: EmailTemplate | None = None, rate_limit: float | None = 1.0,
+                 max_retries: int = 3, retry_delay: float = 2.0,
+                 messages_per_connection: int = 100, log_path: str | None = None):
+        self.sender = sender
+        self.connect = connect
+        self.template = template or load_template()
+        self.rate_limit = rate_limit
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.messages_per_connection = messages_per_connection
+        self.log_path = log_path
+        self.sent: list[SendResult] = []
+        self._queue: queue.Queue = queue.Queue()
+        self._smtp: smtplib.SMTP | None = None
+        self._smtp_messages = 0
+        self._last_send = 0.0
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def send(self, peer_info: rtl.PeerInfo, client_config: str) -> Future:
+        """Queue a client config for a peer; the future resolves to its SendResult."""
+        future = Future()
+        self._queue.put((peer_info, client_config, future))
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mailer", daemon=True)
+                self._thread.start()
+        return future
+
+    def close(self):
+        """Wait for queued emails to be sent, then close the SMTP connection."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        try:
+            while (item := self._queue.get()) is not None:
+                peer_info, client_config, future = item
+                try:
+                    future.set_result(self._deliver(peer_info, client_config))
+                except Exception as e:
+                    future.set_exception(e)
+        finally:
+            self._disconnect()
+
+    def _deliver(self, peer_info: rtl.PeerInfo, client_config: str) -> SendResult:
+        message = build_message(peer_info, client_config, self.sender, self.template)
+        result = SendResult(peer_info.email, peer_info.name, peer_info.device, "failed", 0)
+        while result.attempts <= self.max_retries:
+            result.attempts += 1
+            self._throttle()
+            try:
+                self._connection().send_message(message)
+                self._smtp_messages += 1
+                result.status = "sent"
+                result.error = None
+                result.sent_utc = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+                break
+            except smtplib.SMTPRecipientsRefused as e:
+                result.error = f"{type(e).__name__}: {e}"
+                break
+            except (smtplib.SMTPException, OSError) as e:
+                result.error = f"{type(e).__name__}: {e}"
+                logger.warning("sending to %s failed (attempt %d): %s", peer_info.email, result.attempts, e)
+                self._disconnect()
+                if result.attempts <= self.max_retries:
+                    time.sleep(self.retry_delay * 2 ** (result.attempts - 1))
+        self._record(result)
+        return result
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is not None and self._smtp_messages >= self.messages_per_connection:
+            self._disconnect()
+        if self._smtp is None:
+            self._smtp = self.connect()
+            self._smtp_messages = 0
+        return self._smtp
+
+    def _disconnect(self):
+        if self._smtp is None:
+            return
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._smtp = None
+
+    def _throttle(self):
+        if not self.rate_limit:
+            return
+        wait = self._last_send + 1 / self.rate_limit - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_send = time.monotonic()
+
+    def _record(self, result: SendResult):
+        self.sent.append(result)
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps(asdict(result)) + "\n")
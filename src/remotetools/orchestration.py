@@ -1,76 +1,318 @@
 import remotetools.local as rtl
 import remotetools.remote as rtr
+import remotetools.tracing as rtt
 from fabric.connection import Connection
+from dataclasses import dataclass
 from datetime import datetime, timezone
 
 
-def add_peer(c: Connection, name: str, device: str, email: str, csv_path: str = "peers.csv") -> str:
-    """Add a new peer to the VPN and return client config."""
-    # 1. Load existing peers
-    peers = rtl.get_all_peers()
-
-    # 2. Find next available IP
-    ip = rtl.find_next_vpn_ip(peers)
+@dataclass
+class PeerResult:
+    """Outcome for one peer in a bulk operation: its config or an error."""
+    peer_info: rtl.PeerInfo | None = None
+    config: str | None = None
+    error: str | None = None
+
+
+def _allocate(peers: list[tuple[str, str, str]], store: rtl.PeerStore, subnet: str | None,
+              results: dict[tuple[str, str], PeerResult]) -> list[tuple[str, str, str, str]]:
+    """Assign IPs to new (name, device, email) peers, recording an error result for each one rejected.
+
+    The IPs come from the store's kept allocator and are only claimed when the
+    peers are saved, so read the store version first and check it before saving.
+    """
+    taken = set()
+    new = []
+    for name, device, email in peers:
+        key = (name, device)
+        if key in taken or store.get(name, device) is not None:
+            results[key] = PeerResult(error=f"Peer {name}/{device} already exists")
+            continue
+        taken.add(key)
+        new.append((name, device, email))
+    ips = store.free_ips(len(new), subnet)
+    for name, device, email in new[len(ips):]:
+        results[(name, device)] = PeerResult(error="No VPN IP available")
+    return [(name, device, email, ip) for (name, device, email), ip in zip(new, ips)]
+
+
+def _allocate_one(name: str, device: str, email: str, store: rtl.PeerStore, subnet: str | None) -> str | None:
+    """Assign an IP to one new peer as _allocate does. Returns None if none is free, raises ValueError if the peer exists."""
+    results = {}
+    for _, _, _, ip in _allocate([(name, device, email)], store, subnet, results):
+        return ip
+    error = results[(name, device)].error
+    if error == "No VPN IP available":
+        return None
+    raise ValueError(error)
+
+
+def _public_keys(store: rtl.PeerStore, peers: list[tuple[str, str]]) -> list[str]:
+    """Return the public keys of the stored (name, device) peers."""
+    wanted = set(peers)
+    return [p.public_key for p in store.iter() if (p.name, p.device) in wanted]
+
+
+@rtt.operation("add_peer")
+def add_peer(c: Connection, name: str, device: str, email: str, csv_path: str | None = None,
+             subnet: str | None = None, incremental: bool = False, local_keys: bool = True,
+             store: rtl.PeerStore | None = None, profile: rtl.ClientProfile = rtl.FULL_TUNNEL,
+             deploy: bool = True, expires_utc: str = "", helper: bool = False) -> str:
+    """Add a new peer to the VPN and return client config, or None if no VPN IP is free.
+
+    Client keys are generated locally unless local_keys=False, which falls back
+    to running `wg genkey` on the server. Peers are kept in the configured store
+    unless another store is given. With deploy=False only the store is updated,
+    e.g. to leave the deploy to a DeployScheduler. expires_utc, if given, is
+    an ISO 8601 time after which the expiry reaper removes the peer; it is
+    stored in UTC and ValueError is raised if it does not parse. helper=True
+    deploys through the server-side helper in a single round trip. Raises
+    ValueError if the peer already exists.
+    """
+    expires_utc = rtl.utc_timestamp(expires_utc)
+    target = store or rtl.get_peer_store()
+
+    # 1. Note the store version, then validate and find the next available IP
+    with rtt.span("allocate ip"):
+        version = target.version()
+        ip = _allocate_one(name, device, email, target, subnet)
     if ip is None:
         return ip
 
-    # 3. Generate client keypair
-    private_key, public_key = rtr.generate_client_keypair(c)
-
-    # 4. Get server public key
-    server_key = rtr.retrieve_server_public_key(c)
-
-    # 5. Create PeerInfo with current UTC timestamp
-    peer_info = rtl.PeerInfo(name, private_key, public_key, device, email, ip, datetime.now(timezone.utc).isoformat())
-
-    # 6. Convert to PeerRecord and save to CSV
-    peer_record = rtl.PeerRecord.from_peer_info(peer_info)
-    rtl.add_peer(peer_record)
-
-    # 7. Generate client config text
-    client_config = rtl.generate_client_config(peer_info, server_key, f"{c.host}:51820")
-
-    # 8. Deploy updated server config
-    deploy_config(c, csv_path)
-
-    # 9. Return client config
-    return client_config
-
-
-def remove_peer(c: Connection, name: str, device: str) -> bool:
+    # 2. Generate client keypair
+    if local_keys:
+        with rtt.span("generate keypair"):
+            private_key, public_key = rtl.generate_wireguard_keypair()
+    else:
+        private_key, public_key = rtr.generate_client_keypair(c)
+
+    # 3. Get server public key, unless the helper will return it with the deploy
+    server_key = None if helper and deploy else rtr.retrieve_server_public_key(c)
+
+    # 4. Create PeerInfo with current UTC timestamp
+    peer_info = rtl.PeerInfo(name, private_key, public_key, device, email, ip, datetime.now(timezone.utc).isoformat(),
+                             expires_utc)
+
+    # 5. Convert to PeerRecord and save to storage under the store lock. If another
+    #    writer got in since step 1, validate and allocate again from the current peers
+    with rtt.span("save peer"), target.locked():
+        if target.version() != version:
+            peer_info.vpn_ip = _allocate_one(name, device, email, target, subnet)
+            if peer_info.vpn_ip is None:
+                return None
+        peer_record = rtl.PeerRecord.from_peer_info(peer_info)
+        if store:
+            store.add(peer_record)
+        else:
+            rtl.add_peer(peer_record)
+
+    # 6. Deploy updated server config, through the helper if asked and wg0.conf exists
+    applied = False
+    if helper and deploy:
+        server_key, applied = rtr.helper_add_peers(c, [peer_record])
+    if deploy and not applied:
+        deploy_config(c, csv_path, subnet=subnet, incremental=incremental, store=store, helper=helper)
+
+    # 7. Generate and return client config text
+    return rtl.generate_client_config(peer_info, server_key, f"{c.host}:51820", profile)
+
+
+@rtt.operation("remove_peer")
+def remove_peer(c: Connection, name: str, device: str, subnet: str | None = None,
+                incremental: bool = False, store: rtl.PeerStore | None = None, deploy: bool = True,
+                helper: bool = False) -> bool:
     """Remove a peer from the VPN."""
-    # 1. Delete peer from storage
-    result = rtl.remove_peer(name, device)
+    # 1. With the helper, note the peer's public key before it goes
+    if helper:
+        public_keys = _public_keys(store or rtl.get_peer_store(), [(name, device)])
+
+    # 2. Delete peer from storage
+    with rtt.span("remove peer"):
+        result = store.remove(name, device) if store else rtl.remove_peer(name, device)
     
     if not result:
         return False  # Peer not found
     
-    # 2. Rebuild and deploy server config
-    
-    print("DEBUG: about to deploy")
-    deploy_config(c)
-    print("DEBUG: about to return True")
+    # 3. Rebuild and deploy server config, or remove the peer through the helper
+    if deploy and not (helper and rtr.helper_remove_peers(c, public_keys)):
+        deploy_config(c, subnet=subnet, incremental=incremental, store=store, helper=helper)
 
     return True
 
 
-def deploy_config(c: Connection, csv_path: str = "peers.csv"):
-    """Rebuild and deploy server config from peer database."""
-    # 1. Load all peers from CSV
-    peers = rtl.load_peers(csv_path)
+@rtt.operation("add_peers")
+def add_peers(c: Connection, peers: list[tuple[str, str, str]],
+              subnet: str | None = None, incremental: bool = False,
+              local_keys: bool = True, store: rtl.PeerStore | None = None,
+              profile: rtl.ClientProfile = rtl.FULL_TUNNEL, deploy: bool = True,
+              expires_utc: str = "", helper: bool = False) -> dict[tuple[str, str], PeerResult]:
+    """Add several (name, device, email) peers with a single deploy and return a result per (name, device)."""
+    expires_utc = rtl.utc_timestamp(expires_utc)
+    results = {}
+    target = store or rtl.get_peer_store()
+
+    # 1. Note the store version, then validate and allocate an IP for each new peer
+    with rtt.span("allocate ips"):
+        version = target.version()
+        accepted = _allocate(peers, target, subnet, results)
+    if not accepted:
+        return results
+
+    # 2. Generate all client keypairs
+    if local_keys:
+        with rtt.span("generate keypairs"):
+            keypairs = [rtl.generate_wireguard_keypair() for _ in accepted]
+    else:
+        keypairs = rtr.generate_client_keypairs(c, len(accepted))
+
+    # 3. Build PeerInfo for every accepted peer
+    created_utc = datetime.now(timezone.utc).isoformat()
+    peer_infos = [
+        rtl.PeerInfo(name, private_key, public_key, device, email, ip, created_utc, expires_utc)
+        for (name, device, email, ip), (private_key, public_key) in zip(accepted, keypairs)
+    ]
+
+    # 4. Save all records in one write under the store lock. If another writer got
+    #    in since step 1, validate and allocate again from the current peers
+    try:
+        with rtt.span("save peers"), target.locked():
+            if target.version() != version:
+                by_key = {(pi.name, pi.device): pi for pi in peer_infos}
+                reallocated = _allocate([(pi.name, pi.device, pi.email) for pi in peer_infos],
+                                        target, subnet, results)
+                peer_infos = []
+                for name, device, email, ip in reallocated:
+                    by_key[(name, device)].vpn_ip = ip
+                    peer_infos.append(by_key[(name, device)])
+            records = [rtl.PeerRecord.from_peer_info(pi) for pi in peer_infos]
+            if store:
+                store.add_many(records)
+            else:
+                rtl.add_peers(records)
+    except ValueError as e:
+        for pi in peer_infos:
+            results[(pi.name, pi.device)] = PeerResult(error=str(e))
+        return results
+    if not peer_infos:
+        return results
+
+    # 5. Deploy updated server config once, through the helper if asked and wg0.conf exists
+    server_key, applied = None, False
+    if helper and deploy:
+        server_key, applied = rtr.helper_add_peers(c, records)
+    if deploy and not applied:
+        deploy_config(c, subnet=subnet, incremental=incremental, store=store, helper=helper)
+
+    # 6. Generate client configs
+    server_key = server_key or rtr.retrieve_server_public_key(c)
+    for pi in peer_infos:
+        config = rtl.generate_client_config(pi, server_key, f"{c.host}:51820", profile)
+        results[(pi.name, pi.device)] = PeerResult(peer_info=pi, config=config)
+
+    return results
+
+
+@rtt.operation("remove_peers")
+def remove_peers(c: Connection, peers: list[tuple[str, str]],
+                 subnet: str | None = None, incremental: bool = False,
+                 store: rtl.PeerStore | None = None, deploy: bool = True,
+                 helper: bool = False) -> dict[tuple[str, str], bool]:
+    """Remove several (name, device) peers with a single deploy."""
+    # 1. With the helper, note the peers' public keys before they go
+    if helper:
+        public_keys = _public_keys(store or rtl.get_peer_store(), peers)
+
+    # 2. Delete all peers from storage in one write
+    with rtt.span("remove peers"):
+        found = store.remove_many(peers) if store else rtl.remove_peers(peers)
+    results = dict(zip(peers, found))
+
+    # 3. Rebuild and deploy server config once if anything changed
+    if deploy and any(found) and not (helper and rtr.helper_remove_peers(c, public_keys)):
+        deploy_config(c, subnet=subnet, incremental=incremental, store=store, helper=helper)
+
+    return results
+
+
+@rtt.operation("remove_peers_where")
+def remove_peers_where(c: Connection, peer_filter: rtl.PeerFilter | None = None,
+                       subnet: str | None = None, incremental: bool = False,
+                       store: rtl.PeerStore | None = None, deploy: bool = True, helper: bool = False,
+                       **conditions) -> list[rtl.PeerRecord]:
+    """Remove every peer matching a filter, e.g. email="alice@example.com", with a single deploy."""
+    # 1. Delete matching peers from storage in one write
+    peer_filter = peer_filter or rtl.PeerFilter(**conditions)
+    with rtt.span("remove peers"):
+        removed = store.remove_where(peer_filter) if store else rtl.remove_peers_where(peer_filter)
+
+    # 2. Rebuild and deploy server config once if anything changed
+    if deploy and removed and not (helper and rtr.helper_remove_peers(c, [p.public_key for p in removed])):
+        deploy_config(c, subnet=subnet, incremental=incremental, store=store, helper=helper)
+
+    return removed
+
+
+@rtt.operation("deploy_config")
+def deploy_config(c: Connection, csv_path: str | None = None, subnet: str | None = None,
+                  incremental: bool = False, store: rtl.PeerStore | None = None, helper: bool = False) -> bool:
+    """Rebuild and deploy server config from peer database.
+
+    Returns False, skipping both the write and the reload, if the server already
+    has an identical config.
+
+    With incremental=True, peers are added and removed on the running interface with
+    `wg set` instead of restarting it, so connected clients stay up. A restart still
+    happens when the [Interface] section changes.
+
+    With helper=True the config is uploaded and then installed and applied by the
+    server-side helper in one exec, rather than in separate hash, install and
+    reload commands.
+    """
+    # 1. Read peers from the CSV file or store if given, else from the configured store,
+    #    refusing a subnet whose server Address would cut some of them off
+    if csv_path:
+        source = rtl.CsvPeerStore(csv_path)
+    else:
+        source = store or rtl.get_peer_store()
+    with rtt.span("check subnet"):
+        rtl.check_subnet(source.iter(), subnet)
     
-    # 2. Get server private key from /etc/wireguard/private.key
-    result = c.run("cat /etc/wireguard/private.key", hide=True, in_stream=False)
-    server_private_key = result.stdout.strip()
+    # 2. Get server private key and public interface (cached)
+    state = rtr.get_server_state(c)
+    server_private_key = state.private_key
+    interface = state.interface or "eth0"
     
-    # 3. Generate full server config
-    config_text = rtr.generate_server_config(peers, server_private_key)
+    # 3. Render the server config lazily, streaming peers straight from storage
+    def render():
+        return rtr.iter_server_config(source.iter(), server_private_key, subnet, interface)
     
-    # 4. Write to /etc/wireguard/wg0.conf
-    c.run(f"echo '{config_text}' | sudo tee /etc/wireguard/wg0.conf > /dev/null", hide=True, in_stream=False)
+    # 4. Let the server-side helper compare, install and apply it if asked
+    if helper:
+        return rtr.helper_apply_config(c, render, incremental)
+
+    # 5. In incremental mode, remember the running [Interface] settings
+    if incremental:
+        result = c.sudo(rtr.INTERFACE_SECTION_COMMAND, hide=True, in_stream=False, warn=True)
+        old_interface = rtr.interface_section(result.stdout) if result.ok else None
+
+    # 6. Upload /etc/wireguard/wg0.conf so the config survives reboots; nothing to do if unchanged
+    if not rtr.upload_config(c, render):
+        return False
     
-    # 5. Reload WireGuard
+    # 7. Apply only peer changes to the live interface, unless [Interface] changed
+    new_interface = rtr.interface_section(rtr.generate_interface_section(server_private_key, subnet, interface))
+    if incremental and old_interface == new_interface:
+        result = c.sudo("wg show wg0 dump", hide=True, in_stream=False, warn=True)
+        if result.ok:
+            running = rtr.parse_wg_dump(result.stdout)
+            desired = {p.public_key: f"{p.vpn_ip}/32" for p in source.iter()}
+            for cmd in rtr.peer_update_commands(desired, running):
+                c.sudo(cmd, hide=True, in_stream=False)
+            return True
+
+    # 8. Reload WireGuard
     c.sudo("systemctl restart wg-quick@wg0", hide=True, in_stream=False)
+    return True
 
 
 
@@ -0,0 +1,112 @@
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.remote as rtr
+import remotetools.tracing as rtt
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from fabric.connection import Connection
+from typing import Iterable
+
+# wg0.conf and the running peers in one round-trip
+SERVER_PEERS_COMMAND = f"sh -c 'cat {rtr.CONFIG_PATH}; echo {rtr.STATE_SEPARATOR}; wg show wg0 dump'"
+
+
+@dataclass
+class Drift:
+    """Differences between the peer store and a server."""
+    missing: list[rtl.PeerRecord] = field(default_factory=list)
+    orphans: dict[str, str] = field(default_factory=dict)
+    ip_mismatches: list[tuple[rtl.PeerRecord, str]] = field(default_factory=list)
+    key_mismatches: list[tuple[rtl.PeerRecord, str]] = field(default_factory=list)
+    unapplied: set[str] = field(default_factory=set)
+
+    @property
+    def in_sync(self) -> bool:
+        return not (self.missing or self.orphans or self.ip_mismatches or self.key_mismatches or self.unapplied)
+
+
+def _ip(allowed_ips: str) -> str:
+    """Return the first address of an AllowedIPs value, without its prefix length."""
+    return allowed_ips.split(",", 1)[0].strip().split("/", 1)[0]
+
+
+def diff_peers(records: Iterable[rtl.PeerRecord], server_peers: dict[str, str]) -> Drift:
+    """Compare stored peers with the server's peers (public key -> allowed IPs) in one pass over each.
+
+    Store-only peers are missing, server-only peers are orphans. A stored peer whose
+    key is on the server with another IP is an IP mismatch; one whose IP is on the
+    server under another key is a key mismatch.
+    """
+    drift = Drift()
+    server_ips = {public_key: _ip(allowed_ips) for public_key, allowed_ips in server_peers.items()}
+    keys_by_ip = {ip: public_key for public_key, ip in server_ips.items()}
+    matched = set()
+    for record in records:
+        ip = server_ips.get(record.public_key)
+        if ip is not None:
+            matched.add(record.public_key)
+            if ip != record.vpn_ip:
+                drift.ip_mismatches.append((record, ip))
+        elif record.vpn_ip in keys_by_ip:
+            server_key = keys_by_ip[record.vpn_ip]
+            matched.add(server_key)
+            drift.key_mismatches.append((record, server_key))
+        else:
+            drift.missing.append(record)
+    drift.orphans = {key: allowed_ips for key, allowed_ips in server_peers.items() if key not in matched}
+    return drift
+
+
+def fetch_server_peers(c: Connection) -> tuple[dict[str, str], dict[str, str]]:
+    """Return the peers in the server's wg0.conf and on its running interface."""
+    result = c.sudo(SERVER_PEERS_COMMAND, hide=True, in_stream=False, warn=True)
+    config_text, _, dump = result.stdout.partition(rtr.STATE_SEPARATOR)
+    return rtr.parse_config_peers(config_text), rtr.parse_wg_dump(dump.strip("\n"))
+
+
+@rtt.operation("check_drift")
+def check_drift(c: Connection, store: rtl.PeerStore | None = None) -> Drift:
+    """Compare the peer store with the server's wg0.conf and running interface."""
+    # 1. Fetch the server's peers
+    config_peers, running_peers = fetch_server_peers(c)
+
+    # 2. Diff against the store
+    with rtt.span("diff peers"):
+        source = store or rtl.get_peer_store()
+        drift = diff_peers(source.iter(), config_peers)
+        drift.unapplied = {key for key in config_peers.keys() | running_peers.keys()
+                           if (config_peers.get(key) or "").replace(" ", "") != running_peers.get(key)}
+    return drift
+
+
+@rtt.operation("reconcile")
+def reconcile(c: Connection, store: rtl.PeerStore | None = None, import_orphans: bool = False,
+              push: bool = False, subnet: str | None = None, incremental: bool = False) -> Drift:
+    """Detect drift and optionally repair it; returns the drift found before any changes.
+
+    import_orphans adds server-only peers to the store as imported-<public key> on
+    device "unknown" so they are kept on the next deploy. push then deploys the store to the server,
+    which removes any remaining orphans and fixes mismatched IPs and keys.
+    """
+    store = store or rtl.get_peer_store()
+
+    # 1. Find the differences
+    drift = check_drift(c, store)
+
+    # 2. Adopt server-only peers whose IP is still free in the store
+    if import_orphans and drift.orphans:
+        with rtt.span("import orphans"):
+            taken = {record.vpn_ip for record in store.iter()}
+            now = datetime.now(timezone.utc).isoformat()
+            imported = []
+            for public_key, allowed_ips in drift.orphans.items():
+                ip = _ip(allowed_ips)
+                if ip and ip not in taken:
+                    taken.add(ip)
+                    imported.append(rtl.PeerRecord(f"imported-{public_key}", public_key, "unknown", "", ip, now))
+            store.add_many(imported)
+
+    # 3. Make the server match the store
+    if push:
+        rto.deploy_config(c, subnet=subnet, incremental=incremental, store=store)
+    return drift
@@ -1,6 +1,59 @@
 import remotetools.local as rtl
+import remotetools.tracing as rtt
+import remotetools.wg_helper as rth
 import fabric
+import hashlib
+import heapq
+import io
+import ipaddress
+import json
+import logging
+import posixpath
+import threading
+import time
+from array import array
+from dataclasses import dataclass, field
 from invoke.exceptions import UnexpectedExit
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, TextIO
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = "/etc/wireguard/wg0.conf"
+KEY_FILES = "/etc/wireguard/private.key /etc/wireguard/public.key"
+# Structured output where iproute2 supports it, human-readable otherwise
+IP_ADDR_COMMAND = "ip -j addr 2>/dev/null || ip a"
+TELEMETRY_COMMAND = "wg show all dump"
+# The server-side helper lives next to the keys, readable only by root
+HELPER_PATH = "/etc/wireguard/myvpn-helper.py"
+HELPER_COMMAND = f"python3 {HELPER_PATH}"
+# A new directory only the SSH user can enter, to upload files to before installing them
+TMP_DIR_COMMAND = "mktemp -d"
+# Print wg0.conf up to the first [Peer] section without reading the rest
+INTERFACE_SECTION_COMMAND = f"sed -n '/^\\[Peer\\]/q;p' {CONFIG_PATH}"
+FINGERPRINT_COMMAND = f"stat -c '%n %Y %s %i' {KEY_FILES}"
+STATE_SEPARATOR = "---myvpn---"
+STATE_COMMAND = (
+    f"{FINGERPRINT_COMMAND}; echo {STATE_SEPARATOR}; "
+    f"cat /etc/wireguard/private.key; echo {STATE_SEPARATOR}; "
+    f"cat /etc/wireguard/public.key; echo {STATE_SEPARATOR}; "
+    f"{IP_ADDR_COMMAND}; echo {STATE_SEPARATOR}; "
+    "wg show wg0 listen-port 2>/dev/null; true"
+)
+
+
+@dataclass
+class ServerState:
+    """Server values that rarely change, cached per connection."""
+    public_key: str
+    private_key: str
+    interface: str | None
+    listen_port: int | None
+    fingerprint: str
+    checked_at: float = 0.0
+
+
+_server_state_cache: dict[str, ServerState] = {}
 
 def generate_client_keypair(c: fabric.connection.Connection) -> tuple[str, str]:
     """Generate WireGuard keypair for a client and return both keys."""
@@ -13,13 +66,118 @@ def generate_client_keypair(c: fabric.connection.Connection) -> tuple[str, str]:
         raise RuntimeError(f"Failed to generate client keypair: {e}")
 
 
-def retrieve_server_public_key(c: fabric.connection.Connection) -> str:
-    """Read and return the server's public key from /etc/wireguard/public.key"""
+def keypairs_command(count: int) -> str:
+    """Return a shell loop printing count "private public" keypair lines."""
+    return f'for i in $(seq {count}); do k=$(wg genkey); echo "$k $(echo -n "$k" | wg pubkey)"; done'
+
+
+def parse_keypairs(output: str, count: int) -> list[tuple[str, str]]:
+    """Parse the output of keypairs_command."""
+    keypairs = [tuple(line.split()) for line in output.splitlines() if line.strip()]
+    if len(keypairs) != count or any(len(kp) != 2 for kp in keypairs):
+        raise RuntimeError(f"Expected {count} keypairs, got unexpected output")
+    return keypairs
+
+
+def generate_client_keypairs(c: fabric.connection.Connection, count: int) -> list[tuple[str, str]]:
+    """Generate several WireGuard keypairs in a single round-trip."""
+    if count <= 0:
+        return []
     try:
-        result = c.run("cat /etc/wireguard/public.key", hide=True, in_stream=False)
-        return result.stdout.strip()
+        result = c.run(keypairs_command(count), hide=True, in_stream=False)
     except UnexpectedExit as e:
-        raise FileNotFoundError(f"Server public key not found at /etc/wireguard/public.key: {e}")
+        raise RuntimeError(f"Failed to generate client keypairs: {e}")
+    return parse_keypairs(result.stdout, count)
+
+
+def _state_key(c: fabric.connection.Connection) -> str:
+    return f"{c.user}@{c.host}:{c.port}"
+
+
+def parse_server_state(output: str) -> ServerState:
+    """Parse the output of STATE_COMMAND into a ServerState."""
+    sections = [section.strip() for section in output.split(STATE_SEPARATOR)]
+    if len(sections) != 5 or not sections[1] or not sections[2]:
+        raise FileNotFoundError("Server keys not found in /etc/wireguard")
+    fingerprint, private_key, public_key, ip_output, listen_port = sections
+    interfaces = [interface.name for interface in parse_interfaces(ip_output) if interface.is_public]
+    return ServerState(
+        public_key=public_key,
+        private_key=private_key,
+        interface=interfaces[0] if interfaces else None,
+        listen_port=int(listen_port) if listen_port.isdigit() else None,
+        fingerprint=fingerprint
+    )
+
+
+def cached_server_state(c, max_age: float = 60.0) -> tuple[ServerState | None, bool]:
+    """Return the cached state for a sync or async connection, if any, and whether it is younger than max_age."""
+    state = _server_state_cache.get(_state_key(c))
+    return state, state is not None and time.monotonic() - state.checked_at < max_age
+
+
+def revalidate_server_state(state: ServerState, fingerprint_output: str | None) -> bool:
+    """Keep a cached state if FINGERPRINT_COMMAND output (None if it failed) shows the key files unchanged."""
+    if fingerprint_output is None or fingerprint_output.strip() != state.fingerprint:
+        return False
+    state.checked_at = time.monotonic()
+    return True
+
+
+def cache_server_state(c, state_output: str) -> ServerState:
+    """Parse STATE_COMMAND output and cache it for a sync or async connection."""
+    state = parse_server_state(state_output)
+    state.checked_at = time.monotonic()
+    _server_state_cache[_state_key(c)] = state
+    return state
+
+
+def get_server_state(c: fabric.connection.Connection, max_age: float = 60.0) -> ServerState:
+    """Return cached server keys, interface and listen port, reading them in one command on a miss.
+
+    Entries younger than max_age seconds are used as is. Older entries are revalidated
+    with a single `stat` of the key files and only re-read if the keys changed.
+    """
+    state, fresh = cached_server_state(c, max_age)
+    if fresh:
+        return state
+    if state is not None:
+        result = c.run(FINGERPRINT_COMMAND, hide=True, in_stream=False, warn=True)
+        if revalidate_server_state(state, result.stdout if result.ok else None):
+            return state
+
+    result = c.run(STATE_COMMAND, hide=True, in_stream=False, warn=True)
+    return cache_server_state(c, result.stdout)
+
+
+def invalidate_server_state(c: fabric.connection.Connection | None = None):
+    """Drop the cached state for one connection, or for all connections."""
+    if c is None:
+        _server_state_cache.clear()
+    else:
+        _server_state_cache.pop(_state_key(c), None)
+
+
+def rotate_server_keys(c: fabric.connection.Connection):
+    """Generate a new server keypair in /etc/wireguard and invalidate the cached state.
+
+    Run deploy_config afterwards so wg0.conf picks up the new private key.
+    """
+    try:
+        c.sudo("sh -c 'umask 077; wg genkey | tee /etc/wireguard/private.key | wg pubkey > /etc/wireguard/public.key'",
+               hide=True, in_stream=False)
+    finally:
+        invalidate_server_state(c)
+
+
+def retrieve_server_public_key(c: fabric.connection.Connection) -> str:
+    """Return the server's public key from /etc/wireguard/public.key (cached)."""
+    return get_server_state(c).public_key
+
+
+def retrieve_server_private_key(c: fabric.connection.Connection) -> str:
+    """Return the server's private key from /etc/wireguard/private.key (cached)."""
+    return get_server_state(c).private_key
 
 
 
@@ -32,72 +190,475 @@ AllowedIPs = {peer_record.vpn_ip}/32
 """
 
 
-def generate_server_config(peer_records: list[rtl.PeerRecord], server_private_key: str) -> str:
-    """Generate complete WireGuard server config."""
-    interface = f"""[Interface]
-Address = 10.0.0.1/24
+def generate_interface_section(server_private_key: str, subnet: str | None = None, interface: str = "eth0") -> str:
+    """Generate the [Interface] section for the server config."""
+    return f"""[Interface]
+Address = {rtl.server_address(subnet)}
 ListenPort = 51820
 PrivateKey = {server_private_key}
-PostUp = iptables -A FORWARD -i %i -j ACCEPT; iptables -A FORWARD -o %i -j ACCEPT; iptables -t nat -A POSTROUTING -o eth0 -j MASQUERADE
-PostDown = iptables -D FORWARD -i %i -j ACCEPT; iptables -D FORWARD -o %i -j ACCEPT; iptables -t nat -D POSTROUTING -o eth0 -j MASQUERADE
+PostUp = iptables -A FORWARD -i %i -j ACCEPT; iptables -A FORWARD -o %i -j ACCEPT; iptables -t nat -A POSTROUTING -o {interface} -j MASQUERADE
+PostDown = iptables -D FORWARD -i %i -j ACCEPT; iptables -D FORWARD -o %i -j ACCEPT; iptables -t nat -D POSTROUTING -o {interface} -j MASQUERADE
 """
-    
-    peers = "".join(generate_peer_section(pr) for pr in peer_records)
-    return interface + peers
 
 
-def get_public_interfaces(output: str) -> tuple[int, list[str]]:
-    """Parse ip a output and return count and list of public-facing interfaces."""
-    lines = output.splitlines()
-    interface_blocks = []
-    interface_block = []
-
-    # Split into interface blocks
-    for line in lines:
-        if len(line) == 0:
+def iter_server_config(peer_records: Iterable[rtl.PeerRecord], server_private_key: str,
+                       subnet: str | None = None, interface: str = "eth0",
+                       peers_per_chunk: int = 256) -> Iterator[str]:
+    """Yield the server config in chunks, consuming peers lazily so memory stays constant."""
+    yield generate_interface_section(server_private_key, subnet, interface)
+    chunk = []
+    for pr in peer_records:
+        chunk.append(generate_peer_section(pr))
+        if len(chunk) >= peers_per_chunk:
+            yield "".join(chunk)
+            chunk.clear()
+    if chunk:
+        yield "".join(chunk)
+
+
+def generate_server_config(peer_records: list[rtl.PeerRecord], server_private_key: str, subnet: str | None = None,
+                           interface: str = "eth0") -> str:
+    """Generate complete WireGuard server config."""
+    return "".join(iter_server_config(peer_records, server_private_key, subnet, interface))
+
+
+def write_server_config(sink: TextIO, peer_records: Iterable[rtl.PeerRecord], server_private_key: str,
+                        subnet: str | None = None, interface: str = "eth0") -> int:
+    """Stream the server config into a file-like sink and return the number of characters written."""
+    written = 0
+    for chunk in iter_server_config(peer_records, server_private_key, subnet, interface):
+        sink.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def upload_config(c: fabric.connection.Connection, config: str | Callable[[], Iterable[str]],
+                  remote_path: str = CONFIG_PATH) -> bool:
+    """Upload a config over SFTP and atomically move it into place with mode 0600.
+
+    config is either the full text or a callable returning an iterable of chunks, which
+    is called twice: once to hash, once to stream the upload. Returns False, without
+    writing anything, if the remote file already has the same SHA-256.
+    """
+    render = (lambda: [config]) if isinstance(config, str) else config
+
+    result = c.sudo(f"sha256sum {remote_path}", hide=True, in_stream=False, warn=True)
+    if unchanged(render, result.stdout if result.ok else ""):
+        return False
+
+    # Stream into a private temp directory, then install next to the target and rename over it
+    tmp_path = upload_tmp_path(make_tmp_dir(c), remote_path)
+    upload_private(c, tmp_path, render())
+    c.sudo(install_command(tmp_path, remote_path), hide=True, in_stream=False)
+    return True
+
+
+def upload_private(c: fabric.connection.Connection, path: str, chunks: Iterable[str]) -> int:
+    """Stream chunks over SFTP to a new file and return the bytes written.
+
+    SFTP creates the file with the server's default mode, so path must be in a
+    directory only the SSH user can enter, see make_tmp_dir.
+    """
+    with rtt.span("sftp upload", c.host, path) as record, c.sftp().open(path, "wb") as f:
+        # Don't wait for an ack per write, so rendering overlaps with the transfer
+        if hasattr(f, "set_pipelined"):
+            f.set_pipelined(True)
+        for chunk in chunks:
+            data = chunk.encode()
+            f.write(data)
+            record.bytes_sent += len(data)
+    return record.bytes_sent
+
+
+def unchanged(render: Callable[[], Iterable[str]], sha256sum_output: str) -> bool:
+    """True if the rendered config hashes to the digest in `sha256sum` output."""
+    digest = hashlib.sha256()
+    with rtt.span("hash config"):
+        for chunk in render():
+            digest.update(chunk.encode())
+    return sha256sum_output.split()[:1] == [digest.hexdigest()]
+
+
+def make_tmp_dir(c: fabric.connection.Connection) -> str:
+    """Create a temp directory on the server with mode 0700 and return its path."""
+    return c.run(TMP_DIR_COMMAND, hide=True, in_stream=False).stdout.strip()
+
+
+def upload_tmp_path(tmp_dir: str, remote_path: str) -> str:
+    """Return the path in a private temp directory to upload a file to before installing it."""
+    return posixpath.join(tmp_dir, posixpath.basename(remote_path))
+
+
+def install_command(tmp_path: str, remote_path: str = CONFIG_PATH) -> str:
+    """Return the command that installs an uploaded file as root with mode 0600 and atomically replaces the target.
+
+    The uploaded file and its temp directory are removed afterwards.
+    """
+    staged_path = posixpath.join(posixpath.dirname(remote_path), f".{posixpath.basename(remote_path)}.tmp")
+    return (
+        f"sh -c 'install -m 600 -o root -g root {tmp_path} {staged_path} && mv {staged_path} {remote_path}; "
+        f"status=$?; rm -f {tmp_path}; rmdir {posixpath.dirname(tmp_path)}; exit $status'"
+    )
+
+
+def install_helper(c: fabric.connection.Connection) -> bool:
+    """Upload the server-side helper script; returns False if the installed copy is already current."""
+    return upload_config(c, Path(rth.__file__).read_text(), HELPER_PATH)
+
+
+def call_helper(c: fabric.connection.Connection, ops: list[dict]) -> list[dict]:
+    """Run a batch of helper operations in one exec and return a result per operation.
+
+    The request carries the helper version; if the server's copy is missing or
+    from another version it is (re)installed and the request sent once more.
+    The request goes over stdin, so the connection must be root or have
+    passwordless sudo.
+    """
+    payload = json.dumps({"version": rth.VERSION, "ops": ops})
+    for attempt in range(2):
+        result = c.sudo(HELPER_COMMAND, hide=True, in_stream=io.StringIO(payload), warn=True)
+        try:
+            response = json.loads(result.stdout)
+        except ValueError:
+            response = {}
+        if response.get("version") == rth.VERSION:
+            break
+        if attempt:
+            raise RuntimeError(f"Server-side helper failed: {result.stderr.strip() or result.stdout.strip()}")
+        install_helper(c)
+    if "error" in response:
+        raise RuntimeError(f"Server-side helper failed: {response['error']}")
+    return response["results"]
+
+
+def helper_add_peers(c: fabric.connection.Connection, peer_records: list[rtl.PeerRecord]) -> tuple[str, bool]:
+    """Add peers to wg0.conf and the live interface in one round trip.
+
+    Returns the server public key and whether the peers were applied; they are
+    not if the server has no wg0.conf yet, in which case run deploy_config.
+    """
+    server_key, added = call_helper(c, [
+        {"op": "server_key"},
+        {"op": "add_peers", "sections": [generate_peer_section(pr) for pr in peer_records]},
+    ])
+    return server_key["public_key"], added["applied"]
+
+
+def helper_remove_peers(c: fabric.connection.Connection, public_keys: list[str]) -> bool:
+    """Remove peers from wg0.conf and the live interface in one round trip; False if there is no wg0.conf."""
+    [removed] = call_helper(c, [{"op": "remove_peers", "public_keys": public_keys}])
+    return removed["applied"]
+
+
+def helper_apply_config(c: fabric.connection.Connection, config: str | Callable[[], Iterable[str]],
+                        incremental: bool = False) -> bool:
+    """Upload a complete wg0.conf and have the helper install and apply it; returns False if it was unchanged.
+
+    The config goes over SFTP rather than in the request, keeping the private key
+    off stdin and large configs fast.
+    """
+    tmp_path = upload_tmp_path(make_tmp_dir(c), CONFIG_PATH)
+    upload_private(c, tmp_path, [config] if isinstance(config, str) else config())
+    [applied] = call_helper(c, [{"op": "apply_config", "path": tmp_path, "incremental": incremental}])
+    return applied["changed"]
+
+
+def interface_section(config_text: str) -> str:
+    """Return the [Interface] part of a WireGuard config, i.e. everything before the first [Peer]."""
+    return config_text.split("[Peer]", 1)[0].strip()
+
+
+def parse_wg_dump(output: str) -> dict[str, str]:
+    """Parse `wg show <interface> dump` output into a map of peer public key to allowed IPs."""
+    peers = {}
+    for line in output.splitlines()[1:]:
+        fields = line.split("\t")
+        if len(fields) >= 4:
+            peers[fields[0]] = fields[3]
+    return peers
+
+
+def parse_config_peers(config_text: str) -> dict[str, str]:
+    """Parse the [Peer] sections of a wg0.conf into a map of peer public key to allowed IPs."""
+    peers = {}
+    public_key = allowed_ips = None
+    in_peer = False
+    for line in config_text.splitlines() + ["[End]"]:
+        line = line.split("#", 1)[0].strip()
+        if line.startswith("["):
+            if in_peer and public_key:
+                peers[public_key] = allowed_ips or ""
+            in_peer = line == "[Peer]"
+            public_key = allowed_ips = None
+        elif in_peer and "=" in line:
+            key, value = (part.strip() for part in line.split("=", 1))
+            if key == "PublicKey":
+                public_key = value
+            elif key == "AllowedIPs":
+                allowed_ips = value
+    return peers
+
+
+def peer_update_commands(desired: dict[str, str], running: dict[str, str], interface: str = "wg0",
+                         batch_size: int = 200) -> list[str]:
+    """Build `wg set` commands that turn the running peer set into the desired one."""
+    changes = [f"peer {pk} allowed-ips {ips}" for pk, ips in desired.items() if running.get(pk) != ips]
+    changes += [f"peer {pk} remove" for pk in running if pk not in desired]
+    return [
+        f"wg set {interface} " + " ".join(changes[i:i + batch_size])
+        for i in range(0, len(changes), batch_size)
+    ]
+
+
+@dataclass
+class NetworkInterface:
+    """A network interface with its globally routable addresses."""
+    name: str
+    state: str
+    mtu: int | None = None
+    flags: list[str] = field(default_factory=list)
+    ipv4: list[str] = field(default_factory=list)
+    ipv6: list[str] = field(default_factory=list)
+
+    @property
+    def is_public(self) -> bool:
+        """True for an up, broadcast-capable, non-WireGuard interface with a global IPv4 address."""
+        return (self.name != "lo" and not self.name.startswith("wg") and "BROADCAST" in self.flags
+                and self.state == "UP" and bool(self.ipv4))
+
+
+def _add_address(interface: NetworkInterface, family: str, address: str):
+    """Record an address on the interface if it is globally routable."""
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return
+    if not ip.is_global:
+        return
+    if family == "inet":
+        interface.ipv4.append(address)
+    elif family == "inet6":
+        interface.ipv6.append(address)
+
+
+def parse_ip_json(output: str) -> list[NetworkInterface]:
+    """Parse `ip -j addr` output in a single pass."""
+    interfaces = []
+    for link in json.loads(output):
+        interface = NetworkInterface(
+            name=link.get("ifname", ""),
+            state=link.get("operstate", "UNKNOWN"),
+            mtu=link.get("mtu"),
+            flags=link.get("flags", [])
+        )
+        for addr in link.get("addr_info", []):
+            _add_address(interface, addr.get("family"), addr.get("local", ""))
+        interfaces.append(interface)
+    return interfaces
+
+
+def parse_ip_text(output: str) -> list[NetworkInterface]:
+    """Parse human-readable `ip a` output, for hosts whose iproute2 lacks JSON support."""
+    interfaces = []
+    for line in output.splitlines():
+        if not line.strip():
             continue
+        fields = line.split()
         if line[0].isdigit():
-            if len(interface_block) > 0:
-                interface_blocks.append(interface_block)
-                interface_block = []
-        interface_block.append(line)
-    
-    if len(interface_block) > 0:
-        interface_blocks.append(interface_block)
-    
-    # Filter candidates
-    candidates = []
-    for block in interface_blocks:
-        line = block[0].split()
-        interf = line[1].replace(":", "")
-        
-        # Skip loopback and wireguard
-        if interf == 'lo' or interf.startswith('wg'):
-            continue
-        
-        # Check for BROADCAST and UP state
-        if "BROADCAST" not in block[0] or "state UP" not in block[0]:
-            continue
-        
-        # Check for public IP (not 127.x, 10.x, 192.168.x, 172.16-31.x)
-        has_public = False
-        for line in block[1:]:
-            if 'inet ' in line and 'inet6' not in line:
-                ip = line.split()[1].split('/')[0]
-                if not (ip.startswith('127.') or 
-                       ip.startswith('10.') or 
-                       ip.startswith('192.168.') or
-                       (ip.startswith('172.') and 16 <= int(ip.split('.')[1]) <= 31)):
-                    has_public = True
-                    break
-        
-        if has_public:
-            candidates.append(interf)
-    
+            # e.g. "2: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc fq_codel state UP ..."
+            flags = fields[2].strip("<>").split(",") if len(fields) > 2 else []
+            interface = NetworkInterface(
+                name=fields[1].rstrip(":").split("@")[0],
+                state=fields[fields.index("state") + 1] if "state" in fields[:-1] else "UNKNOWN",
+                mtu=int(fields[fields.index("mtu") + 1]) if "mtu" in fields[:-1] else None,
+                flags=flags
+            )
+            interfaces.append(interface)
+        elif interfaces and fields[0] in ("inet", "inet6") and len(fields) > 1:
+            _add_address(interfaces[-1], fields[0], fields[1].split("/")[0])
+    return interfaces
+
+
+def parse_interfaces(output: str) -> list[NetworkInterface]:
+    """Parse `ip -j addr` output, falling back to the text parser for plain `ip a` output."""
+    if output.lstrip().startswith("["):
+        return parse_ip_json(output)
+    return parse_ip_text(output)
+
+
+def get_public_interfaces(output: str) -> tuple[int, list[str]]:
+    """Parse ip a (or ip -j addr) output and return count and list of public-facing interfaces."""
+    candidates = [interface.name for interface in parse_interfaces(output) if interface.is_public]
     return len(candidates), candidates
 
-    
-def detect_network_interface(c: Connection) -> tuple[int, list[str]]:
+
+def detect_interfaces(c: fabric.connection.Connection) -> list[NetworkInterface]:
+    """Return all network interfaces on the server."""
+    result = c.run(IP_ADDR_COMMAND, hide=True, in_stream=False)
+    return parse_interfaces(result.stdout)
+
+
+def detect_network_interface(c: fabric.connection.Connection) -> tuple[int, list[str]]:
     """Detect public-facing network interface on the server."""
-    result = c.run("ip a", hide=True, in_stream=False)
-    return get_public_interfaces(result.stdout)
\ No newline at end of file
+    candidates = [interface.name for interface in detect_interfaces(c) if interface.is_public]
+    return len(candidates), candidates
+
+
+@dataclass
+class TelemetrySample:
+    """One poll of `wg show all dump`, stored column-wise with one slot per peer."""
+    taken_at: float
+    interfaces: list[str] = field(default_factory=list)
+    public_keys: list[str] = field(default_factory=list)
+    endpoints: list[str] = field(default_factory=list)
+    handshakes: array = field(default_factory=lambda: array("q"))
+    rx_bytes: array = field(default_factory=lambda: array("q"))
+    tx_bytes: array = field(default_factory=lambda: array("q"))
+    rx_rates: array = field(default_factory=lambda: array("d"))
+    tx_rates: array = field(default_factory=lambda: array("d"))
+    index: dict[str, int] = field(default_factory=dict)
+
+    def __len__(self) -> int:
+        return len(self.public_keys)
+
+
+@dataclass
+class PeerActivity:
+    """Runtime view of one peer, joined to its stored record when known."""
+    public_key: str
+    interface: str
+    endpoint: str | None
+    latest_handshake: int
+    rx_bytes: int
+    tx_bytes: int
+    rx_rate: float
+    tx_rate: float
+    peer: rtl.PeerRecord | None = None
+
+
+def parse_telemetry(output: str, taken_at: float) -> TelemetrySample:
+    """Parse `wg show all dump` output, skipping the per-interface lines."""
+    sample = TelemetrySample(taken_at)
+    for line in output.splitlines():
+        fields = line.split("\t")
+        # interface, public key, preshared key, endpoint, allowed ips, handshake, rx, tx, keepalive
+        if len(fields) < 9:
+            continue
+        sample.index[fields[1]] = len(sample.public_keys)
+        sample.interfaces.append(fields[0])
+        sample.public_keys.append(fields[1])
+        sample.endpoints.append(fields[3])
+        sample.handshakes.append(int(fields[5]))
+        sample.rx_bytes.append(int(fields[6]))
+        sample.tx_bytes.append(int(fields[7]))
+    return sample
+
+
+def compute_rates(sample: TelemetrySample, previous: TelemetrySample | None):
+    """Fill in bytes per second since the previous sample. Counters that went backwards count from zero."""
+    count = len(sample)
+    sample.rx_rates = array("d", bytes(8 * count))
+    sample.tx_rates = array("d", bytes(8 * count))
+    if previous is None:
+        return
+    elapsed = sample.taken_at - previous.taken_at
+    if elapsed <= 0:
+        return
+    for i, public_key in enumerate(sample.public_keys):
+        j = previous.index.get(public_key)
+        if j is None:
+            continue
+        rx = sample.rx_bytes[i] - previous.rx_bytes[j]
+        tx = sample.tx_bytes[i] - previous.tx_bytes[j]
+        sample.rx_rates[i] = (rx if rx >= 0 else sample.rx_bytes[i]) / elapsed
+        sample.tx_rates[i] = (tx if tx >= 0 else sample.tx_bytes[i]) / elapsed
+
+
+class TelemetryCollector:
+    """Poll a server's WireGuard counters and answer questions about peer activity."""
+
+    def __init__(self, c: fabric.connection.Connection, interval: float = 30.0,
+                 store: rtl.PeerStore | None = None):
+        self.c = c
+        self.interval = interval
+        self.store = store
+        self.sample: TelemetrySample | None = None
+        self._peers: dict[str, rtl.PeerRecord] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def refresh_peers(self):
+        """Rebuild the public key index over the peer store."""
+        store = self.store or rtl.get_peer_store()
+        self._peers = {record.public_key: record for record in store.iter()}
+
+    def poll(self) -> TelemetrySample:
+        """Take a sample and compute rates against the previous one."""
+        result = self.c.sudo(TELEMETRY_COMMAND, hide=True, in_stream=False)
+        sample = parse_telemetry(result.stdout, time.time())
+        compute_rates(sample, self.sample)
+        if self.sample is None or any(key not in self._peers for key in sample.public_keys):
+            self.refresh_peers()
+        self.sample = sample
+        return sample
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning("telemetry poll on %s failed: %s", self.c.host, e)
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Poll every interval in a background thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"telemetry-{self.c.host}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def activity(self, i: int) -> PeerActivity:
+        """Return the peer in slot i of the latest sample."""
+        sample = self.sample
+        endpoint = sample.endpoints[i]
+        return PeerActivity(
+            public_key=sample.public_keys[i],
+            interface=sample.interfaces[i],
+            endpoint=None if endpoint == "(none)" else endpoint,
+            latest_handshake=sample.handshakes[i],
+            rx_bytes=sample.rx_bytes[i],
+            tx_bytes=sample.tx_bytes[i],
+            rx_rate=sample.rx_rates[i],
+            tx_rate=sample.tx_rates[i],
+            peer=self._peers.get(sample.public_keys[i])
+        )
+
+    def peer(self, public_key: str) -> PeerActivity | None:
+        """Return the activity of one peer, or None if the server does not know it."""
+        if self.sample is None or public_key not in self.sample.index:
+            return None
+        return self.activity(self.sample.index[public_key])
+
+    def stale(self, hours: float, now: float | None = None, include_never: bool = True) -> list[PeerActivity]:
+        """Return peers whose latest handshake is older than the given number of hours."""
+        if self.sample is None:
+            return []
+        cutoff = (time.time() if now is None else now) - hours * 3600
+        handshakes = self.sample.handshakes
+        return [self.activity(i) for i in range(len(handshakes))
+                if (handshakes[i] == 0 and include_never) or 0 < handshakes[i] < cutoff]
+
+    def top_talkers(self, n: int = 10) -> list[PeerActivity]:
+        """Return the n peers with the highest combined rx and tx rate in the latest sample."""
+        if self.sample is None:
+            return []
+        rx, tx = self.sample.rx_rates, self.sample.tx_rates
+        return [self.activity(i) for i in heapq.nlargest(n, range(len(rx)), key=lambda i: rx[i] + tx[i])]
@@ -0,0 +1,128 @@
+import threading
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from fabric.connection import Connection
+from typing import Callable
+
+
+def _server_key(c: Connection) -> str:
+    return f"{c.user}@{c.host}:{c.port}"
+
+
+@dataclass
+class _Batch:
+    connection: Connection
+    kwargs: dict
+    futures: list[Future] = field(default_factory=list)
+    timer: threading.Timer | None = None
+
+
+class DeployScheduler:
+    """Coalesce deploy requests so each server gets one deploy per window.
+
+    The first request for a server opens a window of `window` seconds; every
+    request arriving before it closes, or until `max_batch` requests have
+    queued, is served by a single deploy_config call. Each request returns a
+    Future that resolves to that deploy's result. Deploys to one server never
+    overlap; deploys to different servers run independently.
+    """
+
+    def __init__(self, window: float = 2.0, max_batch: int = 100,
+                 deploy: Callable[..., bool] | None = None):
+        self.window = window
+        self.max_batch = max_batch
+        self.deploy = deploy
+        self.requests = 0
+        self.deploys = 0
+        self._lock = threading.Lock()
+        self._batches: dict[str, _Batch] = {}
+        self._server_locks: dict[str, threading.Lock] = {}
+
+    def request(self, c: Connection, **kwargs) -> Future:
+        """Mark a server dirty and return a Future for the deploy that will include the change.
+
+        kwargs are passed to deploy_config; the latest request's kwargs win.
+        """
+        key = _server_key(c)
+        future = Future()
+        with self._lock:
+            self.requests += 1
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = _Batch(c, kwargs)
+                batch.timer = threading.Timer(self.window, self._flush, (key, batch))
+                batch.timer.daemon = True
+                batch.timer.start()
+            batch.kwargs = kwargs
+            batch.futures.append(future)
+            if len(batch.futures) >= self.max_batch:
+                # Close the batch now so later requests open a new window
+                batch.timer.cancel()
+                del self._batches[key]
+                threading.Thread(target=self._deploy, args=(key, batch), daemon=True).start()
+        return future
+
+    def _flush(self, key: str, batch: _Batch):
+        # Timer callback: deploy the batch unless it was already closed
+        with self._lock:
+            if self._batches.get(key) is not batch:
+                return
+            del self._batches[key]
+        self._deploy(key, batch)
+
+    def _deploy(self, key: str, batch: _Batch):
+        with self._lock:
+            server_lock = self._server_locks.setdefault(key, threading.Lock())
+        with server_lock:
+            deploy = self.deploy or rto.deploy_config
+            try:
+                result = deploy(batch.connection, **batch.kwargs)
+            except Exception as e:
+                for future in batch.futures:
+                    future.set_exception(e)
+            else:
+                for future in batch.futures:
+                    future.set_result(result)
+            finally:
+                with self._lock:
+                    self.deploys += 1
+
+    def flush(self):
+        """Deploy every pending server now and wait for the deploys to finish."""
+        with self._lock:
+            batches = list(self._batches.items())
+            self._batches.clear()
+            for _, batch in batches:
+                batch.timer.cancel()
+        for key, batch in batches:
+            self._deploy(key, batch)
+
+    def close(self):
+        """Flush pending deploys."""
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add_peer(self, c: Connection, name: str, device: str, email: str,
+                 subnet: str | None = None, incremental: bool = False,
+                 store: rtl.PeerStore | None = None, **kwargs) -> tuple[str | None, Future | None]:
+        """Add a peer to the store now and schedule the deploy. Returns (client config, deploy future)."""
+        config = rto.add_peer(c, name, device, email, subnet=subnet, incremental=incremental,
+                              store=store, deploy=False, **kwargs)
+        if config is None:
+            return None, None
+        return config, self.request(c, subnet=subnet, incremental=incremental, store=store)
+
+    def remove_peer(self, c: Connection, name: str, device: str, subnet: str | None = None,
+                    incremental: bool = False, store: rtl.PeerStore | None = None) -> tuple[bool, Future | None]:
+        """Remove a peer from the store now and schedule the deploy. Returns (found, deploy future)."""
+        if not rto.remove_peer(c, name, device, subnet=subnet, incremental=incremental,
+                               store=store, deploy=False):
+            return False, None
+        return True, self.request(c, subnet=subnet, incremental=incremental, store=store)
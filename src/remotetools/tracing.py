@@ -0,0 +1,247 @@
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import re
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    """Timing for one remote command or local step."""
+    name: str
+    host: str | None = None
+    command: str | None = None
+    duration: float = 0.0
+    exit_status: int | None = None
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    error: str | None = None
+    operation: str | None = None
+
+
+@dataclass
+class Operation:
+    """A top-level orchestration call and the spans recorded while it ran."""
+    name: str
+    host: str | None = None
+    duration: float = 0.0
+    error: str | None = None
+    spans: list[Span] = field(default_factory=list)
+
+    def breakdown(self) -> dict[str, float]:
+        """Return the total seconds spent per span name, slowest first."""
+        totals = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def report(self) -> str:
+        """Format the breakdown as a small text table."""
+        lines = [f"{self.name} on {self.host}: {self.duration * 1000:.1f} ms"]
+        for name, seconds in self.breakdown().items():
+            lines.append(f"  {seconds * 1000:9.1f} ms  {name}")
+        return "\n".join(lines)
+
+
+class MemorySink:
+    """Keep spans and operations in lists, e.g. for tests."""
+
+    def __init__(self):
+        self.spans = []
+        self.operations = []
+
+    def emit_span(self, span: Span):
+        self.spans.append(span)
+
+    def emit_operation(self, operation: Operation):
+        self.operations.append(operation)
+
+
+class LoggingSink:
+    """Log spans at DEBUG and operation breakdowns at INFO."""
+
+    def __init__(self, log: logging.Logger = logger):
+        self.log = log
+
+    def emit_span(self, span: Span):
+        self.log.debug("%s %s %.1f ms exit=%s", span.host, span.name, span.duration * 1000, span.exit_status)
+
+    def emit_operation(self, operation: Operation):
+        self.log.info("%s", operation.report())
+
+
+class JsonLinesSink:
+    """Append spans and operations to a JSON lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, record: dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def emit_span(self, span: Span):
+        self._write({"type": "span", **asdict(span)})
+
+    def emit_operation(self, operation: Operation):
+        self._write({
+            "type": "operation",
+            "name": operation.name,
+            "host": operation.host,
+            "duration": operation.duration,
+            "error": operation.error,
+            "breakdown": operation.breakdown(),
+        })
+
+
+# Quoted arguments and echoed text are where secrets such as private keys appear
+_QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"")
+_ECHOED = re.compile(r"\b(echo|printf)\b[^|;&\n]*?(\s*)(?=[|;&\n]|$)")
+
+
+def redact(text: str) -> str:
+    """Mask quoted arguments and echoed text in a command or error message."""
+    text = _QUOTED.sub("'***'", text)
+    return _ECHOED.sub(r"\1 ***\2", text)
+
+
+def _describe(e: Exception) -> str:
+    return redact(f"{type(e).__name__}: {e}")
+
+
+_sinks: list = []
+_current_operation: contextvars.ContextVar[Operation | None] = contextvars.ContextVar(
+    "remotetools_operation", default=None
+)
+
+
+def add_sink(sink):
+    """Start sending spans and operations to a sink."""
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    """Stop sending spans and operations to a sink."""
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+@contextmanager
+def span(name: str, host: str | None = None, command: str | None = None) -> Iterator[Span]:
+    """Time a block as a named span and report it to the sinks and the current operation.
+
+    The command and any error are redacted before they are recorded.
+    """
+    current = _current_operation.get()
+    record = Span(name, host, redact(command) if command else command, operation=current.name if current else None)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record.error = _describe(e)
+        result = getattr(e, "result", None)
+        if record.exit_status is None and result is not None:
+            record.exit_status = getattr(result, "exited", None)
+        raise
+    finally:
+        record.duration = time.perf_counter() - start
+        if current is not None:
+            current.spans.append(record)
+        for sink in _sinks:
+            sink.emit_span(record)
+
+
+def command_span(command: str, host: str | None = None):
+    """Time a remote command as a span named after its first two (redacted) words."""
+    return span(" ".join(redact(command).split()[:2]), host, command)
+
+
+def operation(name: str):
+    """Decorate an orchestration function so its spans are grouped and reported as one operation.
+
+    The first argument, the connection, is wrapped in a TracedConnection. Nested
+    operations are recorded as spans of the outermost one. Coroutine functions
+    are timed the same way; their connection is left as is, since async
+    connections record their own spans.
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(c, *args, **kwargs):
+                if _current_operation.get() is not None:
+                    with span(name, c.host):
+                        return await fn(c, *args, **kwargs)
+
+                current = Operation(name, c.host)
+                token = _current_operation.set(current)
+                start = time.perf_counter()
+                try:
+                    return await fn(c, *args, **kwargs)
+                except Exception as e:
+                    current.error = _describe(e)
+                    raise
+                finally:
+                    current.duration = time.perf_counter() - start
+                    _current_operation.reset(token)
+                    for sink in _sinks:
+                        sink.emit_operation(current)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(c, *args, **kwargs):
+            c = traced(c)
+            if _current_operation.get() is not None:
+                with span(name, c.host):
+                    return fn(c, *args, **kwargs)
+
+            current = Operation(name, c.host)
+            token = _current_operation.set(current)
+            start = time.perf_counter()
+            try:
+                return fn(c, *args, **kwargs)
+            except Exception as e:
+                current.error = _describe(e)
+                raise
+            finally:
+                current.duration = time.perf_counter() - start
+                _current_operation.reset(token)
+                for sink in _sinks:
+                    sink.emit_operation(current)
+        return wrapper
+    return decorator
+
+
+class TracedConnection:
+    """Wrap a fabric Connection so every run and sudo call is recorded as a span."""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def _traced(self, method, command, **kwargs):
+        with command_span(command, self._connection.host) as record:
+            record.bytes_sent = len(command)
+            result = getattr(self._connection, method)(command, **kwargs)
+            record.exit_status = getattr(result, "exited", None)
+            record.bytes_received = len(getattr(result, "stdout", "") or "") + len(getattr(result, "stderr", "") or "")
+            return result
+
+    def run(self, command, **kwargs):
+        return self._traced("run", command, **kwargs)
+
+    def sudo(self, command, **kwargs):
+        return self._traced("sudo", command, **kwargs)
+
+
+def traced(c):
+    """Return c wrapped in a TracedConnection, unless it already is one."""
+    return c if isinstance(c, TracedConnection) else TracedConnection(c)
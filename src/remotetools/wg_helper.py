@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""Server-side helper that applies a batch of WireGuard operations in one exec.
+
+remotetools installs this file on the server and runs it with a JSON request on
+stdin, {"version": N, "ops": [{"op": ...}, ...]}, answering with one JSON
+response, {"version": N, "results": [...]}, or {"version": N, "error": ...}.
+It uses only the standard library so it runs on any server with python3.
+"""
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+
+VERSION = 2
+# Exit status when the request was written for another helper version
+EXIT_OUTDATED = 3
+
+CONFIG_PATH = "/etc/wireguard/wg0.conf"
+PUBLIC_KEY_PATH = "/etc/wireguard/public.key"
+INTERFACE = "wg0"
+
+
+class LocalSystem:
+    """Files and commands on this machine."""
+
+    def read(self, path):
+        try:
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, path, text, mode=0o600):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".helper.")
+        try:
+            os.fchmod(fd, mode)
+            with os.fdopen(fd, "w") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def remove(self, path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def remove_dir(self, path):
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+    def run(self, args):
+        process = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        return process.returncode, process.stdout
+
+
+def split_config(text):
+    """Split a wg0.conf into the text before the first [Peer] and its [Peer] sections."""
+    parts = re.split(r"\n(?=\[Peer\]\s*\n)", text)
+    return parts[0], ["\n" + part for part in parts[1:]]
+
+
+def join_config(head, sections):
+    return head + "".join(sections)
+
+
+def section_peer(section):
+    """Return (public key, allowed IPs) of a [Peer] section."""
+    fields = {}
+    for line in section.splitlines():
+        key, sep, value = line.split("#", 1)[0].partition("=")
+        if sep:
+            fields[key.strip()] = value.strip()
+    allowed_ips = ",".join(ip.strip() for ip in fields.get("AllowedIPs", "").split(","))
+    return fields.get("PublicKey"), allowed_ips
+
+
+def running_peers(system):
+    """Return the running interface's peers (public key -> allowed IPs), or None if it is down."""
+    status, output = system.run(["wg", "show", INTERFACE, "dump"])
+    if status != 0:
+        return None
+    peers = {}
+    for line in output.splitlines()[1:]:
+        fields = line.split("\t")
+        if len(fields) >= 4:
+            peers[fields[0]] = fields[3]
+    return peers
+
+
+def set_peers(system, changes):
+    """Apply `wg set` peer changes, e.g. ["peer KEY allowed-ips IP", "peer KEY remove"], in batches."""
+    for i in range(0, len(changes), 200):
+        args = ["wg", "set", INTERFACE]
+        for change in changes[i:i + 200]:
+            args += change.split()
+        status, _ = system.run(args)
+        if status != 0:
+            raise RuntimeError("wg set failed")
+
+
+def restart(system):
+    status, _ = system.run(["systemctl", "restart", "wg-quick@" + INTERFACE])
+    if status != 0:
+        raise RuntimeError("systemctl restart wg-quick@{} failed".format(INTERFACE))
+    return {"restarted": True}
+
+
+def op_server_key(system, op):
+    public_key = system.read(PUBLIC_KEY_PATH)
+    if public_key is None:
+        raise RuntimeError("server keys not found in /etc/wireguard")
+    return {"public_key": public_key.strip()}
+
+
+def op_add_peers(system, op):
+    """Add or update [Peer] sections in wg0.conf and on the running interface."""
+    config = system.read(CONFIG_PATH)
+    if config is None:
+        return {"applied": False}
+    head, sections = split_config(config)
+    added = {section_peer(section)[0]: section for section in op["sections"]}
+    sections = [section for section in sections if section_peer(section)[0] not in added]
+    sections += list(added.values())
+    system.write(CONFIG_PATH, join_config(head, sections))
+    if running_peers(system) is None:
+        return dict(restart(system), applied=True)
+    set_peers(system, ["peer {} allowed-ips {}".format(*section_peer(section)) for section in added.values()])
+    return {"applied": True, "restarted": False}
+
+
+def op_remove_peers(system, op):
+    """Remove peers by public key from wg0.conf and the running interface."""
+    config = system.read(CONFIG_PATH)
+    if config is None:
+        return {"applied": False, "removed": []}
+    head, sections = split_config(config)
+    wanted = set(op["public_keys"])
+    kept = [section for section in sections if section_peer(section)[0] not in wanted]
+    removed = [key for key in (section_peer(section)[0] for section in sections) if key in wanted]
+    if removed:
+        system.write(CONFIG_PATH, join_config(head, kept))
+        running = running_peers(system)
+        if running is None:
+            restart(system)
+        else:
+            set_peers(system, ["peer {} remove".format(key) for key in removed if key in running])
+    return {"applied": True, "removed": removed}
+
+
+def op_apply_config(system, op):
+    """Install an uploaded wg0.conf, applying peer changes live when only peers changed.
+
+    The uploaded file and its (empty) temp directory are removed.
+    """
+    config = system.read(op["path"])
+    system.remove(op["path"])
+    system.remove_dir(os.path.dirname(op["path"]))
+    if config is None:
+        raise RuntimeError("{} not found".format(op["path"]))
+    old = system.read(CONFIG_PATH)
+    if old == config:
+        return {"changed": False, "restarted": False}
+    system.write(CONFIG_PATH, config)
+    running = running_peers(system)
+    if op.get("incremental") and old is not None and running is not None \
+            and split_config(old)[0].strip() == split_config(config)[0].strip():
+        desired = dict(section_peer(section) for section in split_config(config)[1])
+        changes = ["peer {} allowed-ips {}".format(key, ips) for key, ips in desired.items() if running.get(key) != ips]
+        changes += ["peer {} remove".format(key) for key in running if key not in desired]
+        set_peers(system, changes)
+        return {"changed": True, "restarted": False}
+    return dict(restart(system), changed=True)
+
+
+OPERATIONS = {
+    "version": lambda system, op: {"version": VERSION},
+    "server_key": op_server_key,
+    "add_peers": op_add_peers,
+    "remove_peers": op_remove_peers,
+    "apply_config": op_apply_config,
+    "reload": lambda system, op: restart(system),
+}
+
+
+def handle(request, system, version=VERSION):
+    """Run each operation in order, stopping at the first failure."""
+    if request.get("version") != version:
+        return {"version": version, "error": "version mismatch"}
+    results = []
+    for op in request.get("ops", []):
+        operation = OPERATIONS.get(op.get("op"))
+        if operation is None:
+            return {"version": version, "results": results, "error": "unknown op {!r}".format(op.get("op"))}
+        try:
+            results.append(operation(system, op))
+        except Exception as e:
+            return {"version": version, "results": results, "error": "{}: {}".format(op["op"], e)}
+    return {"version": version, "results": results}
+
+
+def main():
+    if sys.argv[1:] == ["--version"]:
+        print(VERSION)
+        return 0
+    try:
+        request = json.load(sys.stdin)
+    except ValueError as e:
+        json.dump({"version": VERSION, "error": "invalid request: {}".format(e)}, sys.stdout)
+        return 2
+    response = handle(request, LocalSystem())
+    json.dump(response, sys.stdout)
+    if response.get("error") == "version mismatch":
+        return EXIT_OUTDATED
+    return 1 if "error" in response else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import asyncio
+import gc
+import threading
+import time
+import pytest
+import remotetools.aio as rta
+import remotetools.local as rtl
+import remotetools.remote as rtr
+import remotetools.tracing as rtt
+from remotetools.fake_server import FakeServer
+
+
+class FakeAsyncConnection:
+    """Runs commands against a FakeServer after an optional delay."""
+    def __init__(self, host="vpn.example.com", latency=0.0):
+        self.host = host
+        self.user = "root"
+        self.port = 22
+        self.latency = latency
+        self.server = FakeServer()
+        self.commands = []
+
+    async def run(self, command, warn=False):
+        await asyncio.sleep(self.latency)
+        self.commands.append(command)
+        exited, stdout, stderr = self.server.execute(command)
+        result = rta.Result(stdout, stderr, exited)
+        if not result.ok and not warn:
+            raise rta.CommandError(command, result)
+        return result
+
+    sudo = run
+
+    async def upload(self, path, chunks):
+        await asyncio.sleep(self.latency)
+        data = b"".join([block async for block in rta.upload_blocks(chunks)])
+        self.server.write(path, data.decode(), 0o600)
+        return len(data)
+
+
+def test_add_peers_and_deploy(tmp_path):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    c = FakeAsyncConnection()
+
+    results = asyncio.run(rta.add_peers(c, [("Alice", "iPhone", "alice@example.com"),
+                                            ("Bob", "laptop", "bob@example.com")], store=store))
+    config = asyncio.run(rta.add_peer(c, "Carol", "iPad", "carol@example.com", store=store))
+
+    assert [r.peer_info.vpn_ip for r in results.values()] == ["10.0.0.2", "10.0.0.3"]
+    assert "Endpoint = vpn.example.com:51820" in config
+    assert f"PublicKey = {c.server.public_key}" in config
+    assert c.server.config.count("[Peer]") == 3
+    assert f"PrivateKey = {c.server.private_key}" in c.server.config
+    assert c.server.modes[rtr.CONFIG_PATH] == 0o600
+    assert len(c.server.peers) == 3
+    assert c.commands.count(rtr.STATE_COMMAND) == 1
+    assert c.server.restarts == 2
+
+    # Nothing changed, so nothing is uploaded or restarted
+    assert asyncio.run(rta.deploy_config(c, store=store)) is False
+
+    with pytest.raises(ValueError):
+        asyncio.run(rta.add_peer(c, "Carol", "iPad", "carol@example.com", store=store))
+    assert asyncio.run(rta.remove_peer(c, "Carol", "iPad", store=store)) is True
+    assert c.server.config.count("[Peer]") == 2
+
+
+def test_contended_store_does_not_block_the_event_loop(tmp_path):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    c = FakeAsyncConnection()
+    locked, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with store.locked():
+            locked.set()
+            release.wait(5)
+
+    async def main():
+        adding = asyncio.ensure_future(rta.add_peer(c, "Alice", "iPhone", "alice@example.com", store=store))
+        # Other work keeps running while add_peer waits for the store lock
+        for _ in range(5):
+            await asyncio.sleep(0.01)
+        assert not adding.done()
+        release.set()
+        return await adding
+
+    holder = threading.Thread(target=hold_lock)
+    holder.start()
+    locked.wait(5)
+    try:
+        config = asyncio.run(main())
+    finally:
+        release.set()
+        holder.join()
+    assert "Address = 10.0.0.2/32" in config
+
+
+def test_upload_blocks_are_rendered_off_the_event_loop():
+    threads = set()
+
+    def chunks():
+        for _ in range(3):
+            threads.add(threading.get_ident())
+            time.sleep(0.05)  # e.g. a store read waiting on the disk
+            yield "x" * (rta.UPLOAD_BLOCK_SIZE // 2 + 1)
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticker = asyncio.ensure_future(tick())
+        blocks = [block async for block in rta.upload_blocks(chunks())]
+        ticker.cancel()
+        return blocks, ticks
+
+    blocks, ticks = asyncio.run(main())
+    assert [len(block) for block in blocks] == [rta.UPLOAD_BLOCK_SIZE + 2, rta.UPLOAD_BLOCK_SIZE // 2 + 1]
+    assert threading.get_ident() not in threads
+    assert ticks >= 5
+
+
+def test_failed_keypairs_leave_no_unretrieved_task(tmp_path, monkeypatch):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    c = FakeAsyncConnection()
+    c.server.remove("/etc/wireguard/public.key")  # the server key lookup fails as well
+
+    async def failing_keypairs(c, count):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("Failed to generate client keypairs")
+    monkeypatch.setattr(rta, "generate_client_keypairs", failing_keypairs)
+
+    errors = []
+    async def main():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        with pytest.raises(RuntimeError):
+            await rta.add_peer(c, "Alice", "iPhone", "alice@example.com", store=store, local_keys=False)
+        await asyncio.sleep(0.01)
+        gc.collect()
+    asyncio.run(main())
+    assert errors == []
+
+
+def test_gather_deploys_servers_concurrently(tmp_path):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    servers = [FakeAsyncConnection(f"vpn{i}.example.com", latency=0.05) for i in range(20)]
+
+    start = time.perf_counter()
+    results = asyncio.run(rta.gather(*(rta.deploy_config(c, store=store) for c in servers), limit=20))
+    elapsed = time.perf_counter() - start
+
+    # Each deploy is 4 round-trips; run one after another they would take 4 seconds
+    assert results == [True] * 20
+    assert elapsed < 1.0
+
+
+def test_run_uses_shared_loop_and_traces_operations(tmp_path):
+    sink = rtt.MemorySink()
+    rtt.add_sink(sink)
+    try:
+        store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+        c = FakeAsyncConnection()
+        assert rta.run(rta.deploy_config(c, store=store)) is True
+        assert rta.run(rta.retrieve_server_public_key(c)) == c.server.public_key
+    finally:
+        rtt.remove_sink(sink)
+
+    assert [op.name for op in sink.operations] == ["deploy_config"]
+    assert "sftp upload" in sink.operations[0].breakdown()
+
+
+def test_connect_reuses_connections():
+    c = rta.connect("vpn.example.com", user="admin", known_hosts=None)
+    assert rta.connect("vpn.example.com", user="admin") is c
+    assert rta.connect("vpn.example.com") is not c
+    asyncio.run(rta.close_all())
+    assert rta.connect("vpn.example.com", user="admin") is not c
+
+
+def test_sudo_prefix_for_non_root_users():
+    commands = []
+
+    class Recording(rta.AsyncConnection):
+        async def run(self, command, warn=False):
+            commands.append(command)
+            return rta.Result()
+
+    asyncio.run(Recording("vpn.example.com", user="admin").sudo("wg show"))
+    asyncio.run(Recording("vpn.example.com").sudo("wg show"))
+    assert commands == ["sudo -n wg show", "wg show"]
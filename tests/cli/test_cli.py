@@ -0,0 +1,91 @@
+import json
+import subprocess
+import sys
+import time
+import zipfile
+import pytest
+import remotetools.cli as rtcli
+import remotetools.local as rtl
+from remotetools.fake_server import FakeConnection, FakeServer
+
+# Wall-clock budget for `myvpn list` in a fresh interpreter, including Python's own startup
+STARTUP_BUDGET = 0.5
+
+
+@pytest.fixture
+def csv_path(tmp_path):
+    path = tmp_path / "peers.csv"
+    rtl.save_peers_to_csv([
+        rtl.PeerRecord("Alice", "alice_pubkey", "iPhone", "alice@example.com", "10.0.0.2", "2024-12-02T23:30:00Z"),
+        rtl.PeerRecord("Bob", "bob_pubkey", "Laptop", "bob@example.com", "10.0.0.3", "2024-12-02T23:31:00Z"),
+    ], str(path))
+    return str(path)
+
+
+def test_list_and_allocate(csv_path, capsys):
+    assert rtcli.main(["--store", csv_path, "list", "--email", "bob@example.com", "--json"]) == 0
+    [line] = capsys.readouterr().out.splitlines()
+    assert json.loads(line)["name"] == "Bob"
+
+    assert rtcli.main(["--store", csv_path, "list", "--limit", "1"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0].split() == rtcli.LIST_COLUMNS
+    assert lines[1].startswith("Alice")
+    assert lines[2] == "... 1 more, use --offset 1"
+
+    assert rtcli.main(["--store", csv_path, "allocate", "--count", "2"]) == 0
+    assert capsys.readouterr().out.split() == ["10.0.0.4", "10.0.0.5"]
+
+    assert rtcli.main(["--store", csv_path, "--subnet", "10.0.0.0/30", "allocate", "--count", "2"]) == 1
+    assert capsys.readouterr().err.strip() == "myvpn: no free IP in 10.0.0.0/30"
+
+
+def test_export_bundles_saved_configs(tmp_path, capsys):
+    (tmp_path / "Alice_iPhone.conf").write_text("[Interface]\n")
+    archive = tmp_path / "configs.zip"
+
+    assert rtcli.main(["export", str(archive), "--configs", str(tmp_path)]) == 0
+    assert zipfile.ZipFile(archive).namelist() == ["Alice_iPhone.conf"]
+    assert rtcli.main(["export", str(archive), "--configs", str(tmp_path / "missing")]) == 1
+
+
+def test_remote_commands(tmp_path, csv_path, monkeypatch, capsys):
+    server = FakeServer()
+    monkeypatch.setattr(rtcli, "_connect", lambda args: FakeConnection(args.host, server=server))
+    remote = ["--host", "vpn.example.com"]
+
+    assert rtcli.main(["--store", csv_path, "add", "Carol", "iPad", "carol@example.com", *remote,
+                       "--output-dir", str(tmp_path)]) == 0
+    config_path = capsys.readouterr().out.strip()
+    assert "Endpoint = vpn.example.com:51820" in open(config_path).read()
+    assert server.config.count("[Peer]") == 3
+
+    assert rtcli.main(["--store", csv_path, "deploy", *remote]) == 0
+    assert capsys.readouterr().out.strip() == "unchanged"
+    assert rtcli.main(["--store", csv_path, "status", *remote]) == 0
+    assert "in sync" in capsys.readouterr().out
+
+    assert rtcli.main(["--store", csv_path, "remove", "Bob", "Laptop", *remote, "--helper"]) == 0
+    assert rtcli.main(["--store", csv_path, "remove", "Bob", "Laptop", *remote]) == 1
+    assert "no peer Bob/Laptop" in capsys.readouterr().err
+    assert server.config.count("[Peer]") == 2
+
+
+def test_local_commands_do_not_import_remote_dependencies(csv_path):
+    code = (
+        "import sys; from remotetools.cli import main; "
+        f"main(['--store', {csv_path!r}, 'list']); main(['--store', {csv_path!r}, 'allocate']); "
+        "print(sorted(m for m in ('fabric', 'paramiko', 'invoke', 'cryptography') if m in sys.modules))"
+    )
+    process = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert process.stdout.splitlines()[-1] == "[]"
+
+
+def test_list_starts_within_budget(csv_path):
+    timings = []
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "remotetools.cli", "--store", csv_path, "list"],
+                       capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    assert min(timings) < STARTUP_BUDGET
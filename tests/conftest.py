@@ -0,0 +1,16 @@
+import pytest
+import remotetools.local as rtl
+import remotetools.remote as rtr
+
+
+@pytest.fixture(autouse=True)
+def reset_vpn_subnet():
+    yield
+    rtl.set_vpn_subnet(rtl.VPN_SUBNET)
+
+
+@pytest.fixture(autouse=True)
+def clear_server_state():
+    rtr.invalidate_server_state()
+    yield
+    rtr.invalidate_server_state()
@@ -0,0 +1,138 @@
+import sqlite3
+import threading
+import pytest
+import remotetools.expiry as rtx
+import remotetools.fleet as rtf
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.remote as rtr
+from fabric.connection import Connection
+
+NOW = "2025-06-15T12:00:00+00:00"
+
+
+def make_peers():
+    return [
+        rtl.PeerRecord("Alice", "key1", "iPhone", "alice@example.com", "10.0.0.2", "2025-01-01T00:00:00+00:00"),
+        rtl.PeerRecord("Guest", "key2", "Laptop", "guest@example.com", "10.0.0.3", "2025-06-01T00:00:00+00:00",
+                       "2025-06-08T00:00:00+00:00"),
+        rtl.PeerRecord("Contractor", "key3", "Laptop", "c@example.com", "10.0.0.4", "2025-03-01T00:00:00+00:00",
+                       "2025-06-01T00:00:00+00:00"),
+        rtl.PeerRecord("Intern", "key4", "iPhone", "intern@example.com", "10.0.0.5", "2025-06-01T00:00:00+00:00",
+                       "2025-09-01T00:00:00+00:00"),
+    ]
+
+
+def test_old_csv_without_expiry_column(tmp_path):
+    csv_file = tmp_path / "peers.csv"
+    csv_file.write_text("name,public_key,device,email,vpn_ip,created_utc\n"
+                        "Alice,key1,iPhone,alice@example.com,10.0.0.2,2025-01-01T00:00:00+00:00\n")
+    store = rtl.CsvPeerStore(str(csv_file))
+    assert store.all()[0].expires_utc == ""
+    
+    store.add(make_peers()[1])
+    
+    assert csv_file.read_text().splitlines()[0] == ",".join(rtl.CSV_FIELDS)
+    assert [p.expires_utc for p in rtl.load_peers(str(csv_file))] == ["", "2025-06-08T00:00:00+00:00"]
+    assert [p.name for p in store.all()] == ["Alice", "Guest"]
+
+
+def test_old_sqlite_database_gains_expiry_column(tmp_path):
+    db_file = tmp_path / "peers.db"
+    conn = sqlite3.connect(db_file)
+    conn.execute("CREATE TABLE peers (name TEXT NOT NULL, public_key TEXT NOT NULL, device TEXT NOT NULL, "
+                 "email TEXT NOT NULL, vpn_ip TEXT NOT NULL, created_utc TEXT NOT NULL)")
+    conn.execute("INSERT INTO peers VALUES ('Alice', 'key1', 'iPhone', 'alice@example.com', '10.0.0.2', "
+                 "'2025-01-01T00:00:00+00:00')")
+    conn.commit()
+    conn.close()
+    
+    store = rtl.SqlitePeerStore(str(db_file))
+    store.add_many(make_peers()[1:])
+    
+    assert store.all()[0].expires_utc == ""
+    assert [p.name for p in rtx.expired_peers(store, NOW)] == ["Contractor", "Guest"]
+
+
+def test_reap_expired_dry_run_and_batch(tmp_path, monkeypatch):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    store.add_many(make_peers())
+    deploys = []
+    monkeypatch.setattr(rto, 'deploy_config', lambda c, **kwargs: deploys.append(kwargs))
+    c = Connection(host='test.example.com', user='testuser')
+    
+    listed = rtx.reap_expired(c, store, now=NOW, dry_run=True)
+    assert [p.name for p in listed] == ["Contractor", "Guest"]
+    assert deploys == []
+    assert store.count() == 4
+    
+    removed = rtx.reap_expired(c, store, now=NOW)
+    assert [p.name for p in removed] == ["Contractor", "Guest"]
+    assert len(deploys) == 1
+    assert [p.name for p in store.all()] == ["Alice", "Intern"]
+    
+    assert rtx.reap_expired(c, store, now=NOW) == []
+    assert len(deploys) == 1
+
+
+def test_reap_fleet_deploys_only_affected_servers(tmp_path, monkeypatch):
+    servers = [
+        rtf.Server(Connection(host=f"vpn{i}.example.com", user='root'),
+                   rtl.CsvPeerStore(str(tmp_path / f"peers{i}.csv")), subnet="10.0.0.0/24")
+        for i in range(2)
+    ]
+    servers[0].store.add_many(make_peers())
+    servers[1].store.add(make_peers()[0])
+    deployed = []
+    lock = threading.Lock()
+    
+    def mock_deploy_config(c, **kwargs):
+        with lock:
+            deployed.append(c.host)
+    
+    monkeypatch.setattr(rto, 'deploy_config', mock_deploy_config)
+    
+    results = rtx.reap_fleet(rtf.Fleet(servers), now=NOW)
+    
+    assert [p.name for p in results["vpn0.example.com"]] == ["Contractor", "Guest"]
+    assert results["vpn1.example.com"] == []
+    assert deployed == ["vpn0.example.com"]
+
+
+def test_add_peer_with_expiry(tmp_path, monkeypatch):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    monkeypatch.setattr(rtr, 'retrieve_server_public_key', lambda c: "fake_server_public_key")
+    c = Connection(host='test.example.com', user='testuser')
+    
+    rto.add_peer(c, "Guest", "Laptop", "guest@example.com", store=store, deploy=False,
+                 expires_utc=rtx.expires_in(days=7))
+    
+    assert store.all()[0].expires_utc > rtx.utc_now()
+    assert rtx.expired_peers(store) == []
+
+
+def test_expiry_times_are_stored_in_utc(tmp_path, monkeypatch):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    monkeypatch.setattr(rtr, 'retrieve_server_public_key', lambda c: "fake_server_public_key")
+    c = Connection(host='test.example.com', user='testuser')
+    
+    rto.add_peer(c, "Guest", "Laptop", "guest@example.com", store=store, deploy=False,
+                 expires_utc="2025-06-15T13:00:00+02:00")
+    rto.add_peers(c, [("Intern", "iPhone", "intern@example.com")], store=store, deploy=False,
+                  expires_utc="2025-06-15T12:30:00Z")
+    
+    assert [p.expires_utc for p in store.all()] == ["2025-06-15T11:00:00+00:00", "2025-06-15T12:30:00+00:00"]
+    assert [p.name for p in rtx.expired_peers(store, NOW)] == ["Guest"]
+    assert [p.name for p in rtx.expired_peers(store, "2025-06-15T14:00:00+02:00")] == ["Guest"]
+    assert rtl.utc_timestamp("2025-06-15T12:00:00") == NOW
+
+
+def test_unparseable_expiry_is_rejected(tmp_path):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    c = Connection(host='test.example.com', user='testuser')
+    
+    with pytest.raises(ValueError, match="Not an ISO 8601 time"):
+        rto.add_peer(c, "Guest", "Laptop", "guest@example.com", store=store, expires_utc="next tuesday")
+    with pytest.raises(ValueError, match="Not an ISO 8601 time"):
+        rtx.expired_peers(store, "soon")
+    assert store.all() == []
@@ -0,0 +1,64 @@
+import importlib.util
+import io
+import zipfile
+import pytest
+import remotetools.export as rte
+import remotetools.local as rtl
+
+
+def make_peers(count):
+    return [
+        rtl.PeerInfo(f"user{i}", f"priv{i}", f"pub{i}", "phone", f"user{i}@example.com", f"10.0.0.{i + 2}",
+                     "2024-12-03T00:00:00Z")
+        for i in range(count)
+    ]
+
+
+def test_export_configs_streams_zip():
+    output = io.BytesIO()
+    
+    stats = rte.export_configs(make_peers(50), "server_pub", "vpn.example.com:51820", output)
+    
+    assert stats.configs == 50
+    assert stats.qr_codes == 0
+    with zipfile.ZipFile(output) as archive:
+        names = archive.namelist()
+        assert names[:2] == ["user0_phone.conf", "user1_phone.conf"]
+        assert len(names) == 50
+        config = archive.read("user7_phone.conf").decode()
+    assert "PrivateKey = priv7" in config
+    assert "Address = 10.0.0.9/32" in config
+    assert "AllowedIPs = 0.0.0.0/0" in config
+
+
+def test_export_configs_per_peer_profile(tmp_path):
+    split = rtl.split_tunnel("10.0.0.0/24")
+    path = tmp_path / "configs.zip"
+    
+    rte.export_configs(make_peers(2), "server_pub", "vpn.example.com:51820", str(path),
+                       profile=lambda peer: split if peer.name == "user1" else rtl.FULL_TUNNEL)
+    
+    with zipfile.ZipFile(path) as archive:
+        full = archive.read("user0_phone.conf").decode()
+        split_config = archive.read("user1_phone.conf").decode()
+    assert "DNS = 8.8.8.8" in full
+    assert "AllowedIPs = 10.0.0.0/24" in split_config
+    assert "DNS" not in split_config
+
+
+def test_export_configs_with_qr_codes():
+    pytest.importorskip("qrcode")
+    output = io.BytesIO()
+    
+    stats = rte.export_configs(make_peers(3), "server_pub", "vpn.example.com:51820", output, qr=True)
+    
+    assert stats.qr_codes == 3
+    with zipfile.ZipFile(output) as archive:
+        assert archive.read("user0_phone.png").startswith(b"\x89PNG")
+
+
+@pytest.mark.skipif(importlib.util.find_spec("qrcode") is not None, reason="qrcode is installed")
+def test_export_configs_qr_codes_need_qrcode():
+    # Raised in a worker process and re-raised here
+    with pytest.raises(ImportError, match="pip install 'remotetools\\[qr\\]'"):
+        rte.export_configs(make_peers(3), "server_pub", "vpn.example.com:51820", io.BytesIO(), qr=True, max_workers=2)
@@ -0,0 +1,114 @@
+import time
+import pytest
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.reconcile as rtc
+import remotetools.remote as rtr
+from invoke.exceptions import UnexpectedExit
+from remotetools.fake_server import FakeConnection, FakeNetworkError, FakeServer
+
+
+@pytest.fixture
+def store(tmp_path):
+    return rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+
+
+def test_add_and_remove_peers_end_to_end(store):
+    c = FakeConnection()
+
+    config = rto.add_peer(c, "Alice", "iPhone", "alice@example.com", store=store)
+    rto.add_peers(c, [("Bob", "Laptop", "bob@example.com"), ("Carol", "iPad", "carol@example.com")],
+                  store=store, incremental=True)
+
+    assert f"PublicKey = {c.server.public_key}" in config
+    assert "Endpoint = fake.example.com:51820" in config
+    assert c.server.modes[rtr.CONFIG_PATH] == 0o600
+    assert c.server.config.count("[Peer]") == 3
+    assert c.server.restarts == 1  # the second deploy only ran `wg set`
+    assert {peer.allowed_ips for peer in c.server.peers.values()} == {"10.0.0.2/32", "10.0.0.3/32", "10.0.0.4/32"}
+    assert not any(path.startswith("/tmp/") for path in c.server.files)
+    assert not c.server.dirs
+
+    assert rto.remove_peer(c, "Bob", "Laptop", store=store, incremental=True)
+    assert len(c.server.peers) == 2
+    assert rtc.check_drift(c, store).in_sync
+
+
+def test_remote_keys_match_wg_pubkey():
+    c = FakeConnection()
+    private_key, public_key = rtr.generate_client_keypair(c)
+    [(private_key2, public_key2)] = rtr.generate_client_keypairs(c, 1)
+
+    assert c.run(f"echo -n '{private_key2}' | wg pubkey").stdout.strip() == public_key2
+    assert len(private_key) == len(public_key) == 44
+    with pytest.raises(UnexpectedExit):
+        c.run("echo -n 'not-a-key' | wg pubkey")
+
+
+def test_rotated_keys_invalidate_cached_state():
+    c = FakeConnection()
+    old_key = rtr.retrieve_server_public_key(c)
+    rtr.rotate_server_keys(c)
+    assert rtr.retrieve_server_public_key(c) == c.server.public_key != old_key
+
+
+def test_interfaces_with_and_without_json_support():
+    interfaces = [
+        rtr.NetworkInterface("lo", "UNKNOWN", 65536, ["LOOPBACK", "UP"]),
+        rtr.NetworkInterface("ens3", "UP", 1500, ["BROADCAST", "UP"], ["93.184.216.34"], ["2606:2800:220:1::1"]),
+        rtr.NetworkInterface("ens4", "DOWN", 1500, ["BROADCAST"], ["93.184.216.35"]),
+    ]
+    for ip_json in (True, False):
+        c = FakeConnection(server=FakeServer(interfaces, ip_json=ip_json))
+        assert rtr.detect_network_interface(c) == (1, ["ens3"])
+
+
+def test_telemetry_from_simulated_traffic(store):
+    c = FakeConnection()
+    rto.add_peer(c, "Alice", "iPhone", "alice@example.com", store=store)
+    collector = rtr.TelemetryCollector(c, store=store)
+    collector.poll()
+
+    [record] = store.all()
+    c.server.add_traffic(record.public_key, rx_bytes=5000, endpoint="198.51.100.4:40000")
+    collector.poll()
+    [top] = collector.top_talkers(1)
+    assert top.peer.name == "Alice"
+    assert top.rx_bytes == 5000
+
+
+def test_unknown_commands_fail_like_a_shell():
+    c = FakeConnection()
+    assert c.run("frobnicate --now", warn=True).exited == 127
+    with pytest.raises(UnexpectedExit):
+        c.sudo("wg show wg0 dump")  # not up until the first deploy
+
+
+def test_injected_failures_are_reproducible():
+    outcomes = []
+    for _ in range(2):
+        c = FakeConnection(failure_rate=0.5, seed=7)
+        run = []
+        for _ in range(20):
+            try:
+                c.run("wg genkey")
+                run.append(True)
+            except FakeNetworkError:
+                run.append(False)
+        outcomes.append(run)
+    assert outcomes[0] == outcomes[1]
+    assert True in outcomes[0] and False in outcomes[0]
+
+
+def test_latency_scales_with_round_trips(store):
+    c = FakeConnection(latency=0.01)
+    rto.add_peer(c, "Alice", "iPhone", "alice@example.com", store=store)
+    c.reset_counters()
+
+    start = time.perf_counter()
+    rto.add_peer(c, "Bob", "Laptop", "bob@example.com", store=store, incremental=True)
+    elapsed = time.perf_counter() - start
+
+    # sha256sum, sed, mktemp, sftp open/close, install, wg show, wg set; server state is cached
+    assert c.round_trips == 8
+    assert 0.08 <= elapsed < 0.08 + 0.5
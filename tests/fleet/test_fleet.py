@@ -0,0 +1,80 @@
+import threading
+import time
+import pytest
+import remotetools.fleet as rtf
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.remote as rtr
+from fabric.connection import Connection
+
+
+def make_fleet(tmp_path, regions, **kwargs):
+    servers = [
+        rtf.Server(
+            connection=Connection(host=f"vpn{i}.example.com", user='root'),
+            store=rtl.CsvPeerStore(str(tmp_path / f"peers{i}.csv")),
+            subnet=f"10.{i}.0.0/24",
+            region=region
+        )
+        for i, region in enumerate(regions)
+    ]
+    return rtf.Fleet(servers, **kwargs)
+
+
+def test_place_least_loaded_in_region(tmp_path):
+    fleet = make_fleet(tmp_path, ["eu", "eu", "us"])
+    fleet.servers[0].store.add(rtl.PeerRecord("Alice", "key1", "iPhone", "alice@example.com",
+                                              "10.0.0.2", "2024-12-03T00:00:00Z"))
+    
+    assert fleet.place().host == "vpn1.example.com"
+    assert fleet.place(region="eu").host == "vpn1.example.com"
+    assert fleet.place(region="us").host == "vpn2.example.com"
+    with pytest.raises(ValueError):
+        fleet.place(region="asia")
+
+
+def test_add_peers_spreads_batch_and_uses_server_subnets(tmp_path, monkeypatch):
+    fleet = make_fleet(tmp_path, ["eu", "eu", "us"])
+    deployed = []
+    keys = iter(range(100))
+    monkeypatch.setattr(rtl, 'generate_wireguard_keypair', lambda: ("priv", f"pub{next(keys)}"))
+    monkeypatch.setattr(rtr, 'retrieve_server_public_key', lambda c: "server_pub")
+    monkeypatch.setattr(rto, 'deploy_config', lambda c, **kwargs: deployed.append(c.host))
+    
+    results = fleet.add_peers([(f"User{i}", "Phone", f"user{i}@example.com") for i in range(4)], region="eu")
+    
+    assert sorted(results) == ["vpn0.example.com", "vpn1.example.com"]
+    assert sorted(deployed) == ["vpn0.example.com", "vpn1.example.com"]
+    assert [p.vpn_ip for p in fleet.servers[0].store.all()] == ["10.0.0.2", "10.0.0.3"]
+    assert [p.vpn_ip for p in fleet.servers[1].store.all()] == ["10.1.0.2", "10.1.0.3"]
+    assert fleet.servers[2].store.count() == 0
+
+
+def test_deploy_all_runs_concurrently_with_bounded_workers(tmp_path, monkeypatch):
+    fleet = make_fleet(tmp_path, [None] * 6, max_workers=3)
+    lock = threading.Lock()
+    active = []
+    peak = []
+    
+    def mock_deploy_config(c, **kwargs):
+        with lock:
+            active.append(c.host)
+            peak.append(len(active))
+        time.sleep(0.2)
+        with lock:
+            active.remove(c.host)
+        if c.host == "vpn5.example.com":
+            raise RuntimeError("unreachable")
+        return True
+    
+    monkeypatch.setattr(rto, 'deploy_config', mock_deploy_config)
+    
+    start = time.perf_counter()
+    results = fleet.deploy_all()
+    elapsed = time.perf_counter() - start
+    
+    # Two waves of three hosts, not six sequential deploys
+    assert elapsed < 0.8
+    assert max(peak) == 3
+    assert isinstance(results.pop("vpn5.example.com"), RuntimeError)
+    assert all(result is True for result in results.values())
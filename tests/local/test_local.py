@@ -1,3 +1,5 @@
+import base64
+import pytest
 import remotetools.local as rtl
 # from dataclasses import asdict
 # from dataclasses import dataclass, asdict
@@ -150,6 +152,293 @@ def test_remove_peer_from_csv(tmp_path):
     assert result is False
 
 
+def test_sqlite_store_add_and_remove(tmp_path):
+    """Test the SQLite backend keeps insertion order and deletes by name and device."""
+    store = rtl.SqlitePeerStore(str(tmp_path / "peers.db"))
+    
+    peer1 = rtl.PeerRecord(name="Alice", public_key="key1", device="iPhone", 
+                           email="alice@test.com", vpn_ip="10.0.0.2", created_utc="2024-12-03T00:00:00Z")
+    peer2 = rtl.PeerRecord(name="Bob", public_key="key2", device="Laptop", 
+                           email="bob@test.com", vpn_ip="10.0.0.3", created_utc="2024-12-03T00:01:00Z")
+    store.add(peer1)
+    store.add(peer2)
+    
+    assert store.all() == [peer1, peer2]
+    
+    assert store.remove("Alice", "iPhone") is True
+    assert store.remove("Alice", "iPhone") is False
+    assert store.all() == [peer2]
+
+
+def test_sqlite_store_rejects_duplicates(tmp_path):
+    """Test that name/device, public key and VPN IP must be unique."""
+    store = rtl.SqlitePeerStore(str(tmp_path / "peers.db"))
+    store.add(rtl.PeerRecord("Alice", "key1", "iPhone", "alice@test.com", "10.0.0.2", "2024-12-03T00:00:00Z"))
+    
+    duplicates = [
+        rtl.PeerRecord("Alice", "key2", "iPhone", "alice@test.com", "10.0.0.3", "2024-12-03T00:00:00Z"),
+        rtl.PeerRecord("Bob", "key1", "Laptop", "bob@test.com", "10.0.0.3", "2024-12-03T00:00:00Z"),
+        rtl.PeerRecord("Bob", "key2", "Laptop", "bob@test.com", "10.0.0.2", "2024-12-03T00:00:00Z"),
+    ]
+    for peer in duplicates:
+        with pytest.raises(ValueError):
+            store.add(peer)
+    
+    # A failed batch leaves nothing behind
+    with pytest.raises(ValueError):
+        store.add_many([
+            rtl.PeerRecord("Carol", "key3", "iPad", "carol@test.com", "10.0.0.4", "2024-12-03T00:00:00Z"),
+            duplicates[0],
+        ])
+    assert len(store.all()) == 1
+
+
+def test_migrate_csv_to_sqlite(tmp_path):
+    """Test one-shot migration from the CSV format."""
+    csv_file = tmp_path / "peers.csv"
+    db_file = tmp_path / "peers.db"
+    for i in range(2, 5):
+        rtl.save_peer_to_csv(rtl.PeerRecord(f"User{i}", f"key{i}", "Device", f"user{i}@test.com",
+                                            f"10.0.0.{i}", "2024-12-03T00:00:00Z"), str(csv_file))
+    
+    count = rtl.migrate_csv_to_sqlite(str(csv_file), str(db_file))
+    
+    assert count == 3
+    assert rtl.SqlitePeerStore(str(db_file)).all() == rtl.load_peers(str(csv_file))
+
+
+def test_peer_store_is_pluggable(tmp_path, monkeypatch):
+    """Test that add_peer, remove_peer and get_all_peers use the configured store."""
+    monkeypatch.setattr(rtl, '_peer_store', rtl.CsvPeerStore(str(tmp_path / "peers.csv")))
+    rtl.set_peer_store(rtl.SqlitePeerStore(str(tmp_path / "peers.db")))
+    
+    peer = rtl.PeerRecord("Alice", "key1", "iPhone", "alice@test.com", "10.0.0.2", "2024-12-03T00:00:00Z")
+    rtl.add_peer(peer)
+    
+    assert rtl.get_all_peers() == [peer]
+    assert rtl.remove_peer("Alice", "iPhone") is True
+    assert rtl.get_all_peers() == []
+    assert not (tmp_path / "peers.csv").exists()
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: rtl.CsvPeerStore(str(tmp_path / "peers.csv")),
+    lambda tmp_path: rtl.SqlitePeerStore(str(tmp_path / "peers.db")),
+])
+def test_store_remove_many(tmp_path, make_store):
+    """Test bulk removal reports a found flag per key."""
+    store = make_store(tmp_path)
+    store.add_many([
+        rtl.PeerRecord(f"User{i}", f"key{i}", "Device", f"user{i}@test.com", f"10.0.0.{i}", "2024-12-03T00:00:00Z")
+        for i in range(2, 6)
+    ])
+    
+    found = store.remove_many([("User2", "Device"), ("Nobody", "Device"), ("User4", "Device")])
+    
+    assert found == [True, False, True]
+    assert [p.name for p in store.all()] == ["User3", "User5"]
+    assert list(store.iter()) == store.all()
+    assert store.count() == 2
+
+
+def test_ip_allocator_larger_subnet():
+    """Test allocation beyond a /24 and reuse of released addresses."""
+    allocator = rtl.IPAllocator("10.8.0.0/16", used_ips=["10.8.0.2", "10.8.0.3", "192.168.1.5"])
+    
+    assert allocator.server_ip == "10.8.0.1"
+    assert allocator.allocate() == "10.8.0.4"
+    
+    for i in range(5, 256):
+        allocator.reserve(f"10.8.0.{i}")
+    assert allocator.allocate() == "10.8.1.0"
+    
+    allocator.release("10.8.0.3")
+    assert allocator.allocate() == "10.8.0.3"
+    assert allocator.reserve("10.8.0.3") is False
+
+
+@pytest.mark.parametrize("store_factory, filename", [
+    (rtl.CsvPeerStore, "peers.csv"),
+    (rtl.SqlitePeerStore, "peers.db"),
+])
+def test_store_keeps_its_ip_allocator(tmp_path, monkeypatch, store_factory, filename):
+    """Test that a store builds its allocator once and keeps it in step with its own writes."""
+    built = []
+    allocator_class = rtl.IPAllocator
+    monkeypatch.setattr(rtl, "IPAllocator", lambda *args: built.append(args) or allocator_class(*args))
+    path = str(tmp_path / filename)
+    store = store_factory(path)
+    
+    def peer(i, ip):
+        return rtl.PeerRecord(f"User{i}", f"key{i}", "Phone", "", ip, "2024-12-03T00:00:00+00:00")
+    
+    assert store.free_ips(0) == []
+    assert store.free_ips(2) == ["10.0.0.2", "10.0.0.3"]
+    store.add_many([peer(2, "10.0.0.2"), peer(3, "10.0.0.3")])
+    assert store.free_ips(1) == ["10.0.0.4"]
+    assert store.remove("User2", "Phone")
+    assert store.free_ips(2) == ["10.0.0.2", "10.0.0.4"]
+    assert store.get("User3", "Phone") == peer(3, "10.0.0.3")
+    assert store.get("User2", "Phone") is None
+    assert len(built) == 1
+    
+    # A write from elsewhere is picked up by rebuilding
+    if store_factory is rtl.CsvPeerStore:
+        rtl.save_peers_to_csv([peer(3, "10.0.0.3"), peer(4, "10.0.0.2")], path)
+    else:
+        store_factory(path).add(peer(4, "10.0.0.2"))
+    assert store.free_ips(1) == ["10.0.0.4"]
+    assert len(built) == 2
+    
+    # SQLite rolls back an aborted locked() block, and its addresses are free again
+    with pytest.raises(RuntimeError):
+        with store.locked():
+            store.add(peer(5, "10.0.0.4"))
+            raise RuntimeError("abort")
+    assert store.free_ips(1) == (["10.0.0.4"] if store_factory is rtl.SqlitePeerStore else ["10.0.0.5"])
+
+
+def test_configured_vpn_subnet():
+    """Test that the configured subnet is the default everywhere a subnet is needed."""
+    rtl.set_vpn_subnet("10.8.0.0/16")
+    
+    assert rtl.get_vpn_subnet() == "10.8.0.0/16"
+    assert rtl.server_address() == "10.8.0.1/16"
+    assert rtl.IPAllocator(used_ips=["10.8.0.2"]).allocate() == "10.8.0.3"
+    assert rtl.split_tunnel().allowed_ips == "10.8.0.0/16"
+    assert rtl.in_subnet()("10.8.255.254") and not rtl.in_subnet()("10.0.0.2")
+    
+    with pytest.raises(ValueError, match="outside the VPN subnet 10.8.0.0/16"):
+        rtl.check_subnet([rtl.PeerRecord("Alice", "key", "iPhone", "a@test.com", "10.0.0.2", "2024-12-03T00:00:00Z")])
+    with pytest.raises(ValueError):
+        rtl.set_vpn_subnet("10.8.0.0/31")
+    assert rtl.get_vpn_subnet() == "10.8.0.0/16"
+
+
+def test_ip_allocator_reserves_network_server_and_broadcast():
+    """Test that only usable client addresses are handed out."""
+    allocator = rtl.IPAllocator("192.168.5.0/29")
+    
+    allocated = [allocator.allocate() for _ in range(5)]
+    
+    assert allocated == ["192.168.5.2", "192.168.5.3", "192.168.5.4", "192.168.5.5", "192.168.5.6"]
+    assert allocator.allocate() is None
+    assert allocator.available == 0
+    assert rtl.server_address("192.168.5.0/29") == "192.168.5.1/29"
+
+
+def test_generate_wireguard_keypair():
+    """Test local keys have the same shape as `wg genkey` output and derive consistently."""
+    private_key, public_key = rtl.generate_wireguard_keypair()
+    
+    assert len(private_key) == 44
+    assert len(public_key) == 44
+    assert private_key != public_key
+    assert rtl.derive_public_key(private_key) == public_key
+
+
+def test_derive_public_key_rfc7748_vector():
+    """Test against the X25519 test vector from RFC 7748 section 6.1."""
+    private_key = base64.b64encode(bytes.fromhex(
+        "77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a")).decode()
+    expected = base64.b64encode(bytes.fromhex(
+        "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a")).decode()
+    
+    assert rtl.derive_public_key(private_key) == expected
+
+
+
+def test_peer_index_caches_and_applies_writes(tmp_path, monkeypatch):
+    csv_file = tmp_path / "peers.csv"
+    store = rtl.CsvPeerStore(str(csv_file))
+    alice = rtl.PeerRecord("Alice", "key1", "iPhone", "alice@example.com", "10.0.0.2", "2024-12-03T00:00:00Z")
+    bob = rtl.PeerRecord("Bob", "key2", "Laptop", "bob@example.com", "10.0.0.3", "2024-12-03T00:00:00Z")
+    store.add_many([alice, bob])
+    assert store.all() == [alice, bob]
+    
+    parses = []
+    monkeypatch.setattr(rtl, "load_peers", lambda path: parses.append(path) or [])
+    carol = rtl.PeerRecord("Carol", "key3", "iPad", "alice@example.com", "10.0.0.4", "2024-12-03T00:00:00Z")
+    store.add(carol)
+    store.remove("Bob", "Laptop")
+    
+    index = rtl.peer_index(str(csv_file))
+    assert index is store.index
+    assert store.all() == [alice, carol]
+    assert list(store.iter()) == [alice, carol]
+    assert index.get("Carol", "iPad") == carol
+    assert index.find_by_public_key("key1") == alice
+    assert index.find_by_ip("10.0.0.3") is None
+    assert index.find_by_email("alice@example.com") == [alice, carol]
+    assert parses == []
+
+
+def test_peer_index_reloads_on_external_change(tmp_path):
+    csv_file = tmp_path / "peers.csv"
+    store = rtl.CsvPeerStore(str(csv_file))
+    alice = rtl.PeerRecord("Alice", "key1", "iPhone", "alice@example.com", "10.0.0.2", "2024-12-03T00:00:00Z")
+    store.add(alice)
+    assert store.all() == [alice]
+    
+    bob = rtl.PeerRecord("Bob", "key2", "Laptop", "bob@example.com", "10.0.0.3", "2024-12-03T00:00:00Z")
+    rtl.save_peer_to_csv(bob, str(csv_file))
+    assert rtl.CsvPeerStore(str(csv_file)).all() == [alice, bob]
+    
+    csv_file.unlink()
+    assert store.all() == []
+
+
+
+def make_query_peers():
+    return [
+        rtl.PeerRecord("Alice", "key1", "iPhone", "alice@example.com", "10.0.0.2", "2025-01-15T10:00:00+00:00"),
+        rtl.PeerRecord("Alice", "key2", "Laptop", "alice@example.com", "10.0.1.3", "2025-07-01T10:00:00+00:00"),
+        rtl.PeerRecord("Bob", "key3", "iPhone", "bob@example.com", "10.0.0.4", "2024-11-30T10:00:00+00:00"),
+        rtl.PeerRecord("Carol", "key4", "iPad", "carol@example.com", "10.0.0.5", "2025-05-31T23:59:59+00:00"),
+        rtl.PeerRecord("Dave", "key5", "iPhone", "dave@example.com", "10.0.0.6", "2025-06-01T00:00:00+00:00"),
+    ]
+
+
+@pytest.mark.parametrize("make_store", [
+    lambda tmp_path: rtl.CsvPeerStore(str(tmp_path / "peers.csv")),
+    lambda tmp_path: rtl.SqlitePeerStore(str(tmp_path / "peers.db")),
+])
+def test_peer_queries(tmp_path, make_store):
+    store = make_store(tmp_path)
+    store.add_many(make_query_peers())
+    
+    assert [p.device for p in store.find(rtl.PeerFilter(email="alice@example.com")).records] == ["iPhone", "Laptop"]
+    assert store.find(rtl.PeerFilter(public_key="key4")).records[0].name == "Carol"
+    
+    before = store.find(rtl.PeerFilter(created_before="2025-06"))
+    assert [p.name for p in before.records] == ["Bob", "Alice", "Carol"]
+    
+    page = store.find(rtl.PeerFilter(device="iPhone"), offset=1, limit=1)
+    assert [p.name for p in page.records] == ["Bob"]
+    assert page.total == 3 and page.has_more
+    
+    recent_iphones = rtl.PeerFilter(device="iPhone", created_after="2025-01", subnet="10.0.0.0/24")
+    assert [p.name for p in store.find(recent_iphones).records] == ["Alice", "Dave"]
+    assert store.count_where(rtl.PeerFilter(subnet="10.0.0.0/30")) == 1
+    assert recent_iphones == rtl.PeerFilter(device="iPhone", created_after="2025-01", subnet="10.0.0.0/24")
+    assert store.count_where(rtl.PeerFilter(where=lambda p: p.name.startswith("A"))) == 2
+    
+    removed = store.remove_where(rtl.PeerFilter(email="alice@example.com"))
+    assert [p.device for p in removed] == ["iPhone", "Laptop"]
+    assert store.count_where(rtl.PeerFilter()) == 3
+    assert store.find(rtl.PeerFilter(created_before="2025-06")).total == 2
+
+
+def test_find_peers_uses_configured_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(rtl, '_peer_store', rtl.CsvPeerStore(str(tmp_path / "peers.csv")))
+    rtl.add_peers(make_query_peers())
+    
+    assert rtl.count_peers(created_after="2025-06") == 2
+    assert [p.name for p in rtl.find_peers(email="bob@example.com").records] == ["Bob"]
+    assert [p.name for p in rtl.remove_peers_where(device="iPad")] == ["Carol"]
+    assert rtl.count_peers() == 4
+
+
 ############################# move to tests/ssh_stuff/test_ssh_stuff.py
 # import os
 # def test_save_private_key():
@@ -0,0 +1,131 @@
+import json
+import smtplib
+import socket
+import pytest
+from pathlib import Path
+import remotetools.local as rtl
+import remotetools.mailer as rtm
+
+
+def make_peer(i):
+    return rtl.PeerInfo(f"user{i}", f"priv{i}", f"pub{i}", "phone", f"user{i}@example.com",
+                        f"10.0.0.{i + 2}", "2024-12-03T00:00:00Z")
+
+
+class FakeSMTP:
+    """Records messages; fails the first `failures` sends."""
+    connections = 0
+    
+    def __init__(self, outbox):
+        FakeSMTP.connections += 1
+        self.outbox = outbox
+    
+    def send_message(self, message):
+        if self.outbox.failures:
+            self.outbox.failures -= 1
+            raise smtplib.SMTPServerDisconnected("connection lost")
+        if message["To"] == "refused@example.com":
+            raise smtplib.SMTPRecipientsRefused({message["To"]: (550, b"no such user")})
+        self.outbox.append(message)
+    
+    def quit(self):
+        pass
+
+
+class Outbox(list):
+    failures = 0
+
+
+@pytest.fixture
+def outbox():
+    FakeSMTP.connections = 0
+    return Outbox()
+
+
+def test_default_template_ships_with_the_package(tmp_path):
+    # Found through importlib.resources, not relative to a source checkout
+    assert Path(str(rtm.TEMPLATE_DIR)).parent.parent == Path(rtm.__file__).parent
+    assert "$name" in rtm.TEMPLATE_DIR.joinpath("body.txt").read_text()
+
+    (tmp_path / "subject.txt").write_text("Config for $name\n")
+    (tmp_path / "body.txt").write_text("$vpn_ip\n")
+    assert rtm.load_template(str(tmp_path)) == rtm.EmailTemplate("Config for $name", "$vpn_ip\n")
+
+
+def test_build_message_renders_template():
+    template = rtm.load_template()
+    
+    message = rtm.build_message(make_peer(1), "[Interface]\n", "vpn@example.com", template)
+    
+    assert message["Subject"] == "Your VPN Setup File"
+    assert message.get_body().get_content().startswith("Hi user1!")
+    attachment = next(message.iter_attachments())
+    assert attachment.get_filename() == "user1_phone.conf"
+    assert attachment.get_content() == b"[Interface]\n"
+
+
+def test_mailer_reuses_connection_and_logs(outbox, tmp_path):
+    log_path = tmp_path / "sent.jsonl"
+    
+    with rtm.Mailer("vpn@example.com", lambda: FakeSMTP(outbox), rate_limit=None,
+                    messages_per_connection=10, log_path=str(log_path)) as mailer:
+        futures = [mailer.send(make_peer(i), f"config {i}") for i in range(25)]
+    
+    assert [f.result().status for f in futures] == ["sent"] * 25
+    assert [m["To"] for m in outbox] == [f"user{i}@example.com" for i in range(25)]
+    assert FakeSMTP.connections == 3
+    assert len(log_path.read_text().splitlines()) == 25
+    assert json.loads(log_path.read_text().splitlines()[0])["email"] == "user0@example.com"
+
+
+def test_mailer_retries_transient_failures(outbox):
+    outbox.failures = 2
+    
+    with rtm.Mailer("vpn@example.com", lambda: FakeSMTP(outbox), rate_limit=None, retry_delay=0) as mailer:
+        result = mailer.send(make_peer(1), "config").result()
+        refused = mailer.send(rtl.PeerInfo("Bob", "priv", "pub", "phone", "refused@example.com",
+                                           "10.0.0.9", "2024-12-03T00:00:00Z"), "config").result()
+    
+    assert (result.status, result.attempts) == ("sent", 3)
+    assert FakeSMTP.connections == 3
+    assert (refused.status, refused.attempts) == ("failed", 1)
+    assert "SMTPRecipientsRefused" in refused.error
+
+
+def test_mailer_rate_limit(outbox, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(rtm.time, "sleep", sleeps.append)
+    
+    with rtm.Mailer("vpn@example.com", lambda: FakeSMTP(outbox), rate_limit=2) as mailer:
+        for i in range(3):
+            mailer.send(make_peer(i), "config")
+    
+    assert len(outbox) == 3
+    assert len(sleeps) == 2
+    assert all(0 < s <= 0.5 for s in sleeps)
+
+
+def test_mailer_against_local_smtp_server():
+    controller_module = pytest.importorskip("aiosmtpd.controller")
+    handlers = pytest.importorskip("aiosmtpd.handlers")
+    
+    class Handler(handlers.Sink):
+        received = []
+        
+        async def handle_DATA(self, server, session, envelope):
+            self.received.append(envelope.rcpt_tos)
+            return "250 OK"
+    
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    controller = controller_module.Controller(Handler(), hostname="127.0.0.1", port=port)
+    controller.start()
+    try:
+        connect = rtm.smtp_factory("127.0.0.1", port, starttls=False)
+        with rtm.Mailer("vpn@example.com", connect, rate_limit=None) as mailer:
+            futures = [mailer.send(make_peer(i), "config") for i in range(3)]
+        assert [f.result().status for f in futures] == ["sent"] * 3
+        assert Handler.received == [[f"user{i}@example.com"] for i in range(3)]
+    finally:
+        controller.stop()
@@ -1,11 +1,42 @@
+import hashlib
+import io
+import pytest
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import remotetools.orchestration as rto
 import remotetools.remote as rtr
 import remotetools.local as rtl
 from fabric.connection import Connection
+from remotetools.fake_server import FakeConnection
 
-def mock_deploy_config(c, csv_path="peers.csv"):
+SERVER_STATE_OUTPUT = rtr.STATE_SEPARATOR.join([
+    "/etc/wireguard/private.key 1700000000 45 1\n/etc/wireguard/public.key 1700000000 45 2\n",
+    "\nfake_server_private_key\n",
+    "\nfake_server_public_key\n",
+    "\n",
+    "\n51820\n",
+])
+
+
+def mock_deploy_config(c, csv_path="peers.csv", **kwargs):
     pass  # Don't actually deploy during test
 
+
+class MockSftp:
+    """Collects files written over SFTP."""
+    def __init__(self):
+        self.files = {}
+
+    def open(self, path, mode="r"):
+        sftp = self
+        class MockFile(io.BytesIO):
+            def chmod(self, mode):
+                self.mode = mode
+            def close(self):
+                sftp.files[path] = self.getvalue()
+                super().close()
+        return MockFile()
+
 def test_add_peer(tmp_path, monkeypatch):
     csv_file = tmp_path / "test_peers.csv"
     
@@ -16,21 +47,15 @@ def test_add_peer(tmp_path, monkeypatch):
     def mock_retrieve_server_public_key(c):
         return "fake_server_public_key"
     
-    def mock_deploy_config(c, csv_path="peers.csv"):
+    def mock_deploy_config(c, csv_path="peers.csv", **kwargs):
         pass  # Don't actually deploy during test
-
-    def mock_get_all_peers():
-        return []
-
-    # Mock rtl.add_peer to use our temp CSV
-    def mock_add_peer(peer_record):
-        rtl.save_peer_to_csv(peer_record, str(csv_file))
     
+    monkeypatch.setattr(rtl, 'generate_wireguard_keypair', lambda: ("fake_private_key", "fake_public_key"))
     monkeypatch.setattr(rtr, 'generate_client_keypair', mock_generate_client_keypair)
     monkeypatch.setattr(rtr, 'retrieve_server_public_key', mock_retrieve_server_public_key)
     monkeypatch.setattr(rto, 'deploy_config', mock_deploy_config)
-    monkeypatch.setattr(rtl, 'add_peer', mock_add_peer)
-    monkeypatch.setattr(rtl, 'get_all_peers', mock_get_all_peers)    
+    # Use our temp CSV as the configured store
+    monkeypatch.setattr(rtl, '_peer_store', rtl.CsvPeerStore(str(csv_file)))
     
     # Create a mock connection (won't actually connect)
     c = Connection(host='test.example.com', user='testuser')
@@ -65,7 +90,7 @@ def test_remove_peer(tmp_path, monkeypatch):
     
     # Mock deploy_config to avoid remote calls
     deploy_called = []
-    def mock_deploy_config(c, csv_path="peers.csv"):
+    def mock_deploy_config(c, csv_path="peers.csv", **kwargs):
         deploy_called.append(True)
         
     def mock_remove_peer(name, device):
@@ -119,26 +144,40 @@ def test_deploy_config(tmp_path, monkeypatch):
         commands_run.append(cmd)
         # Mock response for reading private key
         class MockResult:
-            stdout = "fake_server_private_key\n"
+            stdout = "/tmp/tmp.Xq3fG1\n" if cmd == "mktemp -d" else SERVER_STATE_OUTPUT
         return MockResult()
     
     def mock_sudo(cmd, **kwargs):
         commands_run.append(cmd)
-        return None
+        # No wg0.conf on the server yet
+        class MockResult:
+            ok = False
+            stdout = ""
+        return MockResult()
     
     # Mock the connection methods
     c = Connection(host='test.example.com', user='testuser')
+    sftp = MockSftp()
     monkeypatch.setattr(c, 'run', mock_run)
     monkeypatch.setattr(c, 'sudo', mock_sudo)
+    monkeypatch.setattr(c, 'sftp', lambda: sftp)
     
     # Call deploy_config
     rto.deploy_config(c, csv_path=str(csv_file))
     
     # Verify commands were called
-    assert len(commands_run) >= 3
+    assert len(commands_run) >= 4
     assert "cat /etc/wireguard/private.key" in commands_run[0]
-    assert "tee /etc/wireguard/wg0.conf" in commands_run[1]
-    assert "wg syncconf" in commands_run[2] or "systemctl restart" in commands_run[2]
+    assert "sha256sum /etc/wireguard/wg0.conf" in commands_run[1]
+    assert commands_run[2] == "mktemp -d"
+    assert "mv /etc/wireguard/.wg0.conf.tmp /etc/wireguard/wg0.conf" in commands_run[3]
+    assert "wg syncconf" in commands_run[4] or "systemctl restart" in commands_run[4]
+    
+    # Verify the config went over SFTP, into the private temp directory, rather than the command line
+    [(path, uploaded)] = sftp.files.items()
+    assert path == "/tmp/tmp.Xq3fG1/wg0.conf"
+    assert b"PrivateKey = fake_server_private_key" in uploaded
+    assert not any("PrivateKey" in cmd for cmd in commands_run)
 
 
 
@@ -206,4 +245,257 @@ def test_deploy_config(tmp_path, monkeypatch):
 #     # Verify the public key can be derived from the private key
 #     derived_pub = c.sudo(f"cat /tmp/private.key | wg pubkey", hide=True, in_stream=False)
     
-#     assert derived_pub.stdout.strip() == public_key  
\ No newline at end of file
+#     assert derived_pub.stdout.strip() == public_key
+
+
+def test_add_peers(tmp_path, monkeypatch):
+    csv_file = tmp_path / "test_peers.csv"
+    rtl.save_peer_to_csv(rtl.PeerRecord("Alice", "alice_pubkey", "iPhone", "alice@example.com",
+                                        "10.0.0.2", "2024-12-03T00:00:00Z"), str(csv_file))
+    monkeypatch.setattr(rtl, '_peer_store', rtl.CsvPeerStore(str(csv_file)))
+    
+    keygen_calls = []
+    def mock_generate_client_keypairs(c, count):
+        keygen_calls.append(count)
+        return [(f"priv{i}", f"pub{i}") for i in range(count)]
+    
+    deploy_called = []
+    def mock_deploy_config(c, csv_path=None, **kwargs):
+        deploy_called.append(True)
+    
+    monkeypatch.setattr(rtr, 'generate_client_keypairs', mock_generate_client_keypairs)
+    monkeypatch.setattr(rtr, 'retrieve_server_public_key', lambda c: "fake_server_public_key")
+    monkeypatch.setattr(rto, 'deploy_config', mock_deploy_config)
+    
+    c = Connection(host='test.example.com', user='testuser')
+    results = rto.add_peers(c, [
+        ("Bob", "Laptop", "bob@example.com"),
+        ("Alice", "iPhone", "alice@example.com"),
+        ("Carol", "iPad", "carol@example.com"),
+    ], local_keys=False)
+    
+    # One keygen batch and one deploy for the whole request
+    assert keygen_calls == [2]
+    assert len(deploy_called) == 1
+    
+    assert results[("Alice", "iPhone")].error is not None
+    assert "priv0" in results[("Bob", "Laptop")].config
+    assert results[("Carol", "iPad")].peer_info.vpn_ip == "10.0.0.4"
+    
+    peers = rtl.load_peers(str(csv_file))
+    assert [p.vpn_ip for p in peers] == ["10.0.0.2", "10.0.0.3", "10.0.0.4"]
+
+
+def test_remove_peers(tmp_path, monkeypatch):
+    csv_file = tmp_path / "test_peers.csv"
+    for i, name in enumerate(["Alice", "Bob", "Carol"], start=2):
+        rtl.save_peer_to_csv(rtl.PeerRecord(name, f"{name}_pubkey", "Phone", f"{name}@example.com",
+                                            f"10.0.0.{i}", "2024-12-03T00:00:00Z"), str(csv_file))
+    monkeypatch.setattr(rtl, '_peer_store', rtl.CsvPeerStore(str(csv_file)))
+    
+    deploy_called = []
+    monkeypatch.setattr(rto, 'deploy_config', lambda c, csv_path=None, **kwargs: deploy_called.append(True))
+    
+    c = Connection(host='test.example.com', user='testuser')
+    results = rto.remove_peers(c, [("Alice", "Phone"), ("Dave", "Phone"), ("Carol", "Phone")])
+    
+    assert results == {("Alice", "Phone"): True, ("Dave", "Phone"): False, ("Carol", "Phone"): True}
+    assert len(deploy_called) == 1
+    assert [p.name for p in rtl.load_peers(str(csv_file))] == ["Bob"]
+
+
+def test_deploy_config_incremental(tmp_path):
+    csv_file = tmp_path / "test_peers.csv"
+    rtl.save_peer_to_csv(rtl.PeerRecord("Alice", "alice_pubkey", "iPhone", "alice@example.com",
+                                        "10.0.0.2", "2024-12-02T23:30:00Z"), str(csv_file))
+    running_config = rtr.generate_server_config([], "fake_server_private_key")
+    
+    commands_run = []
+    class MockResult:
+        def __init__(self, stdout=""):
+            self.stdout = stdout
+            self.ok = True
+    
+    def mock_run(cmd, **kwargs):
+        commands_run.append(cmd)
+        return MockResult(SERVER_STATE_OUTPUT)
+    
+    def mock_sudo(cmd, **kwargs):
+        commands_run.append(cmd)
+        if cmd == rtr.INTERFACE_SECTION_COMMAND:
+            return MockResult(rtr.interface_section(running_config))
+        if cmd == "wg show wg0 dump":
+            return MockResult("fake_server_private_key\tserver_pub\t51820\toff\n")
+        return MockResult()
+    
+    c = Connection(host='test.example.com', user='testuser')
+    c.run = mock_run
+    c.sudo = mock_sudo
+    c.sftp = MockSftp
+    
+    rto.deploy_config(c, csv_path=str(csv_file), incremental=True)
+    
+    assert "wg set wg0 peer alice_pubkey allowed-ips 10.0.0.2/32" in commands_run
+    assert not any("systemctl restart" in cmd for cmd in commands_run)
+    
+    # A changed [Interface] section still needs a restart
+    commands_run.clear()
+    rto.deploy_config(c, csv_path=str(csv_file), subnet="10.0.0.0/16", incremental=True)
+    
+    assert "systemctl restart wg-quick@wg0" in commands_run
+    assert not any(cmd.startswith("wg set") for cmd in commands_run)
+
+
+def test_configured_subnet_survives_later_calls(tmp_path):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    c = FakeConnection()
+    
+    # A subnet passed to one call only is not remembered, so a later deploy refuses
+    # to write an Address that would cut the peer off rather than restarting with it
+    rto.add_peer(c, "Alice", "iPhone", "alice@example.com", subnet="10.8.0.0/16", store=store)
+    assert "Address = 10.8.0.1/16" in c.server.config
+    with pytest.raises(ValueError, match="outside the VPN subnet 10.0.0.0/24"):
+        rto.deploy_config(c, store=store)
+    assert "Address = 10.8.0.1/16" in c.server.config
+    assert c.server.restarts == 1
+    
+    # Configured once, it applies to every call
+    rtl.set_vpn_subnet("10.8.0.0/16")
+    rto.add_peer(c, "Bob", "Laptop", "bob@example.com", store=store)
+    assert rto.remove_peer(c, "Alice", "iPhone", store=store)
+    assert "Address = 10.8.0.1/16" in c.server.config
+    assert "AllowedIPs = 10.8.0.3/32" in c.server.config
+
+
+def test_add_peer_remote_keys(tmp_path, monkeypatch):
+    monkeypatch.setattr(rtl, '_peer_store', rtl.CsvPeerStore(str(tmp_path / "test_peers.csv")))
+    monkeypatch.setattr(rtl, 'generate_wireguard_keypair', lambda: ("local_private_key", "local_public_key"))
+    monkeypatch.setattr(rtr, 'generate_client_keypair', lambda c: ("remote_private_key", "remote_public_key"))
+    monkeypatch.setattr(rtr, 'retrieve_server_public_key', lambda c: "fake_server_public_key")
+    monkeypatch.setattr(rto, 'deploy_config', mock_deploy_config)
+    
+    c = Connection(host='test.example.com', user='testuser')
+    
+    assert "local_private_key" in rto.add_peer(c, "Alice", "iPhone", "alice@example.com")
+    assert "remote_private_key" in rto.add_peer(c, "Bob", "Laptop", "bob@example.com", local_keys=False)
+
+
+def test_deploy_config_skips_unchanged(tmp_path, monkeypatch):
+    csv_file = tmp_path / "test_peers.csv"
+    rtl.save_peer_to_csv(rtl.PeerRecord("Alice", "alice_pubkey", "iPhone", "alice@example.com",
+                                        "10.0.0.2", "2024-12-02T23:30:00Z"), str(csv_file))
+    peers = rtl.load_peers(str(csv_file))
+    deployed = rtr.generate_server_config(peers, "fake_server_private_key").encode()
+    
+    commands_run = []
+    class MockResult:
+        ok = True
+        def __init__(self, stdout=""):
+            self.stdout = stdout
+    
+    def mock_sudo(cmd, **kwargs):
+        commands_run.append(cmd)
+        if cmd.startswith("sha256sum"):
+            return MockResult(f"{hashlib.sha256(deployed).hexdigest()}  /etc/wireguard/wg0.conf\n")
+        return MockResult()
+    
+    c = Connection(host='test.example.com', user='testuser')
+    monkeypatch.setattr(c, 'run', lambda cmd, **kwargs: MockResult(SERVER_STATE_OUTPUT))
+    monkeypatch.setattr(c, 'sudo', mock_sudo)
+    monkeypatch.setattr(c, 'sftp', MockSftp)
+    
+    assert rto.deploy_config(c, csv_path=str(csv_file)) is False
+    assert commands_run == ["sha256sum /etc/wireguard/wg0.conf"]
+
+
+def test_remove_peers_where(tmp_path, monkeypatch):
+    store = rtl.CsvPeerStore(str(tmp_path / "test_peers.csv"))
+    store.add_many([
+        rtl.PeerRecord("Alice", "key1", "iPhone", "alice@example.com", "10.0.0.2", "2024-12-03T00:00:00Z"),
+        rtl.PeerRecord("Alice", "key2", "Laptop", "alice@example.com", "10.0.0.3", "2024-12-03T00:00:00Z"),
+        rtl.PeerRecord("Bob", "key3", "iPhone", "bob@example.com", "10.0.0.4", "2024-12-03T00:00:00Z"),
+    ])
+    deploys = []
+    monkeypatch.setattr(rto, 'deploy_config', lambda c, **kwargs: deploys.append(kwargs))
+    c = Connection(host='test.example.com', user='testuser')
+    
+    removed = rto.remove_peers_where(c, email="alice@example.com", store=store)
+    
+    assert [p.device for p in removed] == ["iPhone", "Laptop"]
+    assert len(deploys) == 1
+    assert rto.remove_peers_where(c, email="nobody@example.com", store=store) == []
+    assert len(deploys) == 1
+    assert [p.name for p in store.all()] == ["Bob"]
+
+
+def add_peers_in_process(store_factory, path, worker, count):
+    """Process pool worker: add peers through the full add_peer path with a stubbed server."""
+    rtr.retrieve_server_public_key = lambda c: "fake_server_public_key"
+    rto.deploy_config = lambda c, *args, **kwargs: True
+    store = store_factory(path)
+    c = Connection(host='test.example.com', user='testuser')
+    return [rto.add_peer(c, f"user{worker}", f"device{i}", "user@example.com", store=store) is not None
+            for i in range(count)]
+
+
+@pytest.mark.parametrize("store_factory, filename", [
+    (rtl.CsvPeerStore, "peers.csv"),
+    (rtl.SqlitePeerStore, "peers.db"),
+])
+def test_add_peer_concurrent_processes(tmp_path, store_factory, filename):
+    path = str(tmp_path / filename)
+    workers, count = 4, 25
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(add_peers_in_process, store_factory, path, w, count) for w in range(workers)]
+        added = [ok for f in futures for ok in f.result()]
+    
+    peers = store_factory(path).all()
+    assert all(added)
+    assert len(peers) == workers * count
+    assert len({p.vpn_ip for p in peers}) == len(peers)
+    assert len({(p.name, p.device) for p in peers}) == len(peers)
+
+
+def test_sqlite_transaction_is_not_shared_between_threads(tmp_path):
+    store = rtl.SqlitePeerStore(str(tmp_path / "peers.db"))
+    store.add_many([rtl.PeerRecord("a", "key1", "d", "", "10.0.0.2", "")])
+    inside = threading.Event()
+    
+    def fail_in_transaction():
+        with pytest.raises(RuntimeError):
+            with store.locked():
+                store.add(rtl.PeerRecord("b", "key2", "d", "", "10.0.0.3", ""))
+                inside.set()
+                assert store.count() == 2
+                threading.Event().wait(0.2)  # give the other thread time to try its delete
+                raise RuntimeError("abort")
+    
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        aborted = pool.submit(fail_in_transaction)
+        inside.wait()
+        assert pool.submit(store.count).result() == 1  # not the uncommitted row
+        assert pool.submit(store.remove, "a", "d").result()
+        aborted.result()
+    
+    assert store.all() == []
+
+
+def test_add_peer_rejects_existing_peer_like_add_peers(tmp_path, monkeypatch):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    c = FakeConnection()
+    rto.add_peer(c, "Alice", "iPhone", "alice@example.com", store=store)
+    
+    with pytest.raises(ValueError, match="Peer Alice/iPhone already exists"):
+        rto.add_peer(c, "Alice", "iPhone", "alice@example.com", store=store)
+    results = rto.add_peers(c, [("Alice", "iPhone", "alice@example.com")], store=store)
+    assert results[("Alice", "iPhone")].error == "Peer Alice/iPhone already exists"
+    
+    # Another writer adding the same peer while keys are generated is caught under the lock
+    def racing_keypair():
+        store.add(rtl.PeerRecord("Bob", "other_key", "Laptop", "", "10.0.0.9", ""))
+        return "private", "public"
+    monkeypatch.setattr(rtl, 'generate_wireguard_keypair', racing_keypair)
+    with pytest.raises(ValueError, match="Peer Bob/Laptop already exists"):
+        rto.add_peer(c, "Bob", "Laptop", "bob@example.com", store=store)
+    assert [(p.name, p.vpn_ip) for p in store.all()] == [("Alice", "10.0.0.2"), ("Bob", "10.0.0.9")]
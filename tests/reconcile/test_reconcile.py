@@ -0,0 +1,113 @@
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.reconcile as rtc
+import remotetools.remote as rtr
+from fabric.connection import Connection
+
+
+def record(name, key, ip):
+    return rtl.PeerRecord(name, key, "iPhone", f"{name.lower()}@example.com", ip, "2024-12-03T00:00:00Z")
+
+
+SERVER_CONFIG = """[Interface]
+Address = 10.0.0.1/24
+PrivateKey = server_priv=
+
+[Peer]
+PublicKey = alice_pub=
+AllowedIPs = 10.0.0.2/32
+
+[Peer]
+# added by hand
+PublicKey = bob_pub=
+AllowedIPs = 10.0.0.9/32
+
+[Peer]
+PublicKey = mallory_pub=
+AllowedIPs = 10.0.0.4/32
+
+[Peer]
+PublicKey = stranger_pub=
+AllowedIPs = 10.0.0.7/32, fd00::7/128
+"""
+
+SERVER_DUMP = (
+    "server_priv=\tserver_pub=\t51820\toff\n"
+    "alice_pub=\t(none)\t(none)\t10.0.0.2/32\t0\t0\t0\toff\n"
+    "bob_pub=\t(none)\t(none)\t10.0.0.9/32\t0\t0\t0\toff\n"
+    "mallory_pub=\t(none)\t(none)\t10.0.0.4/32\t0\t0\t0\toff\n"
+)
+
+
+def test_parse_config_peers():
+    assert rtr.parse_config_peers(SERVER_CONFIG) == {
+        "alice_pub=": "10.0.0.2/32",
+        "bob_pub=": "10.0.0.9/32",
+        "mallory_pub=": "10.0.0.4/32",
+        "stranger_pub=": "10.0.0.7/32, fd00::7/128",
+    }
+
+
+def test_diff_peers():
+    records = [
+        record("Alice", "alice_pub=", "10.0.0.2"),
+        record("Bob", "bob_pub=", "10.0.0.3"),
+        record("Carol", "carol_pub=", "10.0.0.4"),
+        record("Dave", "dave_pub=", "10.0.0.5"),
+    ]
+    
+    drift = rtc.diff_peers(records, rtr.parse_config_peers(SERVER_CONFIG))
+    
+    assert [r.name for r in drift.missing] == ["Dave"]
+    assert [(r.name, ip) for r, ip in drift.ip_mismatches] == [("Bob", "10.0.0.9")]
+    assert [(r.name, key) for r, key in drift.key_mismatches] == [("Carol", "mallory_pub=")]
+    assert drift.orphans == {"stranger_pub=": "10.0.0.7/32, fd00::7/128"}
+    assert not drift.in_sync
+
+
+def test_reconcile_imports_orphans_and_pushes(tmp_path, monkeypatch):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    store.add(record("Alice", "alice_pub=", "10.0.0.2"))
+    commands = []
+    deploys = []
+    
+    class Result:
+        ok = True
+        stdout = SERVER_CONFIG + rtr.STATE_SEPARATOR + "\n" + SERVER_DUMP
+    
+    def mock_sudo(self, cmd, **kwargs):
+        commands.append(cmd)
+        return Result()
+    
+    monkeypatch.setattr(Connection, "sudo", mock_sudo)
+    monkeypatch.setattr(rto, "deploy_config", lambda c, **kwargs: deploys.append(kwargs) or True)
+    c = Connection(host="vpn.example.com", user="root")
+    
+    drift = rtc.reconcile(c, store=store, import_orphans=True, push=True)
+    
+    assert commands == [rtc.SERVER_PEERS_COMMAND]
+    assert set(drift.orphans) == {"bob_pub=", "mallory_pub=", "stranger_pub="}
+    assert drift.unapplied == {"stranger_pub="}
+    imported = {r.public_key: r.vpn_ip for r in store.all()[1:]}
+    assert imported == {"bob_pub=": "10.0.0.9", "mallory_pub=": "10.0.0.4", "stranger_pub=": "10.0.0.7"}
+    assert store.all()[1].name == "imported-bob_pub="
+    assert deploys[0]["store"] is store
+    
+    assert rtc.check_drift(c, store).orphans == {}
+
+
+def test_imported_orphans_with_similar_keys_fit_a_sqlite_store(tmp_path, monkeypatch):
+    store = rtl.SqlitePeerStore(str(tmp_path / "peers.db"))
+    keys = ["k7Hq2Xw9" + "A" * 35 + "=", "k7Hq2Xw9" + "B" * 35 + "="]
+    config = "[Interface]\nAddress = 10.0.0.1/24\n" + "".join(
+        f"\n[Peer]\nPublicKey = {key}\nAllowedIPs = 10.0.0.{i + 2}/32\n" for i, key in enumerate(keys))
+    
+    class Result:
+        ok = True
+        stdout = config + rtr.STATE_SEPARATOR + "\n"
+    
+    monkeypatch.setattr(Connection, "sudo", lambda self, cmd, **kwargs: Result())
+    rtc.reconcile(Connection(host="vpn.example.com", user="root"), store=store, import_orphans=True)
+    
+    assert [r.name for r in store.all()] == [f"imported-{key}" for key in keys]
+    assert all(r.created_utc.endswith("+00:00") for r in store.all())
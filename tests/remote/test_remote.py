@@ -1,9 +1,11 @@
+import io
 import remotetools.remote as rtr
 import remotetools.local as rtl
 from fabric import Connection
+from remotetools.fake_server import FakeConnection
 
 def test_generate_client_keypair():
-    c = Connection(host='46.62.216.199', user='root')
+    c = FakeConnection(host='46.62.216.199', user='root')
     
     private_key, public_key = rtr.generate_client_keypair(c)
     
@@ -13,7 +15,7 @@ def test_generate_client_keypair():
 
 
 def test_retrieve_server_public_key():
-    c = Connection(host='46.62.216.199', user='root')
+    c = FakeConnection(host='46.62.216.199', user='root')
     
     public_key = rtr.retrieve_server_public_key(c)
     
@@ -35,4 +37,256 @@ def test_generate_peer_section():
     
     assert "[Peer]" in section
     assert "test_pubkey_123" in section
-    assert "10.0.0.2/32" in section
\ No newline at end of file
+    assert "10.0.0.2/32" in section
+
+
+def test_generate_server_config_follows_subnet():
+    peer = rtl.PeerRecord(
+        name="Alice",
+        public_key="test_pubkey_123",
+        device="iPhone",
+        email="alice@example.com",
+        vpn_ip="10.8.3.7",
+        created_utc="2024-12-02T23:30:00Z"
+    )
+    
+    config = rtr.generate_server_config([peer], "server_private_key", subnet="10.8.0.0/16")
+    
+    assert "Address = 10.8.0.1/16" in config
+    assert "AllowedIPs = 10.8.3.7/32" in config
+
+
+def test_parse_wg_dump_and_peer_update_commands():
+    dump = (
+        "server_priv\tserver_pub\t51820\toff\n"
+        "keep_pub\t(none)\t1.2.3.4:5555\t10.0.0.2/32\t1700000000\t100\t200\toff\n"
+        "moved_pub\t(none)\t(none)\t10.0.0.3/32\t0\t0\t0\toff\n"
+        "gone_pub\t(none)\t(none)\t10.0.0.4/32\t0\t0\t0\toff\n"
+    )
+    running = rtr.parse_wg_dump(dump)
+    assert running == {"keep_pub": "10.0.0.2/32", "moved_pub": "10.0.0.3/32", "gone_pub": "10.0.0.4/32"}
+    
+    desired = {"keep_pub": "10.0.0.2/32", "moved_pub": "10.0.0.5/32", "new_pub": "10.0.0.6/32"}
+    commands = rtr.peer_update_commands(desired, running)
+    
+    assert commands == [
+        "wg set wg0 peer moved_pub allowed-ips 10.0.0.5/32 peer new_pub allowed-ips 10.0.0.6/32 peer gone_pub remove"
+    ]
+    assert len(rtr.peer_update_commands(desired, running, batch_size=1)) == 3
+    assert rtr.peer_update_commands(running, running) == []
+
+
+def test_server_state_is_cached_and_revalidated(monkeypatch):
+    state_output = rtr.STATE_SEPARATOR.join([
+        "/etc/wireguard/private.key 1700000000 45 1\n/etc/wireguard/public.key 1700000000 45 2\n",
+        "\nserver_private\n",
+        "\nserver_public\n",
+        "\n2: eth0: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 state UP\n    inet 46.62.216.199/32 scope global eth0\n",
+        "\n51820\n",
+    ])
+    fingerprint = state_output.split(rtr.STATE_SEPARATOR)[0]
+    commands_run = []
+    
+    class MockResult:
+        ok = True
+        def __init__(self, stdout):
+            self.stdout = stdout
+    
+    def mock_run(cmd, **kwargs):
+        commands_run.append(cmd)
+        return MockResult(fingerprint if cmd == rtr.FINGERPRINT_COMMAND else state_output)
+    
+    c = Connection(host='cache.example.com', user='root')
+    monkeypatch.setattr(c, 'run', mock_run)
+    rtr.invalidate_server_state(c)
+    
+    state = rtr.get_server_state(c)
+    assert (state.private_key, state.public_key) == ("server_private", "server_public")
+    assert state.interface == "eth0"
+    assert state.listen_port == 51820
+    
+    # Fresh entries cost no round-trips at all
+    assert rtr.retrieve_server_public_key(c) == "server_public"
+    assert rtr.retrieve_server_private_key(c) == "server_private"
+    assert len(commands_run) == 1
+    
+    # Stale entries are revalidated with a single stat and kept if unchanged
+    rtr.get_server_state(c, max_age=0)
+    assert len(commands_run) == 2
+    assert commands_run[1] == rtr.FINGERPRINT_COMMAND
+    
+    # A key change is noticed and triggers a full reload
+    fingerprint = "changed"
+    rtr.get_server_state(c, max_age=0)
+    assert len(commands_run) == 4
+    
+    rtr.invalidate_server_state(c)
+
+
+def test_iter_server_config_streams_from_generator():
+    def peers():
+        for i in range(1000):
+            yield rtl.PeerRecord(f"User{i}", f"pubkey{i}", "Phone", f"user{i}@example.com",
+                                 f"10.8.{i // 256}.{i % 256}", "2024-12-02T23:30:00Z")
+    
+    chunks = list(rtr.iter_server_config(peers(), "server_private_key", subnet="10.8.0.0/16"))
+    
+    # Interface section plus four chunks of at most 256 peers
+    assert len(chunks) == 5
+    assert "".join(chunks) == rtr.generate_server_config(list(peers()), "server_private_key", "10.8.0.0/16")
+    
+    sink = io.StringIO()
+    written = rtr.write_server_config(sink, peers(), "server_private_key", "10.8.0.0/16")
+    assert sink.getvalue() == "".join(chunks)
+    assert written == len(sink.getvalue())
+
+
+def test_upload_config_streams_chunks():
+    writes = []
+    commands_run = []
+    
+    class MockFile:
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            pass
+        def set_pipelined(self, pipelined=True):
+            pass
+        def write(self, data):
+            writes.append(data)
+    
+    class MockResult:
+        ok = False
+        stdout = ""
+    
+    class MockConnection:
+        host = "test.example.com"
+        def sftp(self):
+            return self
+        def open(self, path, mode):
+            # Uploads go into the private directory made by mktemp -d, never straight into /tmp
+            assert path == "/tmp/tmp.Xq3fG1/wg0.conf"
+            return MockFile()
+        def run(self, cmd, **kwargs):
+            commands_run.append(cmd)
+            result = MockResult()
+            result.stdout = "/tmp/tmp.Xq3fG1\n"
+            return result
+        def sudo(self, cmd, **kwargs):
+            commands_run.append(cmd)
+            return MockResult()
+    
+    changed = rtr.upload_config(MockConnection(), lambda: iter(["[Interface]\n", "[Peer]\n", "[Peer]\n"]))
+    
+    assert changed is True
+    assert writes == [b"[Interface]\n", b"[Peer]\n", b"[Peer]\n"]
+    assert commands_run[0] == "sha256sum /etc/wireguard/wg0.conf"
+    assert commands_run[1] == "mktemp -d"
+    assert "mv /etc/wireguard/.wg0.conf.tmp /etc/wireguard/wg0.conf" in commands_run[2]
+    assert "rmdir /tmp/tmp.Xq3fG1" in commands_run[2]
+
+
+IP_JSON_OUTPUT = """[
+{"ifindex":1,"ifname":"lo","flags":["LOOPBACK","UP","LOWER_UP"],"mtu":65536,"operstate":"UNKNOWN",
+ "addr_info":[{"family":"inet","local":"127.0.0.1","prefixlen":8},{"family":"inet6","local":"::1","prefixlen":128}]},
+{"ifindex":2,"ifname":"ens3","flags":["BROADCAST","MULTICAST","UP","LOWER_UP"],"mtu":1500,"operstate":"UP",
+ "addr_info":[{"family":"inet","local":"46.62.216.199","prefixlen":32},
+              {"family":"inet6","local":"2a01:4f9:c012:1::1","prefixlen":64},
+              {"family":"inet6","local":"fe80::1","prefixlen":64}]},
+{"ifindex":3,"ifname":"ens4","flags":["BROADCAST","MULTICAST","UP","LOWER_UP"],"mtu":1450,"operstate":"UP",
+ "addr_info":[{"family":"inet","local":"100.64.0.5","prefixlen":10}]},
+{"ifindex":4,"ifname":"veth0","link_index":5,"flags":["BROADCAST","MULTICAST","UP","LOWER_UP"],"mtu":1500,"operstate":"UP",
+ "addr_info":[{"family":"inet","local":"172.17.0.1","prefixlen":16}]},
+{"ifindex":6,"ifname":"wg0","flags":["POINTOPOINT","NOARP","UP","LOWER_UP"],"mtu":1420,"operstate":"UNKNOWN",
+ "addr_info":[{"family":"inet","local":"10.0.0.1","prefixlen":24}]}
+]"""
+
+IP_TEXT_OUTPUT = """1: lo: <LOOPBACK,UP,LOWER_UP> mtu 65536 qdisc noqueue state UNKNOWN group default qlen 1000
+    inet 127.0.0.1/8 scope host lo
+2: ens3: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc fq_codel state UP group default qlen 1000
+    inet 46.62.216.199/32 metric 100 scope global dynamic ens3
+    inet6 2a01:4f9:c012:1::1/64 scope global
+3: veth0@if5: <BROADCAST,MULTICAST,UP,LOWER_UP> mtu 1500 qdisc noqueue state UP group default
+    inet 172.17.0.1/16 scope global veth0
+4: eth1: <BROADCAST,MULTICAST> mtu 1500 qdisc noop state DOWN group default qlen 1000
+"""
+
+
+def test_parse_ip_json_keeps_only_global_addresses():
+    interfaces = {i.name: i for i in rtr.parse_interfaces(IP_JSON_OUTPUT)}
+    
+    assert interfaces["ens3"].ipv4 == ["46.62.216.199"]
+    assert interfaces["ens3"].ipv6 == ["2a01:4f9:c012:1::1"]
+    assert interfaces["ens3"].mtu == 1500
+    assert interfaces["ens4"].ipv4 == []  # CGNAT
+    assert interfaces["veth0"].ipv4 == []
+    assert rtr.get_public_interfaces(IP_JSON_OUTPUT) == (1, ["ens3"])
+
+
+def test_parse_ip_text_fallback_matches_json():
+    interfaces = {i.name: i for i in rtr.parse_interfaces(IP_TEXT_OUTPUT)}
+    
+    assert set(interfaces) == {"lo", "ens3", "veth0", "eth1"}
+    assert interfaces["ens3"].state == "UP"
+    assert interfaces["ens3"].ipv6 == ["2a01:4f9:c012:1::1"]
+    assert interfaces["eth1"].state == "DOWN"
+    assert rtr.get_public_interfaces(IP_TEXT_OUTPUT) == (1, ["ens3"])
+
+
+def test_server_config_uses_detected_interface():
+    config = rtr.generate_server_config([], "server_private_key", interface="ens3")
+    
+    assert "POSTROUTING -o ens3 -j MASQUERADE" in config
+    assert "eth0" not in config
+
+
+def telemetry_dump(peers):
+    lines = ["wg0\tserver_priv\tserver_pub\t51820\toff"]
+    for key, endpoint, handshake, rx, tx in peers:
+        lines.append(f"wg0\t{key}\t(none)\t{endpoint}\t10.0.0.2/32\t{handshake}\t{rx}\t{tx}\toff")
+    return "\n".join(lines) + "\n"
+
+
+def test_telemetry_collector_rates_and_queries(monkeypatch):
+    class Result:
+        def __init__(self, stdout):
+            self.stdout = stdout
+    
+    dumps = [
+        telemetry_dump([("alice_pub", "1.2.3.4:5555", 1000, 100, 200),
+                        ("bob_pub", "(none)", 0, 0, 0),
+                        ("carol_pub", "5.6.7.8:9", 1000, 5000, 5000)]),
+        telemetry_dump([("alice_pub", "1.2.3.4:5555", 1000, 1100, 2200),
+                        ("bob_pub", "(none)", 0, 0, 0),
+                        ("carol_pub", "5.6.7.8:9", 90000, 10, 10)]),
+    ]
+    
+    class MockConnection:
+        host = "vpn.example.com"
+        
+        def sudo(self, cmd, **kwargs):
+            assert cmd == rtr.TELEMETRY_COMMAND
+            return Result(dumps.pop(0))
+    
+    store = rtl.CsvPeerStore("unused.csv")
+    alice = rtl.PeerRecord("Alice", "alice_pub", "iPhone", "alice@example.com", "10.0.0.2", "2024-12-02T23:30:00Z")
+    monkeypatch.setattr(store, "iter", lambda: iter([alice]))
+    clock = iter([100.0, 110.0])
+    monkeypatch.setattr(rtr.time, "time", lambda: next(clock))
+    
+    collector = rtr.TelemetryCollector(MockConnection(), store=store)
+    collector.poll()
+    assert collector.top_talkers(1)[0].rx_rate == 0.0
+    sample = collector.poll()
+    
+    assert len(sample) == 3
+    alice_activity = collector.peer("alice_pub")
+    assert (alice_activity.rx_rate, alice_activity.tx_rate) == (100.0, 200.0)
+    assert alice_activity.peer == alice
+    assert collector.peer("bob_pub").endpoint is None
+    assert collector.peer("carol_pub").rx_rate == 1.0  # counters reset
+    assert [a.public_key for a in collector.top_talkers(2)] == ["alice_pub", "carol_pub"]
+    
+    stale = collector.stale(hours=1, now=90000 + 1800)
+    assert [a.public_key for a in stale] == ["alice_pub", "bob_pub"]
+    assert [a.public_key for a in collector.stale(hours=1, now=90000 + 1800, include_never=False)] == ["alice_pub"]
@@ -0,0 +1,104 @@
+import threading
+import time
+import pytest
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.remote as rtr
+import remotetools.scheduler as rts
+from fabric.connection import Connection
+
+
+class RecordingDeploy:
+    def __init__(self, delay=0.0, error=None):
+        self.calls = []
+        self.delay = delay
+        self.error = error
+        self.lock = threading.Lock()
+    
+    def __call__(self, c, **kwargs):
+        with self.lock:
+            self.calls.append((c.host, kwargs))
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return True
+
+
+def test_requests_within_window_share_one_deploy():
+    deploy = RecordingDeploy()
+    scheduler = rts.DeployScheduler(window=0.2, deploy=deploy)
+    c = Connection(host="vpn1.example.com", user="root")
+    other = Connection(host="vpn2.example.com", user="root")
+    
+    futures = [scheduler.request(c, incremental=True) for _ in range(50)]
+    futures.append(scheduler.request(other))
+    
+    assert all(f.result(timeout=5) is True for f in futures)
+    assert sorted(host for host, _ in deploy.calls) == ["vpn1.example.com", "vpn2.example.com"]
+    assert (scheduler.requests, scheduler.deploys) == (51, 2)
+
+
+def test_max_batch_deploys_early_and_flush_drains():
+    deploy = RecordingDeploy()
+    scheduler = rts.DeployScheduler(window=60, max_batch=10, deploy=deploy)
+    c = Connection(host="vpn1.example.com", user="root")
+    
+    first = [scheduler.request(c) for _ in range(10)]
+    assert all(f.result(timeout=5) for f in first)
+    
+    rest = [scheduler.request(c) for _ in range(3)]
+    assert not any(f.done() for f in rest)
+    scheduler.flush()
+    
+    assert all(f.result(timeout=0) for f in rest)
+    assert len(deploy.calls) == 2
+
+
+def test_requests_after_a_full_batch_wait_for_their_window():
+    deploy = RecordingDeploy(delay=0.1)
+    scheduler = rts.DeployScheduler(window=1.0, max_batch=3, deploy=deploy)
+    c = Connection(host="vpn1.example.com", user="root")
+    
+    futures = [scheduler.request(c) for _ in range(4)]
+    time.sleep(0.01)
+    futures.append(scheduler.request(c))
+    
+    assert all(f.result(timeout=5) for f in futures[:3])
+    time.sleep(0.3)
+    assert len(deploy.calls) == 1
+    assert not any(f.done() for f in futures[3:])
+    scheduler.flush()
+    assert len(deploy.calls) == 2
+
+
+def test_deploy_failure_reaches_every_caller():
+    scheduler = rts.DeployScheduler(window=0.05, deploy=RecordingDeploy(error=RuntimeError("restart failed")))
+    c = Connection(host="vpn1.example.com", user="root")
+    
+    futures = [scheduler.request(c) for _ in range(3)]
+    
+    for f in futures:
+        with pytest.raises(RuntimeError):
+            f.result(timeout=5)
+
+
+def test_scheduler_add_and_remove_peer(tmp_path, monkeypatch):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    deploy = RecordingDeploy()
+    monkeypatch.setattr(rtr, 'retrieve_server_public_key', lambda c: "fake_server_public_key")
+    monkeypatch.setattr(rto, 'deploy_config', deploy)
+    c = Connection(host="vpn1.example.com", user="root")
+    
+    with rts.DeployScheduler(window=60) as scheduler:
+        results = [scheduler.add_peer(c, f"User{i}", "iPhone", "user@example.com", store=store) for i in range(5)]
+        found, removed = scheduler.remove_peer(c, "User0", "iPhone", store=store)
+        missing = scheduler.remove_peer(c, "Nobody", "iPhone", store=store)
+        assert deploy.calls == []
+    
+    assert all("[Interface]" in config for config, _ in results)
+    assert all(future.result(timeout=0) for _, future in results)
+    assert found and removed.result(timeout=0)
+    assert missing == (False, None)
+    assert len(deploy.calls) == 1
+    assert deploy.calls[0][1]["store"] is store
+    assert [p.name for p in store.all()] == ["User1", "User2", "User3", "User4"]
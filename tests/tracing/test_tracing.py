@@ -0,0 +1,133 @@
+import json
+import pytest
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.remote as rtr
+import remotetools.tracing as rtt
+from invoke.exceptions import UnexpectedExit
+
+
+class MockResult:
+    def __init__(self, stdout="", exited=0):
+        self.stdout = stdout
+        self.stderr = ""
+        self.exited = exited
+        self.ok = exited == 0
+        self.command = ""
+        self.hide = ()
+        self.pty = False
+        self.encoding = "utf-8"
+
+
+class MockConnection:
+    host = "trace.example.com"
+    user = "root"
+    port = 22
+
+    def run(self, cmd, **kwargs):
+        return self.sudo(cmd)
+
+    def sudo(self, cmd, **kwargs):
+        if cmd == rtr.STATE_COMMAND:
+            return MockResult(rtr.STATE_SEPARATOR.join(["keys 1 2 3", "server_private", "server_public", "", "51820"]))
+        if cmd.startswith("sha256sum"):
+            return MockResult("", exited=1)
+        if cmd.startswith("systemctl"):
+            raise UnexpectedExit(MockResult("", exited=3))
+        return MockResult()
+
+    def sftp(self):
+        return self
+
+    def open(self, path, mode):
+        class File:
+            def __enter__(self):
+                return self
+            def __exit__(self, *args):
+                pass
+            def chmod(self, mode):
+                pass
+            def write(self, data):
+                pass
+        return File()
+
+
+@pytest.fixture
+def sink():
+    sink = rtt.MemorySink()
+    rtt.add_sink(sink)
+    yield sink
+    rtt.remove_sink(sink)
+
+
+def test_add_peer_operation_breakdown(tmp_path, sink):
+    store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+    
+    with pytest.raises(UnexpectedExit):
+        rto.add_peer(MockConnection(), "Alice", "iPhone", "alice@example.com", store=store)
+    
+    [operation] = sink.operations
+    assert operation.name == "add_peer"
+    assert operation.host == "trace.example.com"
+    assert operation.error.startswith("UnexpectedExit")
+    
+    names = [span.name for span in operation.spans]
+    for expected in ["allocate ip", "generate keypair", "save peer", "stat -c",
+                     "hash config", "sha256sum /etc/wireguard/wg0.conf", "sftp upload",
+                     "systemctl restart", "deploy_config"]:
+        assert expected in names
+    
+    # Every span is tied to the operation and remote commands carry their host
+    assert all(span.operation == "add_peer" for span in operation.spans)
+    restart = next(span for span in operation.spans if span.name == "systemctl restart")
+    assert restart.host == "trace.example.com"
+    assert restart.exit_status == 3
+    assert restart.error is not None
+    upload = next(span for span in operation.spans if span.name == "sftp upload")
+    assert upload.bytes_sent > 0
+    
+    assert list(operation.breakdown())[0] in names
+    assert operation.report().startswith("add_peer on trace.example.com")
+
+
+def test_json_lines_sink(tmp_path):
+    path = tmp_path / "trace.jsonl"
+    sink = rtt.JsonLinesSink(str(path))
+    rtt.add_sink(sink)
+    try:
+        c = rtt.traced(MockConnection())
+        c.run("wg show wg0 dump")
+        with rtt.span("local step"):
+            pass
+    finally:
+        rtt.remove_sink(sink)
+    
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [r["name"] for r in records] == ["wg show", "local step"]
+    assert records[0]["command"] == "wg show wg0 dump"
+    assert records[0]["exit_status"] == 0
+    assert records[1]["host"] is None
+
+
+def test_no_key_material_reaches_sinks(tmp_path, sink):
+    from remotetools.fake_server import FakeConnection
+    
+    path = tmp_path / "trace.jsonl"
+    json_sink = rtt.JsonLinesSink(str(path))
+    rtt.add_sink(json_sink)
+    try:
+        c = FakeConnection()
+        store = rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+        config = rto.add_peer(c, "Alice", "iPhone", "alice@example.com", store=store, local_keys=False)
+        with pytest.raises(UnexpectedExit):
+            rtt.traced(c).run("echo -n 'not-a-key' | wg pubkey")
+    finally:
+        rtt.remove_sink(json_sink)
+    
+    client_key = next(line.split("=", 1)[1].strip() for line in config.splitlines() if line.startswith("PrivateKey"))
+    trace = path.read_text()
+    assert "echo ***" in trace
+    for secret in [client_key, c.server.private_key, "not-a-key"]:
+        assert secret not in trace
+        assert not any(secret in repr(span) for span in sink.spans)
+        assert not any(secret in (operation.error or "") for operation in sink.operations)
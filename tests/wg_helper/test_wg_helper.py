@@ -0,0 +1,91 @@
+import json
+import subprocess
+import sys
+import pytest
+import remotetools.local as rtl
+import remotetools.orchestration as rto
+import remotetools.remote as rtr
+import remotetools.wg_helper as rth
+from remotetools.fake_server import FakeConnection
+
+
+@pytest.fixture
+def store(tmp_path):
+    return rtl.CsvPeerStore(str(tmp_path / "peers.csv"))
+
+
+def test_split_and_join_config_round_trip():
+    peers = [rtl.PeerRecord(f"User{i}", f"key{i}", "Phone", "", f"10.0.0.{i + 2}", "") for i in range(3)]
+    config = rtr.generate_server_config(peers, "server_private_key")
+    head, sections = rth.split_config(config)
+
+    assert rth.join_config(head, sections) == config
+    assert sections[1] == rtr.generate_peer_section(peers[1])
+    assert rth.section_peer(sections[1]) == ("key1", "10.0.0.3/32")
+    assert rth.join_config(head, sections[:1] + sections[2:]) == rtr.generate_server_config(
+        peers[:1] + peers[2:], "server_private_key")
+
+
+def test_add_and_remove_peers_in_one_round_trip(store):
+    c = FakeConnection()
+    rto.add_peer(c, "Alice", "iPhone", "alice@example.com", store=store, helper=True)  # installs the helper
+    c.reset_counters()
+
+    config = rto.add_peer(c, "Bob", "Laptop", "bob@example.com", store=store, helper=True)
+    assert c.round_trips == 1
+    assert c.commands == [rtr.HELPER_COMMAND]
+    assert f"PublicKey = {c.server.public_key}" in config
+    assert len(c.server.peers) == 2
+    assert c.server.restarts == 1
+
+    c.reset_counters()
+    assert rto.remove_peer(c, "Alice", "iPhone", store=store, helper=True)
+    assert c.round_trips == 1
+    assert len(c.server.peers) == 1
+
+    # The helper's edits leave exactly the config a full deploy would write
+    assert rto.deploy_config(c, store=store) is False
+
+
+def test_helper_deploys_full_config_on_a_fresh_server(store):
+    c = FakeConnection()
+    results = rto.add_peers(c, [("Alice", "iPhone", "alice@example.com"), ("Bob", "Laptop", "bob@example.com")],
+                            store=store, helper=True)
+
+    assert all(result.config for result in results.values())
+    assert c.server.config.count("[Peer]") == 2
+    assert c.server.modes[rtr.CONFIG_PATH] == 0o600
+    assert not any(path.startswith("/tmp/") for path in c.server.files)
+    assert not c.server.dirs
+    assert rto.deploy_config(c, store=store, helper=True) is False
+
+
+def test_outdated_helper_is_reinstalled(store):
+    c = FakeConnection()
+    c.server.write(rtr.HELPER_PATH, "VERSION = 0\n")
+
+    [result] = rtr.call_helper(c, [{"op": "version"}])
+    assert result == {"version": rth.VERSION}
+    assert f"VERSION = {rth.VERSION}" in c.server.read(rtr.HELPER_PATH)
+
+    with pytest.raises(RuntimeError, match="unknown op"):
+        rtr.call_helper(c, [{"op": "explode"}])
+
+
+def test_local_system_writes_atomically(tmp_path):
+    system = rth.LocalSystem()
+    path = str(tmp_path / "wg0.conf")
+    system.write(path, "[Interface]\n")
+
+    assert system.read(path) == "[Interface]\n"
+    assert (tmp_path / "wg0.conf").stat().st_mode & 0o777 == 0o600
+    assert list(tmp_path.iterdir()) == [tmp_path / "wg0.conf"]
+    system.remove(path)
+    assert system.read(path) is None
+
+
+def test_script_answers_version_mismatch():
+    process = subprocess.run([sys.executable, rth.__file__], input=json.dumps({"version": -1, "ops": []}),
+                             capture_output=True, text=True)
+    assert process.returncode == rth.EXIT_OUTDATED
+    assert json.loads(process.stdout) == {"version": rth.VERSION, "error": "version mismatch"}